@@ -0,0 +1,113 @@
+"""
+Parity and speed benchmark for the grid-backed label placement in util/box_annotator.py.
+
+python benchmarks/bench_box_annotator.py --sizes 50 200 1000 --repeat 3
+
+`get_optimal_label_pos_reference` is the original placement that scanned every
+detection for each candidate label position. Parity compares the annotated
+frames pixel by pixel.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from contextlib import contextmanager
+
+import numpy as np
+import supervision as sv
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util import box_annotator
+from util.box_annotator import BoxAnnotator, IoU
+
+
+def get_optimal_label_pos_reference(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, occupancy=None):
+    def get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size):
+        is_overlap = False
+        for i in range(len(detections)):
+            detection = detections.xyxy[i].astype(int)
+            if IoU([text_background_x1, text_background_y1, text_background_x2, text_background_y2], detection) > 0.3:
+                is_overlap = True
+                break
+        if text_background_x1 < 0 or text_background_x2 > image_size[0] or text_background_y1 < 0 or text_background_y2 > image_size[1]:
+            is_overlap = True
+        return is_overlap
+
+    candidates = [
+        # top left
+        (x1 + text_padding, y1 - text_padding, x1, y1 - 2 * text_padding - text_height, x1 + 2 * text_padding + text_width, y1),
+        # outer left
+        (x1 - text_padding - text_width, y1 + text_padding + text_height, x1 - 2 * text_padding - text_width, y1, x1, y1 + 2 * text_padding + text_height),
+        # outer right
+        (x2 + text_padding, y1 + text_padding + text_height, x2, y1, x2 + 2 * text_padding + text_width, y1 + 2 * text_padding + text_height),
+        # top right
+        (x2 - text_padding - text_width, y1 - text_padding, x2 - 2 * text_padding - text_width, y1 - 2 * text_padding - text_height, x2, y1),
+    ]
+    for candidate in candidates:
+        if not get_is_overlap(detections, *candidate[2:], image_size):
+            return candidate
+    return candidates[-1]
+
+
+@contextmanager
+def reference_placement():
+    original = box_annotator.get_optimal_label_pos
+    box_annotator.get_optimal_label_pos = get_optimal_label_pos_reference
+    try:
+        yield
+    finally:
+        box_annotator.get_optimal_label_pos = original
+
+
+def random_detections(num_boxes, width, height, seed):
+    """Icon-sized boxes scattered over a screen, with some dense toolbar-like rows."""
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(num_boxes):
+        w, h = rng.randint(12, 120), rng.randint(12, 60)
+        if rng.random() < 0.3:
+            y = rng.choice([0, 40, height - 48])
+        else:
+            y = rng.randint(0, height - h)
+        x = rng.randint(0, width - w)
+        boxes.append([x, y, x + w, min(y + h, height)])
+    return sv.Detections(xyxy=np.array(boxes, dtype=np.float64))
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Box annotator label placement benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 1000], help='Number of boxes per screen')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions, best is reported')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+
+    annotator = BoxAnnotator(text_scale=0.4, text_padding=3, text_thickness=1, thickness=2)
+    frame = np.full((args.height, args.width, 3), 255, dtype=np.uint8)
+    print(f"{'boxes':>6} {'reference (ms)':>15} {'grid (ms)':>10} {'speedup':>8} parity")
+    for size in args.sizes:
+        detections = random_detections(size, args.width, args.height, seed=size)
+        labels = [str(i) for i in range(size)]
+
+        def run():
+            return annotator.annotate(scene=frame.copy(), detections=detections, labels=labels, image_size=(args.width, args.height))
+
+        with reference_placement():
+            reference_time, reference_frame = timeit(run, args.repeat)
+        grid_time, grid_frame = timeit(run, args.repeat)
+        parity = np.array_equal(reference_frame, grid_frame)
+        print(f"{size:>6} {reference_time * 1000:>15.2f} {grid_time * 1000:>10.2f} {reference_time / grid_time:>7.1f}x {parity}")
+
+
+if __name__ == '__main__':
+    main()
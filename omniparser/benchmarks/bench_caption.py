@@ -0,0 +1,90 @@
+"""
+Caption throughput and quality per backend / decoding preset, see util/caption_backend.py.
+
+python benchmarks/bench_caption.py --caption_model_path ../weights/icon_caption_florence --image screenshot.png \
+    --som_model_path ../weights/icon_detect/model.pt --configs pytorch:default pytorch:greedy int8:greedy onnx:greedy
+
+Icons are the YOLO detections of --image when --som_model_path is given, otherwise
+a grid of toolbar / button crops from the synthetic frame. The first config is the
+reference: for every other one the share of identical captions and the mean token
+F1 against it are reported, next to icons/sec. Runs on cpu.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+import torch
+from PIL import Image
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'benchmarks'))
+from bench_image_codec import synthetic_screen
+from util.utils import get_caption_model_processor, get_yolo_model, get_yolo_detections, caption_icon_crops
+from util.icon_crop import crop_icon_batch
+
+
+def token_f1(a: str, b: str) -> float:
+    a_tokens, b_tokens = a.lower().split(), b.lower().split()
+    if not a_tokens or not b_tokens:
+        return float(a_tokens == b_tokens)
+    common = sum((Counter(a_tokens) & Counter(b_tokens)).values())
+    if not common:
+        return 0.0
+    precision, recall = common / len(b_tokens), common / len(a_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def icon_boxes(image, som_model_path, box_threshold):
+    w, h = image.size
+    if som_model_path:
+        xyxy, _, _ = get_yolo_detections(image, get_yolo_model(som_model_path), BOX_TRESHOLD=box_threshold, scale_img=False)
+        return xyxy / torch.tensor([w, h, w, h])
+    # toolbar icons and buttons of the synthetic frame
+    boxes = [[8 + i * 44, 8, 40 + i * 44, 40] for i in range(24)] + [[900 + i * 130, 70 + j * 60, 1020 + i * 130, 102 + j * 60] for i in range(6) for j in range(8)]
+    return torch.tensor(boxes, dtype=torch.float32) / torch.tensor([w, h, w, h])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Caption backend benchmark')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, required=True)
+    parser.add_argument('--configs', type=str, nargs='+', default=['pytorch:default', 'pytorch:greedy:early', 'int8:greedy', 'int8:greedy:early', 'onnx:greedy:early'], help="backend:preset[:early] entries, ':early' enables the early-exit scheduler; the first one is the reference")
+    parser.add_argument('--image', type=str, default=None)
+    parser.add_argument('--som_model_path', type=str, default=None)
+    parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=2, help='Timing repetitions, best is reported')
+    args = parser.parse_args()
+
+    image = (Image.open(args.image) if args.image else synthetic_screen()).convert('RGB')
+    boxes = icon_boxes(image, args.som_model_path, args.BOX_TRESHOLD)
+    crops = crop_icon_batch(np.asarray(image), boxes, size=64, device='cpu')
+    print(f'{len(crops)} icons')
+
+    reference = None
+    print(f"{'config':>20} {'load (s)':>9} {'icons/s':>8} {'same':>7} {'token f1':>9}")
+    for config in args.configs:
+        backend, _, rest = config.partition(':')
+        preset, _, mode = rest.partition(':')
+        start = time.perf_counter()
+        caption_model_processor = get_caption_model_processor(args.caption_model_name, args.caption_model_path, device='cpu', backend=backend, generation=preset or 'default', early_exit=mode == 'early')
+        load_time = time.perf_counter() - start
+        caption_icon_crops(crops[:1], caption_model_processor, batch_size=1)
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            captions = caption_icon_crops(crops, caption_model_processor, batch_size=args.batch_size)
+            best = min(best, time.perf_counter() - start)
+        if reference is None:
+            reference = captions
+        same = sum(a == b for a, b in zip(reference, captions)) / max(len(captions), 1)
+        f1 = sum(token_f1(a, b) for a, b in zip(reference, captions)) / max(len(captions), 1)
+        print(f"{config:>20} {load_time:>9.1f} {len(crops) / best:>8.1f} {same:>7.1%} {f1:>9.3f}")
+        del caption_model_processor
+
+
+if __name__ == '__main__':
+    main()
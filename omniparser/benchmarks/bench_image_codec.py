@@ -0,0 +1,118 @@
+"""
+Encode time vs. payload size vs. parse fidelity for the codecs in util/image_codec.py.
+
+python benchmarks/bench_image_codec.py --image screenshot.png --codecs png:6 png:1 webp webp:80 jpeg:85 jpeg:70
+
+Without --image a synthetic 1920x1080 UI-like frame is used. Pixel fidelity is
+reported as PSNR against the source frame (inf for lossless codecs). With
+--som_model_path and --caption_model_path the decoded frames are also run through
+Omniparser and compared with the parse of the lossless frame: the share of its
+elements found again (IoU > 0.5) and the share of those with identical content,
+a proxy for how much a lossy LLM-bound image would cost in grounding accuracy.
+"""
+import os
+import io
+import sys
+import time
+import random
+import argparse
+
+import numpy as np
+from PIL import Image, ImageDraw
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.image_codec import ImageCodec
+
+
+def synthetic_screen(width=1920, height=1080, seed=0):
+    """White page with a toolbar, buttons, text lines and some gradient 'photos'."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 48), fill=(240, 240, 245))
+    for i in range(24):
+        x = 8 + i * 44
+        draw.rounded_rectangle((x, 8, x + 32, 40), radius=6, fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    for row in range(40):
+        y = 70 + row * 24
+        draw.text((40, y), ' '.join(f'word{rng.randint(0, 999)}' for _ in range(rng.randint(3, 12))), fill='black')
+    for _ in range(30):
+        x, y = rng.randint(900, width - 140), rng.randint(70, height - 40)
+        draw.rectangle((x, y, x + 120, y + 32), outline=(40, 90, 200), width=2)
+        draw.text((x + 10, y + 10), f'Button {rng.randint(0, 99)}', fill=(40, 90, 200))
+    gradient = np.linspace(0, 255, 300, dtype=np.uint8)
+    photo = np.stack(np.broadcast_arrays(gradient[None, :], gradient[:, None], np.full((300, 300), 128, np.uint8)), axis=-1)
+    image.paste(Image.fromarray(photo), (1500, 600))
+    return image
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def iou(a, b):
+    w = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    h = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = w * h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def parse_agreement(reference, parsed):
+    """(share of reference elements matched by an IoU > 0.5 box, share of those with the same content)"""
+    if not reference:
+        return 1.0, 1.0
+    matched = same = 0
+    for element in reference:
+        best = max(parsed, key=lambda e: iou(element['bbox'], e['bbox']), default=None)
+        if best is not None and iou(element['bbox'], best['bbox']) > 0.5:
+            matched += 1
+            same += best['content'] == element['content']
+    return matched / len(reference), same / matched if matched else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Image codec benchmark')
+    parser.add_argument('--image', type=str, default=None, help='Screenshot to encode, a synthetic frame is used when omitted')
+    parser.add_argument('--codecs', type=str, nargs='+', default=['png:6', 'png:1', 'webp', 'webp:80', 'jpeg:85', 'jpeg:70'])
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions, best is reported')
+    parser.add_argument('--som_model_path', type=str, default=None, help='Enables the parse fidelity columns')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default=None)
+    parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05)
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert('RGB') if args.image else synthetic_screen()
+    source = np.asarray(image)
+
+    omniparser = None
+    if args.som_model_path and args.caption_model_path:
+        from util.omniparser import Omniparser
+        omniparser = Omniparser({'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name,
+                                 'caption_model_path': args.caption_model_path, 'BOX_TRESHOLD': args.BOX_TRESHOLD, 'caption_cache_size': 0})
+        _, reference = omniparser.parse_image(image, som_format=None)
+
+    header = f"{'codec':>9} {'encode (ms)':>12} {'decode (ms)':>12} {'size (KB)':>10} {'psnr (dB)':>10}"
+    print(header + (f" {'matched':>8} {'same text':>10}" if omniparser else ''))
+    for spec in args.codecs:
+        codec = ImageCodec.from_spec(spec)
+        encode_time, decode_time = float('inf'), float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            data = codec.encode(image)
+            encode_time = min(encode_time, time.perf_counter() - start)
+            start = time.perf_counter()
+            decoded = Image.open(io.BytesIO(data)).convert('RGB')
+            decoded.load()
+            decode_time = min(decode_time, time.perf_counter() - start)
+        row = f"{codec.spec:>9} {encode_time * 1000:>12.1f} {decode_time * 1000:>12.1f} {len(data) / 1024:>10.1f} {psnr(source, np.asarray(decoded)):>10.2f}"
+        if omniparser:
+            _, parsed = omniparser.parse_image(decoded, som_format=None)
+            matched, same = parse_agreement(reference, parsed)
+            row += f" {matched:>8.1%} {same:>10.1%}"
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
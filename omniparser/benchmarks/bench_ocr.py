@@ -0,0 +1,66 @@
+"""
+EasyOCR vs. PaddleOCR latency and throughput on CPU, through util/ocr_engine.py.
+
+python benchmarks/bench_ocr.py --image screenshot.png --backends easyocr paddleocr --workers 1 2 4
+
+For each backend and reader-pool size reports the single-frame latency, the
+throughput over a batch of frames, and the latency of recognizing only a few
+dirty regions (as the incremental parse does). Without --image a synthetic
+1920x1080 UI-like frame is used. Pass --device cpu (the default) to hide GPUs.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from PIL import Image
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+sys.path.append(os.path.join(root_dir, 'benchmarks'))
+from bench_image_codec import synthetic_screen
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR engine benchmark')
+    parser.add_argument('--image', type=str, default=None, help='Screenshot to recognize, a synthetic frame is used when omitted')
+    parser.add_argument('--backends', type=str, nargs='+', default=['easyocr', 'paddleocr'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Reader pool sizes to compare')
+    parser.add_argument('--frames', type=int, default=8, help='Frames per throughput batch')
+    parser.add_argument('--regions', type=int, default=4, help='Number of 320x160 dirty regions for the region latency column')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions, best is reported')
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+    if args.device == 'cpu':
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    from util.ocr_engine import OCREngine
+
+    image = np.asarray((Image.open(args.image) if args.image else synthetic_screen()).convert('RGB'))
+    h, w = image.shape[:2]
+    regions = [[x, y, x + 320, y + 160] for x, y in zip(np.linspace(0, w - 320, args.regions, dtype=int), np.linspace(0, h - 160, args.regions, dtype=int))]
+    easyocr_args = {'text_threshold': 0.8}
+
+    print(f"{'backend':>10} {'workers':>8} {'texts':>6} {'frame (ms)':>11} {'frames/s':>9} {'regions (ms)':>13}")
+    for backend in args.backends:
+        for workers in args.workers:
+            engine = OCREngine(backend, num_workers=workers)
+            engine.warmup()
+            coord, _ = engine.recognize(image, easyocr_args)
+            latency = best_of(lambda: engine.recognize(image, easyocr_args), args.repeat)
+            batch = best_of(lambda: engine.recognize_batch([image] * args.frames, easyocr_args), args.repeat)
+            region_latency = best_of(lambda: engine.recognize_regions(image, regions, easyocr_args), args.repeat)
+            print(f"{backend:>10} {workers:>8} {len(coord):>6} {latency * 1000:>11.1f} {args.frames / batch:>9.2f} {region_latency * 1000:>13.1f}")
+            engine.executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Parity and speed benchmark for the batched overlap engine in util/overlap.py.
+
+python benchmarks/bench_overlap.py --sizes 50 200 1000 --repeat 5
+
+The reference implementations below are the original per-pair loops that
+`remove_overlap` / `remove_overlap_new` used before they were vectorized.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from typing import List
+
+import torch
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.overlap import remove_overlap, remove_overlap_new
+
+
+def remove_overlap_reference(boxes, iou_threshold, ocr_bbox=None):
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+
+    def box_area(box):
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    def intersection_area(box1, box2):
+        x1 = max(box1[0], box2[0])
+        y1 = max(box1[1], box2[1])
+        x2 = min(box1[2], box2[2])
+        y2 = min(box1[3], box2[3])
+        return max(0, x2 - x1) * max(0, y2 - y1)
+
+    def IoU(box1, box2):
+        intersection = intersection_area(box1, box2)
+        union = box_area(box1) + box_area(box2) - intersection + 1e-6
+        if box_area(box1) > 0 and box_area(box2) > 0:
+            ratio1 = intersection / box_area(box1)
+            ratio2 = intersection / box_area(box2)
+        else:
+            ratio1, ratio2 = 0, 0
+        return max(intersection / union, ratio1, ratio2)
+
+    def is_inside(box1, box2):
+        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
+        intersection = intersection_area(box1, box2)
+        ratio1 = intersection / box_area(box1)
+        return ratio1 > 0.95
+
+    boxes = boxes.tolist()
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    # print('ocr_bbox!!!', ocr_bbox)
+    for i, box1 in enumerate(boxes):
+        # if not any(IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2) for j, box2 in enumerate(boxes) if i != j):
+        is_valid_box = True
+        for j, box2 in enumerate(boxes):
+            # keep the smaller box
+            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
+                is_valid_box = False
+                break
+        if is_valid_box:
+            # add the following 2 lines to include ocr bbox
+            if ocr_bbox:
+                # only add the box if it does not overlap with any ocr bbox
+                if not any(IoU(box1, box3) > iou_threshold and not is_inside(box1, box3) for k, box3 in enumerate(ocr_bbox)):
+                    filtered_boxes.append(box1)
+            else:
+                filtered_boxes.append(box1)
+    return torch.tensor(filtered_boxes)
+
+
+def remove_overlap_new_reference(boxes, iou_threshold, ocr_bbox=None):
+    '''
+    ocr_bbox format: [{'type': 'text', 'bbox':[x,y], 'interactivity':False, 'content':str }, ...]
+    boxes format: [{'type': 'icon', 'bbox':[x,y], 'interactivity':True, 'content':None }, ...]
+
+    '''
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+
+    def box_area(box):
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    def intersection_area(box1, box2):
+        x1 = max(box1[0], box2[0])
+        y1 = max(box1[1], box2[1])
+        x2 = min(box1[2], box2[2])
+        y2 = min(box1[3], box2[3])
+        return max(0, x2 - x1) * max(0, y2 - y1)
+
+    def IoU(box1, box2):
+        intersection = intersection_area(box1, box2)
+        union = box_area(box1) + box_area(box2) - intersection + 1e-6
+        if box_area(box1) > 0 and box_area(box2) > 0:
+            ratio1 = intersection / box_area(box1)
+            ratio2 = intersection / box_area(box2)
+        else:
+            ratio1, ratio2 = 0, 0
+        return max(intersection / union, ratio1, ratio2)
+
+    def is_inside(box1, box2):
+        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
+        intersection = intersection_area(box1, box2)
+        ratio1 = intersection / box_area(box1)
+        return ratio1 > 0.80
+
+    # boxes = boxes.tolist()
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    # print('ocr_bbox!!!', ocr_bbox)
+    for i, box1_elem in enumerate(boxes):
+        box1 = box1_elem['bbox']
+        is_valid_box = True
+        for j, box2_elem in enumerate(boxes):
+            # keep the smaller box
+            box2 = box2_elem['bbox']
+            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
+                is_valid_box = False
+                break
+        if is_valid_box:
+            if ocr_bbox:
+                # keep yolo boxes + prioritize ocr label
+                box_added = False
+                ocr_labels = ''
+                for box3_elem in ocr_bbox:
+                    if not box_added:
+                        box3 = box3_elem['bbox']
+                        if is_inside(box3, box1): # ocr inside icon
+                            # box_added = True
+                            # delete the box3_elem from ocr_bbox
+                            try:
+                                # gather all ocr labels
+                                ocr_labels += box3_elem['content'] + ' '
+                                filtered_boxes.remove(box3_elem)
+                            except:
+                                continue
+                            # break
+                        elif is_inside(box1, box3): # icon inside ocr, don't added this icon box, no need to check other ocr bbox bc no overlap between ocr bbox, icon can only be in one ocr box
+                            box_added = True
+                            break
+                        else:
+                            continue
+                if not box_added:
+                    if ocr_labels:
+                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+                    else:
+                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+            else:
+                filtered_boxes.append(box1)
+    return filtered_boxes # torch.tensor(filtered_boxes)
+
+
+def random_screen(num_boxes, seed=0, ocr_ratio=0.5):
+    """Synthetic screen in normalized xyxy: icon boxes with nested/duplicated detections plus ocr lines."""
+    rng = random.Random(seed)
+    icons = []
+    for _ in range(num_boxes):
+        if icons and rng.random() < 0.2:
+            # jittered duplicate of an earlier detection, the common case for overlap filtering
+            x1, y1, x2, y2 = rng.choice(icons)
+            d = rng.uniform(-0.005, 0.005)
+            icons.append([x1 + d, y1 + d, x2 + d, y2 - d])
+            continue
+        w, h = rng.uniform(0.01, 0.08), rng.uniform(0.01, 0.05)
+        x, y = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+        icons.append([x, y, x + w, y + h])
+    ocr = []
+    for _ in range(int(num_boxes * ocr_ratio)):
+        w, h = rng.uniform(0.02, 0.2), rng.uniform(0.01, 0.02)
+        x, y = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+        ocr.append([x, y, x + w, y + h])
+    icons = torch.tensor(icons).tolist()
+    ocr = torch.tensor(ocr).tolist()
+    return icons, ocr
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overlap engine benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 1000], help='Number of yolo boxes per screen')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions, best is reported')
+    parser.add_argument('--iou_threshold', type=float, default=0.7)
+    parser.add_argument('--ocr_ratio', type=float, default=0.5, help='OCR boxes per yolo box, raise it to mimic text-heavy pages')
+    args = parser.parse_args()
+
+    print(f"{'boxes':>6} {'fn':>20} {'reference (ms)':>15} {'batched (ms)':>13} {'speedup':>8} parity")
+    for size in args.sizes:
+        icons, ocr = random_screen(size, seed=size, ocr_ratio=args.ocr_ratio)
+        icon_elem = [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in icons]
+        ocr_elem = [{'type': 'text', 'bbox': box, 'interactivity': False, 'content': f'text {i}', 'source': 'box_ocr_content_ocr'} for i, box in enumerate(ocr)]
+
+        t_ref, ref = timeit(lambda: remove_overlap_new_reference(icon_elem, args.iou_threshold, ocr_elem), args.repeat)
+        t_new, new = timeit(lambda: remove_overlap_new(icon_elem, args.iou_threshold, ocr_elem), args.repeat)
+        print(f"{size:>6} {'remove_overlap_new':>20} {t_ref * 1000:>15.2f} {t_new * 1000:>13.2f} {t_ref / t_new:>7.1f}x {ref == new}")
+
+        icons_t = torch.tensor(icons, dtype=torch.float64)
+        t_ref, ref = timeit(lambda: remove_overlap_reference(icons_t, args.iou_threshold, ocr), args.repeat)
+        t_new, new = timeit(lambda: remove_overlap(icons_t, args.iou_threshold, ocr), args.repeat)
+        print(f"{size:>6} {'remove_overlap':>20} {t_ref * 1000:>15.2f} {t_new * 1000:>13.2f} {t_ref / t_new:>7.1f}x {torch.equal(ref, new)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ import logging
 import base64
 import requests
 from .utils import is_image_path, encode_image
+from tools.screen_capture import mime_type_of
 
 def run_oai_interleaved(messages: list, system: str, model_name: str, api_key: str, max_tokens=256, temperature=0, provider_base_url: str = "https://api.openai.com/v1"):    
     headers = {"Content-Type": "application/json",
@@ -18,7 +19,7 @@ def run_oai_interleaved(messages: list, system: str, model_name: str, api_key: s
                         if is_image_path(cnt) and 'o3-mini' not in model_name:
                             # 03 mini does not support images
                             base64_image = encode_image(cnt)
-                            content = {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                            content = {"type": "image_url", "image_url": {"url": f"data:{mime_type_of(cnt)};base64,{base64_image}"}}
                         else:
                             content = {"type": "text", "text": cnt}
                     else:
@@ -1,37 +1,99 @@
 import requests
 import base64
+import json
 from pathlib import Path
-from tools.screen_capture import get_screenshot
+from urllib.parse import urljoin
+from tools.screen_capture import get_screenshot, IMAGE_SUFFIXES, mime_type_of
 from agent.llm_utils.utils import encode_image
 
 OUTPUT_DIR = "./tmp/outputs"
 
+def multipart_parts(response: requests.Response) -> list[bytes]:
+    """Bodies of the parts of a multipart/mixed response, in order."""
+    boundary = response.headers['Content-Type'].split('boundary=', 1)[1].strip('"').encode()
+    # every part is framed as \r\n<headers>\r\n\r\n<body>\r\n between two boundary lines
+    return [part[2:-2].partition(b'\r\n\r\n')[2] for part in response.content.split(b'--' + boundary)[1:-1]]
+
 class OmniParserClient:
     def __init__(self, 
-                 url: str) -> None:
+                 url: str,
+                 incremental: bool = False,
+                 session_id: str = 'default',
+                 binary: bool = True,
+                 som: str = 'inline') -> None:
+        """
+        binary: upload the raw PNG and download the SOM image as PNG instead of base64 JSON in both directions
+        som: 'inline' to get the labeled image in the same response, 'url' to fetch it with a second request,
+            'lazy' to only get som_image_url (drawn by the server when fetched with fetch_som_image),
+            'none' when the labeled image is never needed
+        """
         self.url = url
+        self.incremental = incremental
+        self.session_id = session_id
+        self.binary = binary
+        self.som = som if binary else 'base64'
 
     def __call__(self,):
-        screenshot, screenshot_path = get_screenshot()
+        return self.parse(*self.capture())
+
+    def capture(self):
+        """Screenshot of the VM as (PIL image, saved path)."""
+        return get_screenshot()
+
+    def parse(self, screenshot, screenshot_path):
+        """Send a captured screenshot to OmniParser and reformat the response."""
         screenshot_path = str(screenshot_path)
-        image_base64 = encode_image(screenshot_path)
-        response = requests.post(self.url, json={"base64_image": image_base64})
-        response_json = response.json()
+        if self.binary:
+            with open(screenshot_path, "rb") as f:
+                image_bytes = f.read()
+            params = {"incremental": str(self.incremental).lower(), "session_id": self.session_id, "som": self.som}
+            response = requests.post(self.url, data=image_bytes, params=params, headers={"Content-Type": mime_type_of(screenshot_path)})
+            response.raise_for_status()
+            if self.som == 'inline':
+                response_json, som_image_data = multipart_parts(response)
+                response_json = json.loads(response_json)
+                response_json['som_image_base64'] = base64.b64encode(som_image_data).decode('utf-8')
+            else:
+                response_json = response.json()
+                if 'som_image_url' in response_json:
+                    response_json['som_image_url'] = urljoin(self.url, response_json['som_image_url'])
+                som_image_data = self.fetch_som_image(response_json) if self.som == 'url' else None
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        else:
+            image_base64 = encode_image(screenshot_path)
+            response = requests.post(self.url, json={"base64_image": image_base64, "incremental": self.incremental, "session_id": self.session_id, "som": "base64"})
+            response_json = response.json()
+            som_image_data = base64.b64decode(response_json['som_image_base64'])
         print('omniparser latency:', response_json['latency'])
+        if 'caption_cache' in response_json:
+            print('omniparser caption cache:', response_json['caption_cache'])
 
-        som_image_data = base64.b64decode(response_json['som_image_base64'])
         screenshot_path_uuid = Path(screenshot_path).stem.replace("screenshot_", "")
-        som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.png"
-        with open(som_screenshot_path, "wb") as f:
-            f.write(som_image_data)
+        som_screenshot_path = None
+        if som_image_data is not None:
+            som_suffix = IMAGE_SUFFIXES.get(response_json.get('som_image_mime', 'image/png'), '.png')
+            som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}{som_suffix}"
+            with open(som_screenshot_path, "wb") as f:
+                f.write(som_image_data)
         
         response_json['width'] = screenshot.size[0]
         response_json['height'] = screenshot.size[1]
         response_json['original_screenshot_base64'] = image_base64
         response_json['screenshot_uuid'] = screenshot_path_uuid
+        # saved files keep the suffix of their encoding, agents use these paths instead of assuming .png
+        response_json['screenshot_path'] = screenshot_path
+        response_json['screenshot_mime'] = mime_type_of(screenshot_path)
+        response_json['som_screenshot_path'] = som_screenshot_path
         response_json = self.reformat_messages(response_json)
         return response_json
     
+    def fetch_som_image(self, response_json: dict) -> bytes:
+        """Download the labeled image of a 'url' or 'lazy' parse, also filling response_json['som_image_base64']."""
+        som_response = requests.get(response_json['som_image_url'])
+        som_response.raise_for_status()
+        response_json['som_image_base64'] = base64.b64encode(som_response.content).decode('utf-8')
+        return som_response.content
+
     def reformat_messages(self, response_json: dict):
         screen_info = ""
         for idx, element in enumerate(response_json["parsed_content_list"]):
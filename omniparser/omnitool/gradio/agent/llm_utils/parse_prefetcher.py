@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def same_screen(a, b) -> bool:
+    return a.size == b.size and np.array_equal(np.asarray(a), np.asarray(b))
+
+
+class ParsePrefetcher:
+    """
+    Runs OmniParserClient screenshot + parse on a background thread so they overlap with the UI updates after an action.
+
+    prefetch(): capture and parse now, as soon as an action has been executed. When the screen is still
+        pixel-identical to the last one returned by get() (the action changed nothing), that parse is
+        reused instead of sending the frame to the parser again.
+    get(): the newest result, parsing on the spot when nothing was prefetched.
+    Every new job cancels the pending one, results of cancelled jobs are dropped.
+    """
+
+    def __init__(self, client, max_workers: int = 2):
+        self.client = client
+        # two workers so a fresh prefetch never queues behind a cancelled parse still in flight
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='omniparser-prefetch')
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._future = None
+        # (screenshot, parsed_screen) last returned by get()
+        self._last = None
+        self.hits = 0
+        self.misses = 0
+
+    def _stale(self, generation: int) -> bool:
+        with self._lock:
+            return generation is not None and generation != self._generation
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _capture_and_parse(self, generation: int = None, last=None):
+        """(screenshot, parsed_screen), reusing last's parse if its screenshot matches the screen. None when cancelled."""
+        if self._stale(generation):
+            return None
+        screenshot, screenshot_path = self.client.capture()
+        if last is not None:
+            hit = same_screen(last[0], screenshot)
+            self._count(hit)
+            if hit:
+                return last
+        if self._stale(generation):
+            return None
+        return screenshot, self.client.parse(screenshot, screenshot_path)
+
+    def prefetch(self):
+        with self._lock:
+            self._generation += 1
+            if self._future is not None:
+                self._future.cancel()
+            self._future = self.executor.submit(self._capture_and_parse, self._generation, self._last)
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            future, self._future = self._future, None
+        if future is not None:
+            future.cancel()
+
+    def get(self):
+        with self._lock:
+            future, self._future = self._future, None
+            last = self._last
+        result = future.result() if future is not None else None
+        if result is None:
+            result = self._capture_and_parse(last=last)
+        with self._lock:
+            self._last = result
+        return result[1]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
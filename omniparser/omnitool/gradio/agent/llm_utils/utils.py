@@ -1,7 +1,7 @@
 import base64
 
 def is_image_path(text):
-    image_extensions = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".tif")
+    image_extensions = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".tif", ".webp")
     if text.endswith(image_extensions):
         return True
     else:
@@ -15,8 +15,15 @@ from agent.llm_utils.groqclient import run_groq_interleaved
 from agent.llm_utils.utils import is_image_path
 import time
 import re
+import os
+import sys
+# the OmniParser root, for the image codec shared with the parser server
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+from util.image_codec import ImageCodec
 
 OUTPUT_DIR = "./tmp/outputs"
+# the annotated step image is only displayed in the chat, a quality JPEG encodes several times faster than PNG
+OVERLAY_CODEC = ImageCodec.from_spec('jpeg:85')
 
 def extract_data(input_string, data_type):
     # Regular expression to extract content starting from '```python' until the end if there are no closing backticks
@@ -87,8 +94,9 @@ class VLMAgent:
         if isinstance(planner_messages[-1], dict):
             if not isinstance(planner_messages[-1]["content"], list):
                 planner_messages[-1]["content"] = [planner_messages[-1]["content"]]
-            planner_messages[-1]["content"].append(f"{OUTPUT_DIR}/screenshot_{screenshot_uuid}.png")
-            planner_messages[-1]["content"].append(f"{OUTPUT_DIR}/screenshot_som_{screenshot_uuid}.png")
+            planner_messages[-1]["content"].append(parsed_screen["screenshot_path"])
+            if parsed_screen.get("som_screenshot_path"):
+                planner_messages[-1]["content"].append(parsed_screen["som_screenshot_path"])
 
         start = time.time()
         if "gpt" in self.model or "o1" in self.model or "o3-mini" in self.model:
@@ -147,6 +155,7 @@ class VLMAgent:
         vlm_response_json = json.loads(vlm_response_json)
 
         img_to_show_base64 = parsed_screen["som_image_base64"]
+        img_to_show_mime = parsed_screen.get("som_image_mime", "image/png")
         if "Box ID" in vlm_response_json:
             try:
                 bbox = parsed_screen["parsed_content_list"][int(vlm_response_json["Box ID"])]["bbox"]
@@ -160,13 +169,12 @@ class VLMAgent:
                 draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill='red')
                 draw.ellipse((x - radius*3, y - radius*3, x + radius*3, y + radius*3), fill=None, outline='red', width=2)
 
-                buffered = BytesIO()
-                img_to_show.save(buffered, format="PNG")
-                img_to_show_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                img_to_show_base64 = base64.b64encode(OVERLAY_CODEC.encode(img_to_show)).decode("utf-8")
+                img_to_show_mime = OVERLAY_CODEC.mime_type
             except:
                 print(f"Error parsing: {vlm_response_json}")
                 pass
-        self.output_callback(f'<img src="data:image/png;base64,{img_to_show_base64}">', sender="bot")
+        self.output_callback(f'<img src="data:{img_to_show_mime};base64,{img_to_show_base64}">', sender="bot")
         self.output_callback(
                     f'<details>'
                     f'  <summary>Parsed Screen elemetns by OmniParser</summary>'
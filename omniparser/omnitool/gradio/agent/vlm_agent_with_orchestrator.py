@@ -18,7 +18,14 @@ from agent.llm_utils.utils import is_image_path
 import time
 import re
 import os
+import sys
+# the OmniParser root, for the image codec shared with the parser server
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+from util.image_codec import ImageCodec
+from tools.screen_capture import IMAGE_SUFFIXES
 OUTPUT_DIR = "./tmp/outputs"
+# the annotated step image is only displayed in the chat, a quality JPEG encodes several times faster than PNG
+OVERLAY_CODEC = ImageCodec.from_spec('jpeg:85')
 ORCHESTRATOR_LEDGER_PROMPT = """
 Recall we are working on the following request:
 
@@ -127,9 +134,12 @@ class VLMOrchestratedAgent:
 
         self.step_count += 1
         # save the image to the output folder
-        with open(f"{self.save_folder}/screenshot_{self.step_count}.png", "wb") as f:
+        # keep the suffix of each image's encoding
+        screenshot_path = f"{self.save_folder}/screenshot_{self.step_count}{Path(parsed_screen['screenshot_path']).suffix}"
+        som_screenshot_path = f"{self.save_folder}/som_screenshot_{self.step_count}{IMAGE_SUFFIXES.get(parsed_screen.get('som_image_mime', 'image/png'), '.png')}"
+        with open(screenshot_path, "wb") as f:
             f.write(base64.b64decode(parsed_screen['original_screenshot_base64']))
-        with open(f"{self.save_folder}/som_screenshot_{self.step_count}.png", "wb") as f:
+        with open(som_screenshot_path, "wb") as f:
             f.write(base64.b64decode(parsed_screen['som_image_base64']))
 
         latency_omniparser = parsed_screen['latency']
@@ -148,8 +158,9 @@ class VLMOrchestratedAgent:
         if isinstance(planner_messages[-1], dict):
             if not isinstance(planner_messages[-1]["content"], list):
                 planner_messages[-1]["content"] = [planner_messages[-1]["content"]]
-            planner_messages[-1]["content"].append(f"{OUTPUT_DIR}/screenshot_{screenshot_uuid}.png")
-            planner_messages[-1]["content"].append(f"{OUTPUT_DIR}/screenshot_som_{screenshot_uuid}.png")
+            planner_messages[-1]["content"].append(parsed_screen["screenshot_path"])
+            if parsed_screen.get("som_screenshot_path"):
+                planner_messages[-1]["content"].append(parsed_screen["som_screenshot_path"])
 
         start = time.time()
         if "gpt" in self.model or "o1" in self.model or "o3-mini" in self.model:
@@ -210,6 +221,7 @@ class VLMOrchestratedAgent:
         vlm_response_json = json.loads(vlm_response_json)
 
         img_to_show_base64 = parsed_screen["som_image_base64"]
+        img_to_show_mime = parsed_screen.get("som_image_mime", "image/png")
         if "Box ID" in vlm_response_json:
             try:
                 bbox = parsed_screen["parsed_content_list"][int(vlm_response_json["Box ID"])]["bbox"]
@@ -223,13 +235,12 @@ class VLMOrchestratedAgent:
                 draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill='red')
                 draw.ellipse((x - radius*3, y - radius*3, x + radius*3, y + radius*3), fill=None, outline='red', width=2)
 
-                buffered = BytesIO()
-                img_to_show.save(buffered, format="PNG")
-                img_to_show_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                img_to_show_base64 = base64.b64encode(OVERLAY_CODEC.encode(img_to_show)).decode("utf-8")
+                img_to_show_mime = OVERLAY_CODEC.mime_type
             except:
                 print(f"Error parsing: {vlm_response_json}")
                 pass
-        self.output_callback(f'<img src="data:image/png;base64,{img_to_show_base64}">', )
+        self.output_callback(f'<img src="data:{img_to_show_mime};base64,{img_to_show_base64}">', )
         
         # Display screen info in a collapsible dropdown
         self.output_callback(
@@ -272,8 +283,8 @@ class VLMOrchestratedAgent:
 
         # save the intermediate step trajectory to the save folder
         step_trajectory = {
-            "screenshot_path": f"{self.save_folder}/screenshot_{self.step_count}.png",
-            "som_screenshot_path": f"{self.save_folder}/som_screenshot_{self.step_count}.png",
+            "screenshot_path": screenshot_path,
+            "som_screenshot_path": som_screenshot_path,
             "screen_info": screen_info,
             "latency_omniparser": latency_omniparser,
             "latency_vlm": latency_vlm,
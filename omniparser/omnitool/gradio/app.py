@@ -17,6 +17,7 @@ from anthropic.types.tool_use_block import ToolUseBlock
 from loop import (
     APIProvider,
     sampling_loop_sync,
+    sampling_loop_prefetch,
 )
 from tools import ToolResult
 import requests
@@ -37,6 +38,7 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description="Gradio App")
     parser.add_argument("--windows_host_url", type=str, default='localhost:8006')
     parser.add_argument("--omniparser_server_url", type=str, default="localhost:8000")
+    parser.add_argument("--prefetch_parse", action="store_true", help="Start parsing the screen as soon as an action has run, while the UI updates")
     return parser.parse_args()
 args = parse_arguments()
 
@@ -158,7 +160,7 @@ def chatbot_output_callback(message, chatbot_state, hide_images=False, sender="b
                 # somehow can't display via gr.Image
                 # image_data = base64.b64decode(message.base64_image)
                 # return gr.Image(value=Image.open(io.BytesIO(image_data)))
-                return f'<img src="data:image/png;base64,{message.base64_image}">'
+                return f'<img src="data:{message.image_mime or "image/png"};base64,{message.base64_image}">'
 
         elif isinstance(message, BetaTextBlock) or isinstance(message, TextBlock):
             return f"Analysis: {message.text}"
@@ -231,8 +233,9 @@ def process_input(user_input, state):
     print("state")
     print(state)
 
-    # Run sampling_loop_sync with the chatbot_output_callback
-    for loop_msg in sampling_loop_sync(
+    # Run the sampling loop with the chatbot_output_callback
+    sampling_loop = sampling_loop_prefetch if args.prefetch_parse else sampling_loop_sync
+    for loop_msg in sampling_loop(
         model=state["model"],
         provider=state["provider"],
         messages=state["messages"],
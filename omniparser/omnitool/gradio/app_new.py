@@ -181,7 +181,7 @@ def chatbot_output_callback(message, chatbot_state, hide_images=False, sender="b
                 # somehow can't display via gr.Image
                 # image_data = base64.b64decode(message.base64_image)
                 # return gr.Image(value=Image.open(io.BytesIO(image_data)))
-                return f'<img src="data:image/png;base64,{message.base64_image}">'
+                return f'<img src="data:{message.image_mime or "image/png"};base64,{message.base64_image}">'
 
         elif isinstance(message, BetaTextBlock) or isinstance(message, TextBlock):
             # Format reasoning text in a collapsible dropdown
@@ -135,7 +135,7 @@ def chatbot_output_callback(message, hide_images=False):
             if message.error:
                 return f"Error: {message.error}"
             if message.base64_image and not hide_images:
-                return f'<img src="data:image/png;base64,{message.base64_image}">'
+                return f'<img src="data:{message.image_mime or "image/png"};base64,{message.base64_image}">'
         
         elif isinstance(message, (BetaTextBlock, TextBlock)):
             return f"Next step Reasoning: {message.text}"
@@ -82,7 +82,7 @@ def _message_display_callback(messages):
             elif isinstance(msg["content"][0], BetaToolUseBlock):
                 display_messages.append((None, f"Tool Use: {msg['content'][0].name}\nInput: {msg['content'][0].input}"))  # Bot message
             elif isinstance(msg["content"][0], Dict) and msg["content"][0]["content"][-1]["type"] == "image":
-                display_messages.append((None, f'<img src="data:image/png;base64,{msg["content"][0]["content"][-1]["source"]["data"]}">'))  # Bot message
+                display_messages.append((None, f'<img src="data:{msg["content"][0]["content"][-1]["source"]["media_type"]};base64,{msg["content"][0]["content"][-1]["source"]["data"]}">'))  # Bot message
             else:
                 print(msg["content"][0])
         except Exception as e:
@@ -113,7 +113,7 @@ def _make_api_tool_result(
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
+                        "media_type": result.image_mime or "image/png",
                         "data": result.base64_image,
                     },
                 }
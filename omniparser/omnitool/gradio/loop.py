@@ -16,6 +16,7 @@ from anthropic.types.beta import (
 from tools import ToolResult
 
 from agent.llm_utils.omniparserclient import OmniParserClient
+from agent.llm_utils.parse_prefetcher import ParsePrefetcher
 from agent.anthropic_agent import AnthropicActor
 from agent.vlm_agent import VLMAgent
 from agent.vlm_agent_with_orchestrator import VLMOrchestratedAgent
@@ -37,27 +38,8 @@ PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.OPENAI: "gpt-4o",
 }
 
-def sampling_loop_sync(
-    *,
-    model: str,
-    provider: APIProvider | None,
-    messages: list[BetaMessageParam],
-    output_callback: Callable[[BetaContentBlock], None],
-    tool_output_callback: Callable[[ToolResult, str], None],
-    api_response_callback: Callable[[APIResponse[BetaMessage]], None],
-    api_key: str,
-    only_n_most_recent_images: int | None = 2,
-    max_tokens: int = 4096,
-    omniparser_url: str,
-    save_folder: str = "./uploads"
-):
-    """
-    Synchronous agentic sampling loop for the assistant/tool interaction of computer use.
-    """
-    print('in sampling_loop_sync, model:', model)
-    omniparser_client = OmniParserClient(url=f"http://{omniparser_url}/parse/")
+def make_actor(*, model, provider, api_key, api_response_callback, output_callback, max_tokens, only_n_most_recent_images, save_folder):
     if model == "claude-3-5-sonnet-20241022":
-        # Register Actor and Executor
         actor = AnthropicActor(
             model=model, 
             provider=provider,
@@ -89,6 +71,30 @@ def sampling_loop_sync(
         )
     else:
         raise ValueError(f"Model {model} not supported")
+    return actor
+
+def sampling_loop_sync(
+    *,
+    model: str,
+    provider: APIProvider | None,
+    messages: list[BetaMessageParam],
+    output_callback: Callable[[BetaContentBlock], None],
+    tool_output_callback: Callable[[ToolResult, str], None],
+    api_response_callback: Callable[[APIResponse[BetaMessage]], None],
+    api_key: str,
+    only_n_most_recent_images: int | None = 2,
+    max_tokens: int = 4096,
+    omniparser_url: str,
+    save_folder: str = "./uploads"
+):
+    """
+    Synchronous agentic sampling loop for the assistant/tool interaction of computer use.
+    """
+    print('in sampling_loop_sync, model:', model)
+    # the Anthropic loop only reads screen_info, so the SOM overlay is left to be drawn on demand
+    omniparser_client = OmniParserClient(url=f"http://{omniparser_url}/parse/", som='lazy' if model == "claude-3-5-sonnet-20241022" else 'inline')
+    actor = make_actor(model=model, provider=provider, api_key=api_key, api_response_callback=api_response_callback, output_callback=output_callback,
+                       max_tokens=max_tokens, only_n_most_recent_images=only_n_most_recent_images, save_folder=save_folder)
     executor = AnthropicExecutor(
         output_callback=output_callback,
         tool_output_callback=tool_output_callback,
@@ -124,4 +130,72 @@ def sampling_loop_sync(
                 yield message
         
             if not tool_result_content:
-                return messages
\ No newline at end of file
+                return messages
+
+def sampling_loop_prefetch(
+    *,
+    model: str,
+    provider: APIProvider | None,
+    messages: list[BetaMessageParam],
+    output_callback: Callable[[BetaContentBlock], None],
+    tool_output_callback: Callable[[ToolResult, str], None],
+    api_response_callback: Callable[[APIResponse[BetaMessage]], None],
+    api_key: str,
+    only_n_most_recent_images: int | None = 2,
+    max_tokens: int = 4096,
+    omniparser_url: str,
+    save_folder: str = "./uploads"
+):
+    """
+    Variant of sampling_loop_sync with a parse-after-action prefetch.
+
+    The screen is captured and parsed on a background thread as soon as an action has been executed,
+    while the executor's messages are still being rendered. When the action left the screen unchanged,
+    the previous parse is reused without another round trip to the parser.
+    The LLM call still needs the parse of the screen it plans on, so it does not overlap with parsing:
+    a step costs parse + LLM, minus the time spent rendering the executor's output.
+    """
+    print('in sampling_loop_prefetch, model:', model)
+    omniparser_client = OmniParserClient(url=f"http://{omniparser_url}/parse/", som='lazy' if model == "claude-3-5-sonnet-20241022" else 'inline')
+    prefetcher = ParsePrefetcher(omniparser_client)
+    actor = make_actor(model=model, provider=provider, api_key=api_key, api_response_callback=api_response_callback, output_callback=output_callback,
+                       max_tokens=max_tokens, only_n_most_recent_images=only_n_most_recent_images, save_folder=save_folder)
+    executor = AnthropicExecutor(
+        output_callback=output_callback,
+        tool_output_callback=tool_output_callback,
+    )
+    print(f"Model Inited: {model}, Provider: {provider}")
+
+    def execute(tools_use_needed):
+        tool_result_content = None
+        executed = 0
+        for message, tool_result_content in executor(tools_use_needed, messages):
+            if tool_result_content and len(tool_result_content) > executed:
+                # an action just ran, start parsing its result while the UI catches up
+                executed = len(tool_result_content)
+                prefetcher.prefetch()
+            yield message, tool_result_content
+
+    prefetcher.prefetch()
+    try:
+        while True:
+            parsed_screen = prefetcher.get()
+            if model == "claude-3-5-sonnet-20241022":
+                screen_info_block = TextBlock(text='Below is the structured accessibility information of the current UI screen, which includes text and icons you can operate on, take these information into account when you are making the prediction for the next action. Note you will still need to take screenshot to get the image: \n' + parsed_screen['screen_info'], type='text')
+                messages.append({"role": "user", "content": [screen_info_block]})
+                tools_use_needed = actor(messages=messages)
+            else:
+                tools_use_needed, vlm_response_json = actor(messages=messages, parsed_screen=parsed_screen)
+
+            tool_result_content = None
+            for message, tool_result_content in execute(tools_use_needed):
+                yield message
+
+            if not tool_result_content:
+                return messages
+
+            if model == "claude-3-5-sonnet-20241022":
+                messages.append({"content": tool_result_content, "role": "user"})
+    finally:
+        print('prefetched parses reused:', prefetcher.stats())
+        prefetcher.shutdown()
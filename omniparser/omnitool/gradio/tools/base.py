@@ -27,6 +27,8 @@ class ToolResult:
     output: str | None = None
     error: str | None = None
     base64_image: str | None = None
+    # mime type of base64_image, PNG when not set
+    image_mime: str | None = None
     system: str | None = None
 
     def __bool__(self):
@@ -46,6 +48,7 @@ class ToolResult:
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
+            image_mime=self.image_mime if self.base64_image else other.image_mime,
             system=combine_fields(self.system, other.system),
         )
 
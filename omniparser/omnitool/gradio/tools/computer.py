@@ -1,5 +1,5 @@
 import base64
-import time
+import json
 from enum import StrEnum
 from typing import Literal, TypedDict
 
@@ -8,9 +8,9 @@ from PIL import Image
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
 from .base import BaseAnthropicTool, ToolError, ToolResult
-from .screen_capture import get_screenshot
+from .screen_capture import get_screenshot, mime_type_of
+from .settle import SettleDetector
 import requests
-import re
 
 OUTPUT_DIR = "./tmp/outputs"
 
@@ -59,6 +59,34 @@ class ComputerToolOptions(TypedDict):
 def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
+
+PYAUTOGUI_METHODS = {"mouse_down": "mouseDown", "mouse_up": "mouseUp", "key_down": "keyDown", "key_up": "keyUp", "press": "press"}
+
+
+def pyautogui_statement(action: dict) -> str:
+    """One line of python doing what the VM server's /action does for action, position / size print their result as JSON."""
+    name = action["action"]
+    button = action.get("button", "left")
+    if name == "move":
+        return f"pyautogui.moveTo({action['x']!r}, {action['y']!r}, duration={action.get('duration', 0)!r})"
+    if name == "click":
+        return f"pyautogui.click(x={action.get('x')!r}, y={action.get('y')!r}, clicks={action.get('clicks', 1)!r}, button={button!r})"
+    if name in ("mouse_down", "mouse_up"):
+        return f"pyautogui.{PYAUTOGUI_METHODS[name]}(button={button!r})"
+    if name == "drag":
+        return f"pyautogui.dragTo({action['x']!r}, {action['y']!r}, duration={action.get('duration', 0.5)!r}, button={button!r})"
+    if name == "scroll":
+        return f"pyautogui.scroll({action['amount']!r})"
+    if name in ("key_down", "key_up", "press"):
+        return f"pyautogui.{PYAUTOGUI_METHODS[name]}({action['key']!r})"
+    if name == "type":
+        return f"pyautogui.typewrite({action['text']!r}, interval={action.get('interval', 0)!r})"
+    if name == "sleep":
+        return f"time.sleep({action['seconds']!r})"
+    if name in ("position", "size"):
+        return f"print(json.dumps(list(pyautogui.{name}())))"
+    raise ToolError(f"Invalid action for the VM: {name}")
+
 class ComputerTool(BaseAnthropicTool):
     """
     A tool that allows the agent to interact with the screen, keyboard, and mouse of the current computer.
@@ -96,9 +124,14 @@ class ComputerTool(BaseAnthropicTool):
         self.offset_x = 0
         self.offset_y = 0
         self.is_scaling = is_scaling
+        # False once the VM server turned out to predate /action, actions then go to /execute
+        self.action_endpoint = None
         self.width, self.height = self.get_screen_size()
         print(f"screen size: {self.width}, {self.height}")
 
+        # replaces fixed sleeps after actions: waits until the screen stops changing
+        self.settle_detector = SettleDetector()
+
         self.key_conversion = {"Page_Down": "pagedown",
                                "Page_Up": "pageup",
                                "Super_L": "win",
@@ -141,11 +174,12 @@ class ComputerTool(BaseAnthropicTool):
             print(f"mouse move to {x}, {y}")
             
             if action == "mouse_move":
-                self.send_to_vm(f"pyautogui.moveTo({x}, {y})")
+                self.send_actions([{"action": "move", "x": x, "y": y}])
+                self.settle()
                 return ToolResult(output=f"Moved mouse to ({x}, {y})")
             elif action == "left_click_drag":
-                current_x, current_y = self.send_to_vm("pyautogui.position()")
-                self.send_to_vm(f"pyautogui.dragTo({x}, {y}, duration=0.5)")
+                (current_x, current_y), _ = self.send_actions([{"action": "position"}, {"action": "drag", "x": x, "y": y, "duration": 0.5}])
+                self.settle()
                 return ToolResult(output=f"Dragged mouse from ({current_x}, {current_y}) to ({x}, {y})")
 
         if action in ("key", "type"):
@@ -157,25 +191,22 @@ class ComputerTool(BaseAnthropicTool):
                 raise ToolError(output=f"{text} must be a string")
 
             if action == "key":
-                # Handle key combinations
-                keys = text.split('+')
-                for key in keys:
-                    key = self.key_conversion.get(key.strip(), key.strip())
-                    key = key.lower()
-                    self.send_to_vm(f"pyautogui.keyDown('{key}')")  # Press down each key
-                for key in reversed(keys):
-                    key = self.key_conversion.get(key.strip(), key.strip())
-                    key = key.lower()
-                    self.send_to_vm(f"pyautogui.keyUp('{key}')")    # Release each key in reverse order
+                # Handle key combinations, the whole chord goes to the VM in one request
+                keys = [self.key_conversion.get(key.strip(), key.strip()).lower() for key in text.split('+')]
+                self.send_actions([{"action": "key_down", "key": key} for key in keys] +   # Press down each key
+                                  [{"action": "key_up", "key": key} for key in reversed(keys)])  # Release each key in reverse order
+                self.settle()
                 return ToolResult(output=f"Pressed keys: {text}")
             
             elif action == "type":
                 # default click before type TODO: check if this is needed
-                self.send_to_vm("pyautogui.click()")
-                self.send_to_vm(f"pyautogui.typewrite('{text}', interval={TYPING_DELAY_MS / 1000})")
-                self.send_to_vm("pyautogui.press('enter')")
-                screenshot_base64 = (await self.screenshot()).base64_image
-                return ToolResult(output=text, base64_image=screenshot_base64)
+                self.send_actions([
+                    {"action": "click"},
+                    {"action": "type", "text": text, "interval": TYPING_DELAY_MS / 1000},
+                    {"action": "press", "key": "enter"},
+                ])
+                self.settle()
+                return (await self.screenshot()).replace(output=text)
 
         if action in (
             "left_click",
@@ -194,67 +225,92 @@ class ComputerTool(BaseAnthropicTool):
             if action == "screenshot":
                 return await self.screenshot()
             elif action == "cursor_position":
-                x, y = self.send_to_vm("pyautogui.position()")
+                (x, y), = self.send_actions([{"action": "position"}])
                 x, y = self.scale_coordinates(ScalingSource.COMPUTER, x, y)
                 return ToolResult(output=f"X={x},Y={y}")
             else:
                 if action == "left_click":
-                    self.send_to_vm("pyautogui.click()")
+                    self.send_actions([{"action": "click"}])
                 elif action == "right_click":
-                    self.send_to_vm("pyautogui.rightClick()")
+                    self.send_actions([{"action": "click", "button": "right"}])
                 elif action == "middle_click":
-                    self.send_to_vm("pyautogui.middleClick()")
+                    self.send_actions([{"action": "click", "button": "middle"}])
                 elif action == "double_click":
-                    self.send_to_vm("pyautogui.doubleClick()")
+                    self.send_actions([{"action": "click", "clicks": 2}])
                 elif action == "left_press":
-                    self.send_to_vm("pyautogui.mouseDown()")
-                    time.sleep(1)
-                    self.send_to_vm("pyautogui.mouseUp()")
+                    # the 1s hold time of the long press runs on the VM, not a settle wait
+                    self.send_actions([{"action": "mouse_down"}, {"action": "sleep", "seconds": 1}, {"action": "mouse_up"}])
+                self.settle()
                 return ToolResult(output=f"Performed {action}")
         if action in ("scroll_up", "scroll_down"):
             if action == "scroll_up":
-                self.send_to_vm("pyautogui.scroll(100)")
+                self.send_actions([{"action": "scroll", "amount": 100}])
             elif action == "scroll_down":
-                self.send_to_vm("pyautogui.scroll(-100)")
+                self.send_actions([{"action": "scroll", "amount": -100}])
+            self.settle()
             return ToolResult(output=f"Performed {action}")
         if action == "hover":
             return ToolResult(output=f"Performed {action}")
         if action == "wait":
-            time.sleep(1)
+            # at least the former fixed second, longer while the screen is still loading
+            self.settle(min_wait=1.0, max_wait=10.0)
             return ToolResult(output=f"Performed {action}")
         raise ToolError(f"Invalid action: {action}")
 
-    def send_to_vm(self, action: str):
+    def send_actions(self, actions: list[dict]) -> list:
         """
-        Executes a python command on the server. Only return tuple of x,y when action is "pyautogui.position()"
+        Executes structured actions on the server's in-process action worker in one request, returns one
+        result per action ([x, y] for "position", None for most others). See actions.py next to the VM server for the format.
         """
-        prefix = "import pyautogui; pyautogui.FAILSAFE = False;"
-        command_list = ["python", "-c", f"{prefix} {action}"]
-        parse = action == "pyautogui.position()"
-        if parse:
-            command_list[-1] = f"{prefix} print({action})"
+        if self.action_endpoint is False:
+            return self.execute_actions(actions)
+        try:
+            print(f"sending to vm: {actions}")
+            response = requests.post(
+                f"http://localhost:5000/action",
+                json={"actions": actions},
+                timeout=90
+            )
+            if response.status_code == 404 and self.action_endpoint is None:
+                # a VM server from before /action, run the same actions as one script on /execute from now on
+                print("VM server has no /action, falling back to /execute")
+                self.action_endpoint = False
+                return self.execute_actions(actions)
+            self.action_endpoint = True
+            if response.status_code != 200:
+                try:
+                    message = response.json().get('message', '')
+                except ValueError:
+                    message = response.text
+                raise ToolError(f"Failed to execute actions. Status code: {response.status_code} {message}")
+            print(f"actions executed")
+            return response.json()['results']
+        except requests.exceptions.RequestException as e:
+            raise ToolError(f"An error occurred while trying to execute the actions: {str(e)}")
 
+    def execute_actions(self, actions: list[dict]) -> list:
+        """send_actions for VM servers without /action: the actions run as one python script through /execute."""
+        script = "\n".join(["import json, time", "import pyautogui", "pyautogui.FAILSAFE = False"] +
+                           [pyautogui_statement(action) for action in actions])
         try:
-            print(f"sending to vm: {command_list}")
+            print(f"sending to vm: {actions}")
             response = requests.post(
-                f"http://localhost:5000/execute", 
+                f"http://localhost:5000/execute",
                 headers={'Content-Type': 'application/json'},
-                json={"command": command_list},
+                json={"command": ["python", "-c", script]},
                 timeout=90
             )
-            time.sleep(0.7) # avoid async error as actions take time to complete
-            print(f"action executed")
             if response.status_code != 200:
                 raise ToolError(f"Failed to execute command. Status code: {response.status_code}")
-            if parse:
-                output = response.json()['output'].strip()
-                match = re.search(r'Point\(x=(\d+),\s*y=(\d+)\)', output)
-                if not match:
-                    raise ToolError(f"Could not parse coordinates from output: {output}")
-                x, y = map(int, match.groups())
-                return x, y
+            output = response.json()
+            if output.get('returncode'):
+                raise ToolError(f"Failed to execute actions: {output.get('error', '')}")
+            print(f"actions executed")
         except requests.exceptions.RequestException as e:
             raise ToolError(f"An error occurred while trying to execute the command: {str(e)}")
+        # position / size printed one JSON line each, in order
+        printed = iter(output['output'].splitlines())
+        return [json.loads(next(printed)) if action["action"] in ("position", "size") else None for action in actions]
 
     async def screenshot(self):
         if not hasattr(self, 'target_dimension'):
@@ -262,8 +318,11 @@ class ComputerTool(BaseAnthropicTool):
             self.target_dimension = MAX_SCALING_TARGETS["WXGA"]
         width, height = self.target_dimension["width"], self.target_dimension["height"]
         screenshot, path = get_screenshot(resize=True, target_width=width, target_height=height)
-        time.sleep(0.7) # avoid async error as actions take time to complete
-        return ToolResult(base64_image=base64.b64encode(path.read_bytes()).decode())
+        return ToolResult(base64_image=base64.b64encode(path.read_bytes()).decode(), image_mime=mime_type_of(path))
+
+    def settle(self, min_wait: float | None = None, max_wait: float | None = None):
+        """Wait for the screen to stop changing after an action, see SettleDetector."""
+        return self.settle_detector.wait(min_wait=min_wait, max_wait=max_wait)
 
     def padding_image(self, screenshot):
         """Pad the screenshot to 16:10 aspect ratio, when the aspect ratio is not 16:10."""
@@ -309,21 +368,5 @@ class ComputerTool(BaseAnthropicTool):
 
     def get_screen_size(self):
         """Return width and height of the screen"""
-        try:
-            response = requests.post(
-                f"http://localhost:5000/execute",
-                headers={'Content-Type': 'application/json'},
-                json={"command": ["python", "-c", "import pyautogui; print(pyautogui.size())"]},
-                timeout=90
-            )
-            if response.status_code != 200:
-                raise ToolError(f"Failed to get screen size. Status code: {response.status_code}")
-            
-            output = response.json()['output'].strip()
-            match = re.search(r'Size\(width=(\d+),\s*height=(\d+)\)', output)
-            if not match:
-                raise ToolError(f"Could not parse screen size from output: {output}")
-            width, height = map(int, match.groups())
-            return width, height
-        except requests.exceptions.RequestException as e:
-            raise ToolError(f"An error occurred while trying to get screen size: {str(e)}")
\ No newline at end of file
+        (width, height), = self.send_actions([{"action": "size"}])
+        return width, height
\ No newline at end of file
@@ -6,24 +6,42 @@ from .base import BaseAnthropicTool, ToolError
 from io import BytesIO
 
 OUTPUT_DIR = "./tmp/outputs"
+IMAGE_SUFFIXES = {"image/png": ".png", "image/webp": ".webp", "image/jpeg": ".jpg"}
+
+def mime_type_of(path) -> str:
+    """Mime type of an image saved by get_screenshot or OmniParserClient, from its suffix"""
+    suffix = Path(path).suffix.lower()
+    return next((mime for mime, s in IMAGE_SUFFIXES.items() if s == suffix), "image/png")
 
 def get_screenshot(resize: bool = False, target_width: int = 1920, target_height: int = 1080):
     """Capture screenshot by requesting from HTTP endpoint - returns native resolution unless resized"""
     output_dir = Path(OUTPUT_DIR)
     output_dir.mkdir(parents=True, exist_ok=True)
-    path = output_dir / f"screenshot_{uuid4().hex}.png"
     
     try:
-        response = requests.get('http://localhost:5000/screenshot')
+        response = None
+        if resize:
+            # downscale on the VM, encoding and sending the small frame is much cheaper than the full screen
+            response = requests.get('http://localhost:5000/capture', params={'width': target_width, 'height': target_height})
+            if response.status_code == 404:
+                # an older VM server without /capture
+                response = None
+        if response is None:
+            response = requests.get('http://localhost:5000/screenshot')
         if response.status_code != 200:
             raise ToolError(f"Failed to capture screenshot: HTTP {response.status_code}")
+        suffix = IMAGE_SUFFIXES.get(response.headers.get("Content-Type", "").split(";")[0], ".png")
+        path = output_dir / f"screenshot_{uuid4().hex}{suffix}"
         
         # (1280, 800)
         screenshot = Image.open(BytesIO(response.content))
         
         if resize and screenshot.size != (target_width, target_height):
             screenshot = screenshot.resize((target_width, target_height))
-        screenshot.save(path)
+            screenshot.save(path)
+        else:
+            # already encoded by the VM server, store it as is instead of decoding and re-encoding
+            path.write_bytes(response.content)
         return screenshot, path
     except Exception as e:
         raise ToolError(f"Failed to capture screenshot: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+import requests
+
+VM_URL = "http://localhost:5000"
+
+
+class SettleDetector:
+    """
+    Waits until the VM screen stops changing after an action.
+
+    Polls the VM's /thumbnail endpoint (a tiny grayscale frame) and returns once `stable_polls`
+    consecutive thumbnails match, never earlier than min_wait nor later than max_wait seconds.
+    A screen that has not changed at all only counts as settled after `grace_period` seconds, since
+    app launches and page loads often start reacting a few hundred ms after the click.
+    Thumbnails match when at most `max_changed_ratio` of the pixels moved by more than
+    `pixel_tolerance` levels, so a blinking caret or clock does not count as a change.
+    VM servers without /thumbnail fall back to a fixed `fallback_wait` sleep.
+    """
+
+    def __init__(self, url: str = VM_URL, min_wait: float = 0.05, max_wait: float = 3.0, poll_interval: float = 0.05,
+                 stable_polls: int = 2, grace_period: float = 0.3, thumbnail_width: int = 64, pixel_tolerance: int = 8, max_changed_ratio: float = 0.002,
+                 fallback_wait: float = 0.7):
+        self.url = url
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self.grace_period = grace_period
+        self.thumbnail_width = thumbnail_width
+        self.pixel_tolerance = pixel_tolerance
+        self.max_changed_ratio = max_changed_ratio
+        self.fallback_wait = fallback_wait
+        self.supported = None
+        self.session = requests.Session()
+
+    def thumbnail(self) -> np.ndarray | None:
+        response = self.session.get(f"{self.url}/thumbnail", params={"width": self.thumbnail_width}, timeout=5)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        width, height = int(response.headers["X-Width"]), int(response.headers["X-Height"])
+        return np.frombuffer(response.content, dtype=np.uint8).reshape(height, width)
+
+    def same(self, a: np.ndarray, b: np.ndarray) -> bool:
+        if a.shape != b.shape:
+            return False
+        changed = np.abs(a.astype(np.int16) - b.astype(np.int16)) > self.pixel_tolerance
+        return changed.mean() <= self.max_changed_ratio
+
+    def wait(self, min_wait: float | None = None, max_wait: float | None = None) -> float:
+        """Block until the screen is stable, returns the seconds waited."""
+        min_wait = self.min_wait if min_wait is None else min_wait
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.perf_counter()
+        if self.supported is False:
+            time.sleep(max(self.fallback_wait, min_wait))
+            return time.perf_counter() - start
+        time.sleep(min_wait)
+        try:
+            previous = self.thumbnail()
+            # an older VM server without /thumbnail, stop asking
+            self.supported = previous is not None
+        except requests.exceptions.RequestException as e:
+            print(f"settle detection unavailable ({e}), sleeping {self.fallback_wait}s")
+            previous = None
+        if previous is None:
+            time.sleep(max(self.fallback_wait - min_wait, 0))
+            return time.perf_counter() - start
+
+        stable = 0
+        changed = False
+        settled = False
+        while time.perf_counter() - start < max_wait:
+            time.sleep(self.poll_interval)
+            try:
+                current = self.thumbnail()
+            except requests.exceptions.RequestException:
+                break
+            if self.same(previous, current):
+                stable += 1
+            else:
+                stable, changed = 0, True
+            previous = current
+            # stable after a change, or never changed within the grace period
+            if stable >= self.stable_polls and (changed or time.perf_counter() - start >= self.grace_period):
+                settled = True
+                break
+        elapsed = time.perf_counter() - start
+        print(f"screen settled in {elapsed:.2f}s" if settled else f"screen still changing after {elapsed:.2f}s")
+        return elapsed
@@ -0,0 +1,173 @@
+"""
+Structured mouse / keyboard actions for the /action and /batch endpoints.
+
+A batch is a list of dicts, each with an "action" name and its arguments:
+
+    {"action": "move", "x": 100, "y": 200}
+    {"action": "click", "button": "left", "clicks": 2}     x / y optional
+    {"action": "mouse_down"} / {"action": "mouse_up"}      button optional
+    {"action": "drag", "x": 300, "y": 400, "duration": 0.5}
+    {"action": "scroll", "amount": -100}
+    {"action": "key_down", "key": "ctrl"} / {"action": "key_up", "key": "ctrl"}
+    {"action": "press", "key": "enter"}
+    {"action": "type", "text": "hello", "interval": 0.012}
+    {"action": "sleep", "seconds": 1}
+    {"action": "position"}                                 result: [x, y]
+    {"action": "size"}                                     result: [width, height]
+
+Batches run on an ActionWorker, a thread in the server process that keeps
+pyautogui imported, so a hotkey or a click + type + enter sequence costs
+one request and no interpreter launch.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+MOUSE_BUTTONS = ('left', 'right', 'middle')
+
+
+def _number(action: dict, name: str, default=None):
+    value = action.get(name, default)
+    if value is None:
+        raise ValueError(f"{action['action']} requires {name!r}")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{action['action']} {name!r} must be a number, got {value!r}")
+    return value
+
+
+def _string(action: dict, name: str, default=None):
+    value = action.get(name, default)
+    if not isinstance(value, str) or (name != 'text' and not value):
+        raise ValueError(f"{action['action']} {name!r} must be a non-empty string, got {value!r}")
+    return value
+
+
+def _button(action: dict):
+    button = action.get('button', 'left')
+    if button not in MOUSE_BUTTONS:
+        raise ValueError(f"unknown mouse button {button!r}, expected one of {MOUSE_BUTTONS}")
+    return button
+
+
+def _xy(action: dict):
+    """Optional target position, both or neither of x and y."""
+    if action.get('x') is None and action.get('y') is None:
+        return None, None
+    return int(_number(action, 'x')), int(_number(action, 'y'))
+
+
+def validate(action: dict) -> dict:
+    """Normalized copy of one action, raises ValueError on unknown actions or bad arguments."""
+    if not isinstance(action, dict) or 'action' not in action:
+        raise ValueError(f"expected an object with an 'action' field, got {action!r}")
+    name = action['action']
+    if name == 'move':
+        x, y = _xy(action)
+        if x is None:
+            raise ValueError("move requires 'x' and 'y'")
+        return {'action': name, 'x': x, 'y': y, 'duration': _number(action, 'duration', 0)}
+    if name == 'click':
+        x, y = _xy(action)
+        return {'action': name, 'x': x, 'y': y, 'button': _button(action), 'clicks': int(_number(action, 'clicks', 1))}
+    if name in ('mouse_down', 'mouse_up'):
+        return {'action': name, 'button': _button(action)}
+    if name == 'drag':
+        x, y = _xy(action)
+        if x is None:
+            raise ValueError("drag requires 'x' and 'y'")
+        return {'action': name, 'x': x, 'y': y, 'button': _button(action), 'duration': _number(action, 'duration', 0.5)}
+    if name == 'scroll':
+        return {'action': name, 'amount': int(_number(action, 'amount'))}
+    if name in ('key_down', 'key_up', 'press'):
+        return {'action': name, 'key': _string(action, 'key').lower()}
+    if name == 'type':
+        return {'action': name, 'text': _string(action, 'text'), 'interval': _number(action, 'interval', 0)}
+    if name == 'sleep':
+        return {'action': name, 'seconds': _number(action, 'seconds')}
+    if name in ('position', 'size'):
+        return {'action': name}
+    raise ValueError(f"unknown action {name!r}")
+
+
+class ActionWorker:
+    """
+    Executes validated actions on one long-lived thread that keeps pyautogui imported,
+    instead of a python process per command. Batches run one at a time in submission order.
+
+    failsafe: pyautogui's fail-safe, which aborts when the mouse reaches a screen corner. Off by default,
+        as in the per-command scripts ComputerTool used to send: agents legitimately click corners
+        (e.g. the Start button) and nobody is at the VM's mouse to trigger it on purpose.
+    """
+
+    def __init__(self, failsafe: bool = False):
+        import pyautogui
+        pyautogui.FAILSAFE = failsafe
+        self.pyautogui = pyautogui
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='action-worker', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            batch, future = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.execute(batch))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _execute_one(self, action: dict):
+        pyautogui = self.pyautogui
+        name = action['action']
+        if name == 'move':
+            pyautogui.moveTo(action['x'], action['y'], duration=action['duration'])
+        elif name == 'click':
+            pyautogui.click(x=action['x'], y=action['y'], clicks=action['clicks'], button=action['button'])
+        elif name == 'mouse_down':
+            pyautogui.mouseDown(button=action['button'])
+        elif name == 'mouse_up':
+            pyautogui.mouseUp(button=action['button'])
+        elif name == 'drag':
+            pyautogui.dragTo(action['x'], action['y'], duration=action['duration'], button=action['button'])
+        elif name == 'scroll':
+            pyautogui.scroll(action['amount'])
+        elif name == 'key_down':
+            pyautogui.keyDown(action['key'])
+        elif name == 'key_up':
+            pyautogui.keyUp(action['key'])
+        elif name == 'press':
+            pyautogui.press(action['key'])
+        elif name == 'type':
+            pyautogui.typewrite(action['text'], interval=action['interval'])
+        elif name == 'sleep':
+            time.sleep(action['seconds'])
+        elif name == 'position':
+            return list(pyautogui.position())
+        elif name == 'size':
+            return list(pyautogui.size())
+        return None
+
+    def execute(self, batch: list) -> list:
+        """Run a batch on the calling thread, one result per action."""
+        held = []
+        try:
+            results = []
+            for action in batch:
+                results.append(self._execute_one(action))
+                if action['action'] == 'key_down':
+                    held.append(action['key'])
+                elif action['action'] == 'key_up' and action['key'] in held:
+                    held.remove(action['key'])
+            return results
+        except Exception:
+            # do not leave a modifier stuck down when a chord fails half way
+            for key in reversed(held):
+                self.pyautogui.keyUp(key)
+            raise
+
+    def submit(self, batch: list) -> Future:
+        future = Future()
+        self.queue.put((batch, future))
+        return future
@@ -0,0 +1,111 @@
+"""
+Screen capture for the /screenshot, /capture and /stream endpoints.
+
+The cursor sprite is loaded and resized once instead of on every frame.
+A capture can be limited to a region of the screen and downscaled on the
+VM before encoding, and frames can be sent as raw RGB bytes (size in the
+X-Width / X-Height headers) or encoded with a codec spec: png[:zlib level],
+webp (lossless), webp:<quality> or jpeg:<quality>, the same specs as
+OmniParser's util/image_codec.py. The server only needs PIL, so the specs
+are mapped to PIL save arguments here.
+"""
+import functools
+import os
+from io import BytesIO
+from typing import NamedTuple
+
+import pyautogui
+from PIL import Image
+
+CURSOR_PATH = os.path.join(os.path.dirname(__file__), "cursor.png")
+# make the cursor smaller
+CURSOR_SCALE = 1 / 1.5
+RAW_MIME_TYPE = 'application/octet-stream'
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+class Codec(NamedTuple):
+    mime_type: str
+    save_kwargs: dict
+
+
+@functools.lru_cache(maxsize=1)
+def cursor_sprite() -> Image.Image:
+    cursor = Image.open(CURSOR_PATH)
+    return cursor.resize((int(cursor.width * CURSOR_SCALE), int(cursor.height * CURSOR_SCALE)))
+
+
+def parse_region(spec: str | None):
+    """'x,y,width,height' in screen pixels, None for the full screen."""
+    if not spec:
+        return None
+    try:
+        x, y, width, height = (int(v) for v in spec.split(','))
+    except ValueError:
+        raise ValueError(f"region must be 'x,y,width,height', got {spec!r}")
+    if x < 0 or y < 0 or width <= 0 or height <= 0:
+        raise ValueError(f"region must have a non-negative origin and a positive size, got {spec!r}")
+    return x, y, width, height
+
+
+def codec_from_spec(spec: str) -> Codec:
+    """Codec for 'format[:level]', e.g. 'png:1', 'webp', 'jpeg:85'."""
+    format, _, level = spec.lower().partition(':')
+    format = 'jpeg' if format == 'jpg' else format
+    if format not in MIME_TYPES:
+        raise ValueError(f'unsupported image format {format!r}, expected one of {list(MIME_TYPES)}')
+    try:
+        level = int(level) if level else None
+    except ValueError:
+        raise ValueError(f"codec level must be an integer, got {spec!r}")
+    if format == 'png':
+        save_kwargs = {'format': 'PNG', 'compress_level': 1 if level is None else level}
+    elif format == 'jpeg':
+        save_kwargs = {'format': 'JPEG', 'quality': 85 if level is None else level}
+    elif level is None:
+        # method 0 is the fastest lossless WebP effort level
+        save_kwargs = {'format': 'WEBP', 'lossless': True, 'method': 0}
+    else:
+        save_kwargs = {'format': 'WEBP', 'quality': level, 'method': 0}
+    return Codec(MIME_TYPES[format], save_kwargs)
+
+
+def parse_codec(spec: str | None, default):
+    """Codec for spec, 'raw' for unencoded RGB bytes, default when spec is empty."""
+    if not spec:
+        return default
+    if spec == 'raw':
+        return 'raw'
+    return codec_from_spec(spec)
+
+
+def grab(region=None, width: int = None, height: int = None, cursor: bool = True) -> Image.Image:
+    """
+    Screenshot with the cursor drawn on it.
+
+    region: (x, y, width, height) to capture, None for the full screen
+    width, height: downscale to this size, the missing one keeps the aspect ratio. Never upscales.
+    """
+    screenshot = pyautogui.screenshot(region=region)
+    if cursor:
+        cursor_x, cursor_y = pyautogui.position()
+        origin_x, origin_y = region[:2] if region else (0, 0)
+        sprite = cursor_sprite()
+        screenshot.paste(sprite, (cursor_x - origin_x, cursor_y - origin_y), sprite)
+    if width or height:
+        width = width or round(screenshot.width * height / screenshot.height)
+        height = height or round(screenshot.height * width / screenshot.width)
+        if width < screenshot.width or height < screenshot.height:
+            screenshot = screenshot.resize((max(1, min(width, screenshot.width)), max(1, min(height, screenshot.height))), Image.BILINEAR)
+    return screenshot
+
+
+def encode_frame(image: Image.Image, codec) -> tuple[bytes, str]:
+    """(frame bytes, mime type), codec is a Codec or 'raw'."""
+    if codec == 'raw':
+        return image.convert('RGB').tobytes(), RAW_MIME_TYPE
+    if codec.save_kwargs['format'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffered = BytesIO()
+    image.save(buffered, **codec.save_kwargs)
+    return buffered.getvalue(), codec.mime_type
@@ -3,17 +3,25 @@ import logging
 import argparse
 import shlex
 import subprocess
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 import threading
+import time
+import concurrent.futures
 import traceback
 import pyautogui
 from PIL import Image
 from io import BytesIO
+import actions
+import capture
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--log_file", help="log file path", type=str,
                     default=os.path.join(os.path.dirname(__file__), "server.log"))
 parser.add_argument("--port", help="port", type=int, default=5000)
+parser.add_argument("--failsafe", help="enable pyautogui's fail-safe (abort when the mouse reaches a screen corner) for /action", action="store_true")
+parser.add_argument("--action_timeout", help="seconds an /action or /execute request waits for earlier actions to finish, and /action for its own", type=float, default=120)
+parser.add_argument("--screenshot_codec", help="screenshot encoding: png[:zlib level, default 1], webp (lossless), webp:<quality> or jpeg:<quality>", type=str, default="png")
+parser.add_argument("--stream_codec", help="frame encoding of /stream, same specs as --screenshot_codec or raw", type=str, default="jpeg:70")
 args = parser.parse_args()
 
 logging.basicConfig(filename=args.log_file,level=logging.DEBUG, filemode='w' )
@@ -21,7 +29,12 @@ logger = logging.getLogger('werkzeug')
 
 app = Flask(__name__)
 
+screenshot_codec = capture.codec_from_spec(args.screenshot_codec)
+stream_codec = capture.parse_codec(args.stream_codec, screenshot_codec)
+
 computer_control_lock = threading.Lock()
+# keeps pyautogui loaded for /action, /execute still runs arbitrary commands in a subprocess
+action_worker = actions.ActionWorker(failsafe=args.failsafe)
 
 @app.route('/probe', methods=['GET'])
 def probe_endpoint():
@@ -29,8 +42,10 @@ def probe_endpoint():
 
 @app.route('/execute', methods=['POST'])
 def execute_command():
-    # Only execute one command at a time
-    with computer_control_lock:
+    # Only execute one command at a time, a hung /action batch holds the lock until it finishes
+    if not computer_control_lock.acquire(timeout=args.action_timeout):
+        return jsonify({'status': 'error', 'message': 'previous actions still running'}), 503
+    try:
         data = request.json
         # The 'command' key in the JSON request should contain the command to be executed.
         shell = data.get('shell', False)
@@ -59,23 +74,102 @@ def execute_command():
                 'status': 'error',
                 'message': str(e)
             }), 500
+    finally:
+        computer_control_lock.release()
+
+@app.route('/action', methods=['POST'])
+@app.route('/batch', methods=['POST'])
+def execute_actions():
+    """
+    Run structured actions (see actions.py) on the in-process action worker, without spawning python.
+    The body is one action object, or {"actions": [...]} to run several in one request, e.g. every key of a hotkey.
+    """
+    data = request.json or {}
+    try:
+        batch = [actions.validate(action) for action in (data['actions'] if 'actions' in data else [data])]
+    except (ValueError, TypeError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # the lock is released when the worker has finished the batch, not when this request gives up waiting,
+    # so after a timeout the next actions and commands wait for the running one instead of overlapping it
+    if not computer_control_lock.acquire(timeout=args.action_timeout):
+        return jsonify({'status': 'error', 'message': 'previous actions still running'}), 503
+    future = action_worker.submit(batch)
+    future.add_done_callback(lambda _: computer_control_lock.release())
+    try:
+        results = future.result(timeout=args.action_timeout)
+    except concurrent.futures.TimeoutError:
+        return jsonify({'status': 'error', 'message': f'actions still running after {args.action_timeout}s, later requests wait for them'}), 504
+    except Exception as e:
+        logger.error("\n" + traceback.format_exc() + "\n")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return jsonify({'status': 'success', 'results': results})
 
 @app.route('/screenshot', methods=['GET'])
-def capture_screen_with_cursor():    
-    cursor_path = os.path.join(os.path.dirname(__file__), "cursor.png")
+def capture_screen_with_cursor():
+    # Convert PIL Image to bytes and send, ?codec=jpeg:85 overrides the server default for one request
+    try:
+        codec = capture.codec_from_spec(request.args.get('codec')) if request.args.get('codec') else screenshot_codec
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    data, mime_type = capture.encode_frame(capture.grab(), codec)
+    return send_file(BytesIO(data), mimetype=mime_type)
+
+def capture_args(default_codec):
+    """(grab kwargs, codec) from the ?region=x,y,w,h&width=&height=&cursor=0&codec= query of /capture and /stream"""
+    grab_kwargs = {
+        'region': capture.parse_region(request.args.get('region')),
+        'width': request.args.get('width', type=int),
+        'height': request.args.get('height', type=int),
+        'cursor': request.args.get('cursor', '1') != '0',
+    }
+    return grab_kwargs, capture.parse_codec(request.args.get('codec'), default_codec)
+
+@app.route('/capture', methods=['GET'])
+def capture_frame():
+    """One frame, optionally a region and downscaled on the VM, encoded or raw RGB (codec=raw). Size in X-Width / X-Height"""
+    try:
+        grab_kwargs, codec = capture_args(screenshot_codec)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    frame = capture.grab(**grab_kwargs)
+    data, mime_type = capture.encode_frame(frame, codec)
+    response = app.response_class(data, mimetype=mime_type)
+    response.headers['X-Width'] = str(frame.width)
+    response.headers['X-Height'] = str(frame.height)
+    return response
+
+@app.route('/stream', methods=['GET'])
+def stream_frames():
+    """Continuous frames as multipart/x-mixed-replace, same query as /capture plus ?fps= (default 10, at most 30)"""
+    try:
+        grab_kwargs, codec = capture_args(stream_codec)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    interval = 1 / max(0.1, min(request.args.get('fps', 10, type=float), 30))
+
+    def frames():
+        while True:
+            start = time.perf_counter()
+            frame = capture.grab(**grab_kwargs)
+            data, mime_type = capture.encode_frame(frame, codec)
+            yield (f"--frame\r\nContent-Type: {mime_type}\r\nContent-Length: {len(data)}\r\n"
+                   f"X-Width: {frame.width}\r\nX-Height: {frame.height}\r\n\r\n").encode() + data + b"\r\n"
+            time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+    return Response(frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/thumbnail', methods=['GET'])
+def capture_thumbnail():
+    """Tiny grayscale frame (raw 8-bit pixels, size in X-Width / X-Height) for detecting when the screen settles"""
+    width = max(8, min(request.args.get('width', 64, type=int), 512))
     screenshot = pyautogui.screenshot()
-    cursor_x, cursor_y = pyautogui.position()
-    cursor = Image.open(cursor_path)
-    # make the cursor smaller
-    cursor = cursor.resize((int(cursor.width / 1.5), int(cursor.height / 1.5)))
-    screenshot.paste(cursor, (cursor_x, cursor_y), cursor)
-    
-
-    # Convert PIL Image to bytes and send
-    img_io = BytesIO()
-    screenshot.save(img_io, 'PNG')
-    img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    height = max(1, round(screenshot.height * width / screenshot.width))
+    thumbnail = screenshot.resize((width, height), Image.BOX).convert('L')
+    response = app.response_class(thumbnail.tobytes(), mimetype='application/octet-stream')
+    response.headers['X-Width'] = str(width)
+    response.headers['X-Height'] = str(height)
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True, host="0.0.0.0", port=args.port)
\ No newline at end of file
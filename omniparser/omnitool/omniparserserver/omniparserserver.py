@@ -4,22 +4,62 @@ python -m omniparserserver --som_model_path ../../weights/icon_detect/model.pt -
 
 import sys
 import os
+import json
 import time
-from fastapi import FastAPI
+import asyncio
+import uuid
+from collections import OrderedDict
+from functools import partial
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel
+from PIL import Image
 import argparse
 import uvicorn
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(root_dir)
 from util.omniparser import Omniparser
+from util.utils import LazySomOverlay
+from util.timing import LatencyHistograms, timing_context
+from util.batching import MicroBatcher
+from util.inference_executor import InferenceExecutor, InferenceBusy
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Omniparser API')
     parser.add_argument('--som_model_path', type=str, default='../../weights/icon_detect/model.pt', help='Path to the som model')
     parser.add_argument('--caption_model_name', type=str, default='florence2', help='Name of the caption model')
     parser.add_argument('--caption_model_path', type=str, default='../../weights/icon_caption_florence', help='Path to the caption model')
+    parser.add_argument('--caption_backend', type=str, default='pytorch', choices=['pytorch', 'int8', 'onnx'], help='Caption model runtime: int8 dynamic quantization or an ONNX vision encoder (florence2), both for cpu')
+    parser.add_argument('--caption_generation', type=str, default='default', choices=['default', 'greedy'], help='Caption decoding preset, greedy uses a single beam and at most 20 new tokens')
+    parser.add_argument('--caption_early_exit', type=lambda v: str(v).lower() in ('1', 'true', 'yes'), default=False, help='Drop finished captions from the batch while decoding (greedy florence2)')
+    parser.add_argument('--caption_max_new_tokens', type=int, default=None, help='Caption token budget per icon, defaults to the generation preset')
     parser.add_argument('--device', type=str, default='cpu', help='Device to run the model')
     parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05, help='Threshold for box detection')
+    parser.add_argument('--caption_cache_size', type=int, default=4096, help='Number of icon captions kept in the in-memory LRU cache, 0 disables caching')
+    parser.add_argument('--caption_cache_dir', type=str, default=None, help='Optional directory for the on-disk caption cache')
+    parser.add_argument('--incremental_tile_size', type=int, default=128, help='Tile size in pixels used to find changed regions for incremental parsing')
+    parser.add_argument('--incremental_max_dirty_ratio', type=float, default=0.5, help='Fall back to a full parse when more than this fraction of the screen changed')
+    parser.add_argument('--incremental_max_sessions', type=int, default=16, help='Number of sessions whose last frame is kept for incremental parsing, least recently used ones are dropped')
+    parser.add_argument('--parallel_stages', type=lambda v: str(v).lower() in ('1', 'true', 'yes'), default=True, help='Run OCR and YOLO detection concurrently')
+    parser.add_argument('--max_batch_size', type=int, default=4, help='Maximum number of concurrent /parse/ requests coalesced into one batch')
+    parser.add_argument('--max_batch_wait_ms', type=float, default=20.0, help='How long a request waits for others to join its batch')
+    parser.add_argument('--max_pending', type=int, default=16, help='Maximum number of /parse/ requests in flight, further requests get a 503')
+    parser.add_argument('--som_store_size', type=int, default=8, help='Number of SOM images (rendered or lazy) kept for download from /som/{id}')
+    parser.add_argument('--som_render_policy', type=str, default='eager', choices=['eager', 'lazy', 'none'], help='Default SOM overlay rendering when a request does not set som: eager (inline base64), lazy (drawn on GET /som/{id}) or none')
+    parser.add_argument('--som_codec', type=str, default='png', help="Encoding of the SOM image: png[:zlib level, default 1], webp (lossless), webp:<quality> or jpeg:<quality>")
+    parser.add_argument('--yolo_backend', type=str, default='pytorch', choices=['pytorch', 'onnx', 'torchscript', 'openvino'], help='Icon detector runtime, exported backends are built next to the weights on first use')
+    parser.add_argument('--yolo_imgsz_buckets', type=int, nargs='*', default=None, help='Fixed detector input sizes, e.g. 640 1280; each request uses the smallest one that fits')
+    parser.add_argument('--yolo_tile_size', type=int, default=None, help='Detect frames larger than this on overlapping tiles of this size at native resolution, e.g. 1280 for 4K screens')
+    parser.add_argument('--yolo_tile_overlap', type=float, default=0.2, help='Overlap between neighbouring tiles, as a fraction of the tile size')
+    parser.add_argument('--yolo_tile_batch_size', type=int, default=4, help='Tiles per detector call, bounds detector memory')
+    parser.add_argument('--ocr_backend', type=str, default='easyocr', choices=['easyocr', 'paddleocr'], help='OCR engine')
+    parser.add_argument('--ocr_workers', type=int, default=1, help='Number of warm OCR readers, i.e. frames or dirty regions recognized in parallel')
+    parser.add_argument('--ocr_cache_size', type=int, default=8192, help='Number of recognized text boxes kept in the OCR cache, 0 disables it')
+    parser.add_argument('--ocr_cache_max_mb', type=float, default=16, help='Approximate memory budget of the OCR cache')
+    parser.add_argument('--warmup', type=lambda v: str(v).lower() in ('1', 'true', 'yes'), default=True, help='Run blank frames through the models at startup')
+    parser.add_argument('--warmup_size', type=int, nargs=2, default=[1920, 1080], help='Width and height of the warm-up frame')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host for the API')
     parser.add_argument('--port', type=int, default=8000, help='Port for the API')
     args = parser.parse_args()
@@ -30,22 +70,147 @@ config = vars(args)
 
 app = FastAPI()
 omniparser = Omniparser(config)
+stage_latency = LatencyHistograms()
+
+def parse_batch(items):
+    timings = {}
+    images = [image for image, _ in items]
+    som_formats = [som_format for _, som_format in items]
+    results = omniparser.parse_many(images, timings=timings, som_formats=som_formats)
+    # the stage timings are shared by the whole batch, record them once rather than once per request
+    stage_latency.observe_all(timings)
+    return [(dino_labled_img, parsed_content_list, timings, len(items)) for dino_labled_img, parsed_content_list in results]
+
+# the models are not thread safe, so every model call goes through one worker; the event loop stays free for /probe/ and /metrics
+inference = InferenceExecutor(max_workers=1, max_pending=args.max_pending, name='omniparser')
+parse_batcher = MicroBatcher(parse_batch, max_batch_size=args.max_batch_size, max_wait_ms=args.max_batch_wait_ms, executor=inference)
+
+# SOM images waiting to be downloaded from /som/{id}: PNG bytes for som=url, LazySomOverlay (frame + final boxes) for som=lazy
+som_store = OrderedDict()
 
 class ParseRequest(BaseModel):
     base64_image: str
+    incremental: bool = False
+    session_id: str = 'default'
+    som: Optional[str] = None
+
+# how the labeled image is returned: inline base64, as a second part of a multipart/mixed response,
+# drawn now and stored for GET /som/{id}, drawn only when GET /som/{id} is called, or not at all
+SOM_FORMATS = {'base64': 'base64', 'inline': 'png', 'url': 'png', 'lazy': 'lazy', 'none': None}
+DEFAULT_SOM = {'eager': 'base64', 'lazy': 'lazy', 'none': 'none'}[args.som_render_policy]
+
+async def read_parse_request(request: Request):
+    """
+    Accepts the original JSON body, a raw image body (application/octet-stream or image/*) or a
+    multipart form with an `image` file. For the binary forms the options come from the query string.
+    Returns (ParseRequest, image) where image is the base64 string or the raw bytes.
+    """
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        try:
+            parse_request = ParseRequest(**(await request.json()))
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return parse_request, parse_request.base64_image
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        if 'image' not in form:
+            raise HTTPException(status_code=400, detail="multipart body needs an 'image' file field")
+        image = await form['image'].read()
+        options = {**request.query_params, **{k: v for k, v in form.items() if k != 'image'}}
+    else:
+        image = await request.body()
+        options = dict(request.query_params)
+    if not image:
+        raise HTTPException(status_code=400, detail='empty image')
+    return ParseRequest(base64_image='', incremental=str(options.get('incremental', 'false')).lower() in ('1', 'true', 'yes'),
+                        session_id=options.get('session_id', 'default'), som=options.get('som')), image
+
+def decode_image(image, timings):
+    with timing_context(timings):
+        return omniparser.decode_image(image)
 
 @app.post("/parse/")
-async def parse(parse_request: ParseRequest):
+async def parse(request: Request):
     print('start parsing...')
     start = time.time()
-    dino_labled_img, parsed_content_list = omniparser.parse(parse_request.base64_image)
+    parse_request, image = await read_parse_request(request)
+    som = parse_request.som or DEFAULT_SOM
+    if som not in SOM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"som must be one of {list(SOM_FORMATS)}")
+    som_format = SOM_FORMATS[som]
+    # decode before batching, so a corrupt upload fails alone instead of failing every request batched with it
+    decode_timings = {}
+    try:
+        image = await asyncio.get_running_loop().run_in_executor(None, decode_image, image, decode_timings)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=400, detail=f'could not decode image: {e}')
+    try:
+        with inference.admit():
+            if parse_request.incremental:
+                # incremental parses depend on per-session state, run them alone on the same model thread
+                timings = {}
+                batch_size = 1
+                parse_fn = partial(omniparser.parse, image, incremental=True, session_id=parse_request.session_id, timings=timings, som_format=som_format)
+                dino_labled_img, parsed_content_list = await asyncio.get_running_loop().run_in_executor(inference, parse_fn)
+                stage_latency.observe_all(timings)
+            else:
+                dino_labled_img, parsed_content_list, timings, batch_size = await parse_batcher.submit((image, som_format))
+    except InferenceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
     latency = time.time() - start
     print('time:', latency)
-    return {"som_image_base64": dino_labled_img, "parsed_content_list": parsed_content_list, 'latency': latency}
+    stage_latency.observe_all(decode_timings)
+    stage_latency.observe('total', latency)
+    timings = {**decode_timings, **timings}
+    response = {"parsed_content_list": parsed_content_list, 'latency': latency, 'timings': timings, 'batch_size': batch_size}
+    if som != 'none':
+        response['som_image_mime'] = omniparser.som_codec.mime_type
+    if som == 'base64':
+        response['som_image_base64'] = dino_labled_img
+    elif som in ('url', 'lazy'):
+        som_id = uuid.uuid4().hex
+        som_store[som_id] = dino_labled_img
+        while len(som_store) > args.som_store_size:
+            som_store.popitem(last=False)
+        response['som_image_url'] = f'/som/{som_id}'
+    if omniparser.caption_cache is not None:
+        response['caption_cache'] = omniparser.caption_cache.stats()
+    if omniparser.ocr_cache is not None:
+        response['ocr_cache'] = omniparser.ocr_cache.stats()
+    if som == 'inline':
+        # the JSON and the labeled image in one round trip, without base64
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Type: application/json\r\n\r\n'.encode() + json.dumps(jsonable_encoder(response)).encode() +
+                f'\r\n--{boundary}\r\nContent-Type: {omniparser.som_codec.mime_type}\r\n\r\n'.encode() + dino_labled_img +
+                f'\r\n--{boundary}--\r\n'.encode())
+        return Response(content=body, media_type=f'multipart/mixed; boundary={boundary}')
+    return response
+
+@app.get("/som/{som_id}")
+async def get_som_image(som_id: str):
+    som_image = som_store.get(som_id)
+    if som_image is None:
+        raise HTTPException(status_code=404, detail='SOM image not found or expired')
+    if isinstance(som_image, LazySomOverlay):
+        # drawing is plain CPU work on the cached detections, keep it off the event loop and the model thread
+        som_image, _ = await asyncio.get_running_loop().run_in_executor(None, som_image.render, 'png')
+    return Response(content=som_image, media_type=omniparser.som_codec.mime_type)
+
+@app.get("/metrics")
+async def metrics():
+    batch_stats = parse_batcher.stats()
+    lines = [
+        '# TYPE omniparser_parse_batches_total counter',
+        f'omniparser_parse_batches_total {batch_stats["batches"]}',
+        '# TYPE omniparser_parse_batched_requests_total counter',
+        f'omniparser_parse_batched_requests_total {batch_stats["items"]}',
+    ]
+    return PlainTextResponse(stage_latency.render() + '\n'.join(lines) + '\n' + inference.render_metrics('omniparser_inference'), media_type="text/plain; version=0.0.4")
 
 @app.get("/probe/")
 async def root():
-    return {"message": "Omniparser API ready"}
+    return {"message": "Omniparser API ready", "inference": inference.stats()}
 
 if __name__ == "__main__":
     uvicorn.run("omniparserserver:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.tiling import merge_tiled_detections, tile_grid, truncated_mask
+
+WIDTH, HEIGHT = 2400, 1280
+TILES = tile_grid(WIDTH, HEIGHT, tile_size=1280, overlap=0.2)
+
+
+def merge(boxes, scores, tile_ids):
+    boxes = np.asarray(boxes, dtype=np.float64)
+    truncated = np.array([truncated_mask(box[None], TILES[t], WIDTH, HEIGHT)[0] for box, t in zip(boxes, tile_ids)])
+    return merge_tiled_detections(boxes, np.asarray(scores, dtype=np.float64), truncated, np.asarray(tile_ids), TILES).tolist()
+
+
+def test_icon_inside_panel_of_the_same_tile_is_kept():
+    assert merge([[100, 100, 400, 400], [200, 200, 230, 230]], [0.9, 0.5], [0, 0]) == [0, 1]
+
+
+def test_duplicate_seen_by_both_tiles_is_merged():
+    assert merge([[1100, 50, 1150, 100], [1101, 51, 1150, 100]], [0.9, 0.8], [0, 1]) == [0]
+
+
+def test_fragment_cut_by_tile_border_loses_to_the_whole_icon():
+    # tile 0 ends at x=1280, its copy of the icon is cut there
+    assert merge([[1240, 50, 1280, 100], [1240, 50, 1300, 100]], [0.9, 0.5], [0, 1]) == [1]
+
+
+def test_whole_icon_inside_a_panel_of_the_neighbouring_tile_is_kept():
+    assert merge([[1100, 300, 1400, 600], [1110, 310, 1140, 340]], [0.9, 0.5], [1, 0]) == [0, 1]
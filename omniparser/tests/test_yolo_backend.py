@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.yolo_backend import YoloDetector
+
+
+class RecordingModel:
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, source, imgsz, **kwargs):
+        self.calls.append(imgsz)
+        return []
+
+
+def make_detector(buckets):
+    # skip __init__, which loads the Ultralytics weights
+    detector = YoloDetector.__new__(YoloDetector)
+    detector.backend = 'onnx'
+    detector.device = None
+    detector.imgsz_buckets = sorted(buckets)
+    detector.model = RecordingModel()
+    detector.model_for = lambda bucket: detector.model
+    return detector
+
+
+def test_full_hd_frame_without_imgsz_uses_the_bucket_that_fits():
+    detector = make_detector([640, 1280, 1920])
+    detector.predict(source=Image.new('RGB', (1920, 1080)), conf=0.05, iou=0.1)
+    assert detector.model.calls == [1920]
+
+
+def test_frame_size_from_array_and_list():
+    detector = make_detector([640, 1280, 1920])
+    assert detector.source_size(np.zeros((1080, 1920, 3), dtype=np.uint8)) == 1920
+    assert detector.source_size([Image.new('RGB', (800, 600)), Image.new('RGB', (1280, 720))]) == 1280
+    assert detector.bucket_for(detector.source_size(Image.new('RGB', (800, 600)))) == 1280
+
+
+def test_explicit_imgsz_wins_over_frame_size():
+    detector = make_detector([640, 1280, 1920])
+    detector.predict(source=Image.new('RGB', (1920, 1080)), imgsz=640)
+    assert detector.model.calls == [640]
+
+
+def test_warmup_only_runs_the_bucket_of_each_size():
+    detector = make_detector([640, 1280, 1920])
+    detector.warmup(sizes=[(1920, 1080)], runs=1)
+    assert detector.model.calls == [1920]
@@ -0,0 +1,86 @@
+"""
+Dynamic micro-batching for model servers.
+
+Concurrent requests are queued; a single worker task takes the first one,
+waits up to `max_wait_ms` for more (up to `max_batch_size`), runs the whole
+batch through `process_batch` on an executor thread so the event loop stays
+free, and resolves each request's future with its own result.
+"""
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent `submit` calls into batches.
+
+    Attributes:
+        process_batch (Callable[[List[Any]], List[Any]]): blocking function mapping a list of
+            items to a list of results in the same order
+        max_batch_size (int): maximum number of items per batch
+        max_wait_ms (float): how long the first item of a batch waits for company
+        executor (Executor): where `process_batch` runs, a single worker by default so model
+            calls never overlap
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 4, max_wait_ms: float = 20.0, executor: Optional[Executor] = None):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro-batcher')
+        self._queue = None
+        self._worker = None
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -6,6 +6,8 @@ import numpy as np
 from supervision.detection.core import Detections
 from supervision.draw.color import Color, ColorPalette
 
+from util.spatial_index import GridIndex
+
 
 class BoxAnnotator:
     """
@@ -85,6 +87,10 @@ class BoxAnnotator:
             ```
         """
         font = cv2.FONT_HERSHEY_SIMPLEX
+        # label placement checks every candidate position against all boxes, index them once per frame
+        occupancy = GridIndex(detections.xyxy.astype(int)) if self.avoid_overlap and not skip_label else None
+        # labels are mostly short numbers, measure each distinct string once
+        text_sizes = {}
         for i in range(len(detections)):
             x1, y1, x2, y2 = detections.xyxy[i].astype(int)
             class_id = (
@@ -112,12 +118,14 @@ class BoxAnnotator:
                 else labels[i]
             )
 
-            text_width, text_height = cv2.getTextSize(
-                text=text,
-                fontFace=font,
-                fontScale=self.text_scale,
-                thickness=self.text_thickness,
-            )[0]
+            if text not in text_sizes:
+                text_sizes[text] = cv2.getTextSize(
+                    text=text,
+                    fontFace=font,
+                    fontScale=self.text_scale,
+                    thickness=self.text_thickness,
+                )[0]
+            text_width, text_height = text_sizes[text]
 
             if not self.avoid_overlap:
                 text_x = x1 + self.text_padding
@@ -135,7 +143,7 @@ class BoxAnnotator:
                 # text_background_x2 = x1
                 # text_background_y2 = y1 + 2 * self.text_padding + text_height
             else:
-                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size)
+                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, occupancy=occupancy)
 
             cv2.rectangle(
                 img=scene,
@@ -186,23 +194,25 @@ def IoU(box1, box2, return_max=True):
         return intersection / union
 
 
-def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size):
+def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, occupancy=None):
     """ check overlap of text and background detection box, and get_optimal_label_pos, 
         pos: str, position of the text, must be one of 'top left', 'top right', 'outer left', 'outer right' TODO: if all are overlapping, return the last one, i.e. outer right
         Threshold: default to 0.3
+        occupancy: optional GridIndex over detections.xyxy.astype(int), built here when not given
     """
+    if occupancy is None:
+        occupancy = GridIndex(detections.xyxy.astype(int))
 
     def get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size):
-        is_overlap = False
-        for i in range(len(detections)):
-            detection = detections.xyxy[i].astype(int)
-            if IoU([text_background_x1, text_background_y1, text_background_x2, text_background_y2], detection) > 0.3:
-                is_overlap = True
-                break
         # check if the text is out of the image
         if text_background_x1 < 0 or text_background_x2 > image_size[0] or text_background_y1 < 0 or text_background_y2 > image_size[1]:
-            is_overlap = True
-        return is_overlap
+            return True
+        # only boxes that intersect the label can reach the IoU threshold
+        label_box = [int(text_background_x1), int(text_background_y1), int(text_background_x2), int(text_background_y2)]
+        for i in occupancy.intersecting(label_box):
+            if IoU(label_box, occupancy.boxes[i].tolist()) > 0.3:
+                return True
+        return False
     
     # if pos == 'top left':
     text_x = x1 + text_padding
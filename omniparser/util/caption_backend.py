@@ -0,0 +1,131 @@
+"""
+Caption model backends and decoding presets for CPU inference.
+
+`get_caption_model_processor` loads Florence2 / BLIP2 in fp32 on CPU, which
+is the slowest option on CPU-only inference nodes. Backends:
+
+    pytorch   the model as loaded (default)
+    int8      dynamic int8 quantization of every nn.Linear (weights int8,
+              activations quantized on the fly), CPU only
+    onnx      Florence2 only: the DaViT vision encoder, which dominates CPU
+              time at 768x768, runs in ONNX Runtime; the language model keeps
+              decoding in PyTorch with int8 linears. The encoder is exported
+              next to the weights (vision_encoder.onnx) on first use.
+
+Presets select the `generate` arguments. 'default' keeps each model's
+original decoding (BLIP2 beam search with 5 beams); 'greedy' decodes with a
+single beam and a short token budget.
+"""
+import os
+from typing import Dict, Optional
+
+import torch
+
+CAPTION_BACKENDS = ('pytorch', 'int8', 'onnx')
+GENERATION_PRESETS = {
+    'default': {
+        'florence2': {'max_new_tokens': 20, 'num_beams': 1, 'do_sample': False},
+        'blip2': {'max_length': 100, 'num_beams': 5, 'no_repeat_ngram_size': 2, 'early_stopping': True, 'num_return_sequences': 1},
+    },
+    'greedy': {
+        'florence2': {'max_new_tokens': 20, 'num_beams': 1, 'do_sample': False},
+        'blip2': {'max_new_tokens': 20, 'num_beams': 1, 'do_sample': False, 'no_repeat_ngram_size': 2},
+    },
+}
+
+
+def generation_kwargs(model_name: str, preset: str = 'default') -> Dict:
+    if preset not in GENERATION_PRESETS:
+        raise ValueError(f'unknown caption generation preset {preset!r}, expected one of {list(GENERATION_PRESETS)}')
+    return dict(GENERATION_PRESETS[preset].get(model_name, {}))
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of the linear layers, in place of the fp32 model."""
+    if model.device.type != 'cpu':
+        raise ValueError('int8 dynamic quantization is only supported on cpu')
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class _Florence2VisionEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model._encode_image(pixel_values)
+
+
+class OnnxFlorence2:
+    """
+    Florence2 with the vision encoder in ONNX Runtime, a drop-in for the model in caption_model_processor.
+
+    Attributes:
+        model: the PyTorch Florence2 model, used for the text embeddings and decoding
+        onnx_path (str): exported vision encoder
+    """
+
+    def __init__(self, model, onnx_path: str, image_size: int = 768, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+        self.model = model
+        self.onnx_path = onnx_path
+        if not os.path.exists(onnx_path):
+            print(f'exporting the Florence2 vision encoder to {onnx_path}...')
+            dummy = torch.zeros((1, 3, image_size, image_size), dtype=torch.float32)
+            with torch.inference_mode():
+                torch.onnx.export(_Florence2VisionEncoder(model).eval(), (dummy,), onnx_path, input_names=['pixel_values'], output_names=['image_features'],
+                                  dynamic_axes={'pixel_values': {0: 'batch'}, 'image_features': {0: 'batch'}}, opset_version=17)
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+    @property
+    def config(self):
+        return self.model.config
+
+    @property
+    def device(self):
+        return self.model.device
+
+    @property
+    def dtype(self):
+        return self.model.dtype
+
+    def _encode_image(self, pixel_values):
+        return torch.from_numpy(self.session.run(None, {'pixel_values': pixel_values.float().cpu().numpy()})[0])
+
+    def get_input_embeddings(self):
+        return self.model.get_input_embeddings()
+
+    def _merge_input_ids_with_image_features(self, image_features, inputs_embeds):
+        return self.model._merge_input_ids_with_image_features(image_features, inputs_embeds)
+
+    @property
+    def language_model(self):
+        return self.model.language_model
+
+    def generate(self, input_ids, pixel_values, attention_mask=None, **kwargs):
+        """Same contract as Florence2ForConditionalGeneration.generate with pixel_values."""
+        image_features = self._encode_image(pixel_values)
+        inputs_embeds = self.model.get_input_embeddings()(input_ids)
+        inputs_embeds, attention_mask = self.model._merge_input_ids_with_image_features(image_features.to(inputs_embeds.dtype), inputs_embeds)
+        return self.model.language_model.generate(input_ids=None, inputs_embeds=inputs_embeds, attention_mask=attention_mask, **kwargs)
+
+
+def apply_caption_backend(caption_model_processor: Dict, model_name: str, model_name_or_path: str, backend: str = 'pytorch') -> Dict:
+    """Swap the model in a caption_model_processor dict for the requested backend."""
+    if backend not in CAPTION_BACKENDS:
+        raise ValueError(f'unknown caption backend {backend!r}, expected one of {CAPTION_BACKENDS}')
+    model = caption_model_processor['model']
+    if backend == 'int8':
+        model = quantize_int8(model)
+    elif backend == 'onnx':
+        if model_name != 'florence2':
+            raise ValueError('the onnx caption backend is only available for florence2')
+        size = caption_model_processor['processor'].image_processor.size
+        image_size = size.get('height', size.get('shortest_edge', 768))
+        onnx_dir = model_name_or_path if os.path.isdir(model_name_or_path) else '.'
+        model.language_model = quantize_int8(model.language_model)
+        model = OnnxFlorence2(model, os.path.join(onnx_dir, 'vision_encoder.onnx'), image_size=image_size)
+    return {**caption_model_processor, 'model': model}
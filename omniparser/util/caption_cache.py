@@ -0,0 +1,96 @@
+"""
+Content-addressed cache for icon captions.
+
+Consecutive agent steps mostly show the same toolbar / taskbar icons, so
+captions are cached by a hash of the 64x64 crop together with the caption
+model id and prompt. Entries live in an in-memory LRU and, optionally, in
+an on-disk directory that survives server restarts.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class CaptionCache:
+    """
+    LRU cache mapping crop hashes to captions.
+
+    Attributes:
+        max_entries (int): maximum number of captions kept in memory
+        cache_dir (Optional[str]): directory for the on-disk layer, disabled when None
+    """
+
+    def __init__(self, max_entries: int = 4096, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(crop: np.ndarray, model_id: str, prompt: str) -> str:
+        """Exact hash of a uint8 crop plus the caption model id and prompt."""
+        digest = hashlib.sha1(np.ascontiguousarray(crop).tobytes())
+        digest.update(f"{crop.shape}|{model_id}|{prompt}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.txt')
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        caption = None
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                caption = f.read()
+        with self._lock:
+            if caption is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, caption)
+        return caption
+
+    def put(self, key: str, caption: str):
+        with self._lock:
+            self._insert(key, caption)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(caption)
+            os.replace(tmp_path, path)
+
+    def _insert(self, key: str, caption: str):
+        self._entries[key] = caption
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, keys: List[str]) -> List[Optional[str]]:
+        return [self.get(key) for key in keys]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,92 @@
+"""
+Early-exit greedy decoding for Florence2 icon captions.
+
+`model.generate` keeps decoding the whole batch until its longest caption
+finishes, so one verbose icon holds up a batch of two-word ones. This
+scheduler runs the same greedy loop by hand and drops every finished row
+from the batch (its decoder state, encoder states and attention mask), so
+each step only computes the captions still being written. Every icon can
+also get its own token budget.
+
+Only greedy decoding (num_beams=1, no sampling) is scheduled; the logits
+processors `generate` would apply from the model's generation config
+(no-repeat n-grams, forced BOS / EOS) are applied the same way, so the
+captions match `generate` with the same max_new_tokens.
+"""
+from typing import List, Sequence, Union
+
+import torch
+
+
+def supports_early_exit(model_name: str, generation: dict) -> bool:
+    """Florence2 (PyTorch or ONNX-encoder backend, model_name as passed to get_caption_model_processor) with greedy decoding."""
+    return model_name == 'florence2' and generation.get('num_beams', 1) == 1 and not generation.get('do_sample', False)
+
+
+def _select_past(past_key_values, keep: torch.Tensor):
+    if hasattr(past_key_values, 'reorder_cache'):
+        past_key_values.reorder_cache(keep)
+        return past_key_values
+    return tuple(tuple(state.index_select(0, keep) for state in layer) for layer in past_key_values)
+
+
+@torch.inference_mode()
+def generate_early_exit(model, input_ids: torch.Tensor, pixel_values: torch.Tensor, max_new_tokens: Union[int, Sequence[int]] = 20, no_repeat_ngram_size: int = None) -> List[List[int]]:
+    """
+    Greedy Florence2 captioning with finished rows removed from the batch.
+
+    max_new_tokens: a token budget for the whole batch or one per crop
+    Returns the generated token ids of every crop, in input order.
+    """
+    from transformers import LogitsProcessorList, NoRepeatNGramLogitsProcessor, ForcedBOSTokenLogitsProcessor
+    from transformers.modeling_outputs import BaseModelOutput
+
+    language_model = model.language_model
+    config = language_model.generation_config
+    batch = len(input_ids)
+    device = input_ids.device
+    budgets = torch.as_tensor([max_new_tokens] * batch if isinstance(max_new_tokens, int) else list(max_new_tokens), device=device)
+
+    image_features = model._encode_image(pixel_values)
+    inputs_embeds = model.get_input_embeddings()(input_ids)
+    inputs_embeds, attention_mask = model._merge_input_ids_with_image_features(image_features.to(device=device, dtype=inputs_embeds.dtype), inputs_embeds)
+    encoder_states = language_model.get_encoder()(inputs_embeds=inputs_embeds, attention_mask=attention_mask).last_hidden_state
+
+    processors = LogitsProcessorList()
+    ngram = config.no_repeat_ngram_size if no_repeat_ngram_size is None else no_repeat_ngram_size
+    if ngram:
+        processors.append(NoRepeatNGramLogitsProcessor(ngram))
+    if config.forced_bos_token_id is not None:
+        processors.append(ForcedBOSTokenLogitsProcessor(config.forced_bos_token_id))
+    eos_token_ids = torch.as_tensor(config.eos_token_id if isinstance(config.eos_token_id, (list, tuple)) else [config.eos_token_id], device=device)
+    forced_eos_token_id = config.forced_eos_token_id
+
+    active = torch.arange(batch, device=device)
+    sequences = torch.full((batch, 1), config.decoder_start_token_id, dtype=torch.long, device=device)
+    outputs = [[] for _ in range(batch)]
+    past_key_values = None
+    step = 0
+    while len(active):
+        result = language_model(encoder_outputs=BaseModelOutput(last_hidden_state=encoder_states), attention_mask=attention_mask,
+                                decoder_input_ids=sequences[:, -1:], past_key_values=past_key_values, use_cache=True)
+        past_key_values = result.past_key_values
+        scores = processors(sequences, result.logits[:, -1, :])
+        tokens = scores.argmax(dim=-1)
+        step += 1
+        budget = budgets[active]
+        if forced_eos_token_id is not None:
+            # generate forces EOS as the last token allowed by max_length
+            tokens = torch.where(budget == step, torch.full_like(tokens, forced_eos_token_id), tokens)
+        sequences = torch.cat([sequences, tokens[:, None]], dim=1)
+        for row, token in zip(active.tolist(), tokens.tolist()):
+            outputs[row].append(token)
+
+        finished = torch.isin(tokens, eos_token_ids) | (budget <= step)
+        if finished.all():
+            break
+        if finished.any():
+            keep = torch.nonzero(~finished).squeeze(1)
+            active, sequences = active[keep], sequences[keep]
+            encoder_states, attention_mask = encoder_states[keep], attention_mask[keep]
+            past_key_values = _select_past(past_key_values, keep)
+    return outputs
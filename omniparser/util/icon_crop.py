@@ -0,0 +1,85 @@
+"""
+Batched icon crop stage for the caption models.
+
+All icon boxes are cropped and bilinearly resized with one batched gather on
+the caption model's device, producing `pixel_values` that can be fed straight to
+`model.generate` without the numpy -> PIL -> tensor round trip per crop.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def _sample_grid(lo: torch.Tensor, hi: torch.Tensor, size: int):
+    """
+    Bilinear sample positions of cv2.resize along one axis, for crops spanning pixels [lo, hi).
+
+    Returns (i0, i1, weight), each (N, size): the two source pixels of every output pixel and the weight of i1.
+    Positions are clamped to the crop like cv2 does at the border, so no pixel outside the box is read.
+    """
+    steps = torch.arange(size, dtype=torch.float32, device=lo.device) + 0.5
+    scale = (hi - lo).clamp(min=1).float()[:, None] / size
+    pos = (lo.float()[:, None] + steps * scale - 0.5).clamp(lo.float()[:, None], (hi - 1).clamp(min=lo).float()[:, None])
+    i0 = pos.floor()
+    weight = pos - i0
+    i0 = i0.long()
+    i1 = torch.minimum(i0 + 1, (hi - 1).clamp(min=lo)[:, None])
+    return i0, i1, weight
+
+
+def crop_icon_batch(image_source: np.ndarray, boxes: torch.Tensor, size: int = 64, device=None) -> torch.Tensor:
+    """
+    Crop every box out of the screenshot and resize it to size x size.
+
+    Same result as cv2.resize(image_source[ymin:ymax, xmin:xmax], (size, size)) per box (bilinear,
+    border pixels replicated), for up- and downsampled crops alike, up to cv2's fixed-point rounding.
+
+    Args:
+        image_source (np.ndarray): HxWx3 uint8 screenshot
+        boxes (torch.Tensor): (N, 4) boxes in normalized xyxy format
+        size (int): side length of each crop
+        device: device the crops are produced on, defaults to cpu
+
+    Returns:
+        torch.Tensor: (N, 3, size, size) float32 crops in [0, 255]
+    """
+    h, w = image_source.shape[:2]
+    image = torch.from_numpy(np.ascontiguousarray(image_source)).to(device)
+    image = image.permute(2, 0, 1).float()
+    if len(boxes) == 0:
+        return image.new_zeros((0, 3, size, size))
+    # same integer pixel bounds as slicing image_source[ymin:ymax, xmin:xmax]
+    bounds = (boxes.to(device=device, dtype=torch.float64) * torch.tensor([w, h, w, h], dtype=torch.float64, device=device)).floor().long()
+    x_lo, x_hi = bounds[:, 0].clamp(0, w - 1), bounds[:, 2].clamp(1, w)
+    y_lo, y_hi = bounds[:, 1].clamp(0, h - 1), bounds[:, 3].clamp(1, h)
+    x0, x1, wx = _sample_grid(x_lo, x_hi, size)
+    y0, y1, wy = _sample_grid(y_lo, y_hi, size)
+    # separable bilinear interpolation gathered for all crops at once: (3, N, size, size)
+    wx, wy = wx[:, None, :], wy[:, :, None]
+    top = image[:, y0[:, :, None], x0[:, None, :]] * (1 - wx) + image[:, y0[:, :, None], x1[:, None, :]] * wx
+    bottom = image[:, y1[:, :, None], x0[:, None, :]] * (1 - wx) + image[:, y1[:, :, None], x1[:, None, :]] * wx
+    return (top * (1 - wy) + bottom * wy).permute(1, 0, 2, 3).contiguous()
+
+
+def preprocess_icon_batch(crops: torch.Tensor, image_processor, do_resize: bool = True, dtype=torch.float32) -> torch.Tensor:
+    """
+    Apply the caption processor's resize / rescale / normalize steps to a crop batch.
+
+    Mirrors `image_processor(images=..., return_tensors="pt")` for square RGB crops,
+    but stays on the crops' device.
+    """
+    if do_resize and getattr(image_processor, 'do_resize', True):
+        size = image_processor.size
+        if 'height' in size:
+            target = (size['height'], size['width'])
+        else:
+            target = (size['shortest_edge'], size['shortest_edge'])
+        if tuple(crops.shape[-2:]) != target:
+            crops = F.interpolate(crops, size=target, mode='bicubic', align_corners=False).clamp_(0, 255)
+    if getattr(image_processor, 'do_rescale', True):
+        crops = crops * image_processor.rescale_factor
+    if getattr(image_processor, 'do_normalize', True):
+        mean = torch.tensor(image_processor.image_mean, dtype=crops.dtype, device=crops.device).view(1, -1, 1, 1)
+        std = torch.tensor(image_processor.image_std, dtype=crops.dtype, device=crops.device).view(1, -1, 1, 1)
+        crops = (crops - mean) / std
+    return crops.to(dtype)
@@ -0,0 +1,84 @@
+"""
+Configurable image encoding for SOM overlays and screenshots.
+
+PIL's default PNG settings (zlib level 6) take a large share of a step on
+1920x1080+ frames. An `ImageCodec` picks the format and its speed / size
+knobs once, from a short spec string:
+
+    png        lossless PNG, compress level 1 (fast)
+    png:6      PNG with an explicit zlib level, 0-9
+    webp       lossless WebP
+    webp:80    lossy WebP at quality 80
+    jpeg:85    JPEG at quality 85, for images that are only sent to an LLM
+"""
+import io
+from typing import Union
+
+import numpy as np
+from PIL import Image
+
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+DEFAULT_PNG_COMPRESS_LEVEL = 1
+DEFAULT_JPEG_QUALITY = 85
+
+
+class ImageCodec:
+    """
+    Attributes:
+        format (str): 'png', 'webp' or 'jpeg'
+        level (int): PNG zlib level for png, quality for jpeg and lossy webp, None for lossless webp
+    """
+
+    def __init__(self, format: str = 'png', level: int = None):
+        format = format.lower()
+        if format == 'jpg':
+            format = 'jpeg'
+        if format not in MIME_TYPES:
+            raise ValueError(f'unsupported image format {format!r}, expected one of {list(MIME_TYPES)}')
+        if level is None and format == 'png':
+            level = DEFAULT_PNG_COMPRESS_LEVEL
+        if level is None and format == 'jpeg':
+            level = DEFAULT_JPEG_QUALITY
+        self.format = format
+        self.level = level
+
+    @classmethod
+    def from_spec(cls, spec: Union[str, 'ImageCodec', None]) -> 'ImageCodec':
+        """Build a codec from 'format[:level]', e.g. 'png:1', 'webp', 'jpeg:85'. None gives the default PNG codec."""
+        if isinstance(spec, ImageCodec):
+            return spec
+        if not spec:
+            return cls()
+        format, _, level = spec.partition(':')
+        return cls(format, int(level) if level else None)
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @property
+    def spec(self) -> str:
+        return self.format if self.level is None else f'{self.format}:{self.level}'
+
+    def save_kwargs(self) -> dict:
+        if self.format == 'png':
+            return {'format': 'PNG', 'compress_level': self.level}
+        if self.format == 'jpeg':
+            return {'format': 'JPEG', 'quality': self.level}
+        if self.level is None:
+            # method 0 is the fastest lossless WebP effort level, still smaller than PNG on screenshots
+            return {'format': 'WEBP', 'lossless': True, 'method': 0}
+        return {'format': 'WEBP', 'quality': self.level, 'method': 0}
+
+    def encode(self, image: Union[Image.Image, np.ndarray]) -> bytes:
+        """Encode a PIL image or an RGB uint8 array."""
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if self.format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffered = io.BytesIO()
+        image.save(buffered, **self.save_kwargs())
+        return buffered.getvalue()
+
+    def __repr__(self):
+        return f'ImageCodec({self.spec!r})'
@@ -0,0 +1,130 @@
+"""
+Screen-diff helpers for incremental re-parsing.
+
+Between two agent steps usually only a small part of the screen changes.
+These helpers find the changed (dirty) regions of a new frame, pick the
+previous parse results that are still valid, and splice freshly parsed
+regions back into a single parsed_content_list.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+# order in which get_som_labeled_img emits elements
+SOURCE_ORDER = {'box_ocr_content_ocr': 0, 'box_yolo_content_ocr': 1, 'box_yolo_content_yolo': 2}
+
+
+def dirty_tile_mask(prev_image: np.ndarray, image: np.ndarray, tile_size: int = 128, pixel_threshold: int = 16) -> np.ndarray:
+    """Boolean (rows, cols) mask of tiles containing at least one changed pixel."""
+    h, w = image.shape[:2]
+    changed = np.abs(prev_image.astype(np.int16) - image.astype(np.int16)).max(axis=2) > pixel_threshold
+    rows, cols = -(-h // tile_size), -(-w // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:h, :w] = changed
+    return padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+
+def dirty_regions(mask: np.ndarray, tile_size: int, width: int, height: int) -> List[List[int]]:
+    """Pixel xyxy bounding boxes of the 8-connected groups of dirty tiles."""
+    seen = np.zeros_like(mask)
+    regions = []
+    for r, c in zip(*np.nonzero(mask)):
+        if seen[r, c]:
+            continue
+        seen[r, c] = True
+        stack = [(r, c)]
+        r1, c1, r2, c2 = r, c, r, c
+        while stack:
+            y, x = stack.pop()
+            r1, c1, r2, c2 = min(r1, y), min(c1, x), max(r2, y), max(c2, x)
+            for ny in range(max(y - 1, 0), min(y + 2, mask.shape[0])):
+                for nx in range(max(x - 1, 0), min(x + 2, mask.shape[1])):
+                    if mask[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        stack.append((ny, nx))
+        regions.append([int(c1 * tile_size), int(r1 * tile_size), min(int((c2 + 1) * tile_size), width), min(int((r2 + 1) * tile_size), height)])
+    return regions
+
+
+def _intersects(a, b) -> bool:
+    return min(a[2], b[2]) > max(a[0], b[0]) and min(a[3], b[3]) > max(a[1], b[1])
+
+
+def expand_regions(regions: List[List[int]], parsed_content_list: List[dict], width: int, height: int) -> List[List[int]]:
+    """
+    Grow dirty regions so that every previous element they touch is fully inside one,
+    then merge regions that overlap. Elements cut by a region border would otherwise be
+    re-detected as fragments.
+    """
+    boxes = [[e['bbox'][0] * width, e['bbox'][1] * height, e['bbox'][2] * width, e['bbox'][3] * height] for e in parsed_content_list]
+    regions = [list(r) for r in regions]
+    changed = True
+    while changed:
+        changed = False
+        for region in regions:
+            for box in boxes:
+                if _intersects(region, box) and not (box[0] >= region[0] and box[1] >= region[1] and box[2] <= region[2] and box[3] <= region[3]):
+                    region[0], region[1] = min(region[0], int(np.floor(box[0]))), min(region[1], int(np.floor(box[1])))
+                    region[2], region[3] = max(region[2], int(np.ceil(box[2]))), max(region[3], int(np.ceil(box[3])))
+                    changed = True
+        merged = []
+        for region in regions:
+            for other in merged:
+                if _intersects(region, other):
+                    other[0], other[1] = min(other[0], region[0]), min(other[1], region[1])
+                    other[2], other[3] = max(other[2], region[2]), max(other[3], region[3])
+                    changed = True
+                    break
+            else:
+                merged.append(region)
+        regions = merged
+    return [[max(r[0], 0), max(r[1], 0), min(r[2], width), min(r[3], height)] for r in regions]
+
+
+def region_area_ratio(regions: List[List[int]], width: int, height: int) -> float:
+    return sum((r[2] - r[0]) * (r[3] - r[1]) for r in regions) / float(width * height)
+
+
+def split_by_regions(parsed_content_list: List[dict], regions: List[List[int]], width: int, height: int) -> List[dict]:
+    """Previous elements that do not touch any dirty region, i.e. are still valid."""
+    kept = []
+    for e in parsed_content_list:
+        box = [e['bbox'][0] * width, e['bbox'][1] * height, e['bbox'][2] * width, e['bbox'][3] * height]
+        if not any(_intersects(box, region) for region in regions):
+            kept.append(e)
+    return kept
+
+
+def to_frame_coords(parsed_content_list: List[dict], region: List[int], width: int, height: int) -> List[dict]:
+    """Map elements parsed on a region crop (bbox normalized to the crop) back to normalized frame coordinates."""
+    x1, y1, x2, y2 = region
+    rw, rh = x2 - x1, y2 - y1
+    mapped = []
+    for e in parsed_content_list:
+        bx1, by1, bx2, by2 = e['bbox']
+        e = dict(e)
+        e['bbox'] = [(x1 + bx1 * rw) / width, (y1 + by1 * rh) / height, (x1 + bx2 * rw) / width, (y1 + by2 * rh) / height]
+        mapped.append(e)
+    return mapped
+
+
+def splice(kept: List[dict], fresh: List[dict]) -> List[dict]:
+    """Merge still-valid and re-parsed elements in the order get_som_labeled_img would emit them."""
+    return sorted(kept + fresh, key=lambda e: SOURCE_ORDER.get(e.get('source'), len(SOURCE_ORDER)))
+
+
+def plan_incremental_parse(prev_image: np.ndarray, image: np.ndarray, prev_parsed_content_list: List[dict], tile_size: int = 128,
+                           pixel_threshold: int = 16, min_region_size: int = 2) -> Tuple[List[List[int]], List[dict], float]:
+    """
+    Returns (dirty regions in pixel xyxy, previous elements still valid, dirty area ratio).
+
+    Regions thinner than min_region_size pixels cannot be parsed and are dropped before the valid
+    elements are picked, so elements touching them are kept rather than lost.
+    """
+    h, w = image.shape[:2]
+    mask = dirty_tile_mask(prev_image, image, tile_size=tile_size, pixel_threshold=pixel_threshold)
+    regions = dirty_regions(mask, tile_size, w, h)
+    regions = expand_regions(regions, prev_parsed_content_list, w, h)
+    regions = [r for r in regions if r[2] - r[0] >= min_region_size and r[3] - r[1] >= min_region_size]
+    kept = split_by_regions(prev_parsed_content_list, regions, w, h)
+    return regions, kept, region_area_ratio(regions, w, h)
@@ -0,0 +1,125 @@
+"""
+Bounded executor for blocking model inference behind async servers.
+
+Model calls (YOLO, OCR, caption / VLM `generate`) block for hundreds of
+milliseconds, so async handlers hand them to a small worker pool instead of
+running them on the event loop; health and metrics endpoints keep answering
+while a request is in flight. Admission control caps the number of requests
+waiting for or holding a worker: once `max_pending` is reached new requests
+are rejected with `InferenceBusy` instead of piling up.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict
+
+
+class InferenceBusy(RuntimeError):
+    """Raised when an InferenceExecutor already holds `max_pending` requests."""
+
+
+class InferenceExecutor(Executor):
+    """
+    Thread pool with admission control and queue-depth counters.
+
+    It is a regular `concurrent.futures.Executor`, so it can be passed to
+    `loop.run_in_executor` or to MicroBatcher directly.
+
+    Attributes:
+        max_workers (int): concurrent model calls, 1 when the model is not thread safe
+        max_pending (int): admitted requests (running + waiting) before new ones are rejected
+        name (str): thread name prefix and metric label
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 16, name: str = 'inference'):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        return self._pool.submit(self._call, time.perf_counter(), fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        self._pool.shutdown(wait=wait, **kwargs)
+
+    def _call(self, submitted_at: float, fn: Callable, args, kwargs):
+        start = time.perf_counter()
+        with self._lock:
+            self.running += 1
+            self.queue_wait_seconds += start - submitted_at
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_seconds += time.perf_counter() - start
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+    @contextmanager
+    def admit(self):
+        """Hold one admission slot for the duration of the block, raise InferenceBusy when none is left."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise InferenceBusy(f'{self.name}: {self.pending} requests in flight (max {self.max_pending})')
+            self.pending += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Admit the request and run `fn(*args, **kwargs)` on a worker without blocking the event loop."""
+        with self.admit():
+            # run_in_executor does not carry contextvars over, copy them so timing contexts still work
+            call = partial(contextvars.copy_context().run, fn, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(self, call)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'running': self.running,
+                'queued': max(self.pending - self.running, 0),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'queue_wait_seconds': self.queue_wait_seconds,
+                'run_seconds': self.run_seconds,
+            }
+
+    def render_metrics(self, prefix: str = 'inference') -> str:
+        """Prometheus text exposition of the counters in `stats`."""
+        stats = self.stats()
+        label = f'{{executor="{self.name}"}}'
+        lines = []
+        for key, kind in (('pending', 'gauge'), ('running', 'gauge'), ('queued', 'gauge'), ('max_pending', 'gauge'),
+                          ('completed', 'counter'), ('failed', 'counter'), ('rejected', 'counter'),
+                          ('queue_wait_seconds', 'counter'), ('run_seconds', 'counter')):
+            metric = f'{prefix}_{key}_total' if kind == 'counter' else f'{prefix}_{key}'
+            lines.append(f'# TYPE {metric} {kind}')
+            lines.append(f'{metric}{label} {stats[key]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,89 @@
+"""
+Region-level cache for OCR recognition results.
+
+Menus, sidebars and headings usually carry the same text from one agent
+step to the next. Text detection still runs on every frame, but each
+detected text box is cropped and hashed, and recognition only runs on the
+crops that were not seen before. Entries are kept in an LRU bounded both by
+count and by an approximate memory budget.
+"""
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# (text, confidence) pairs recognized inside one detected box
+Recognition = List[Tuple[str, float]]
+
+
+class OCRCache:
+    """
+    LRU cache mapping text-box crop hashes to recognition results.
+
+    Attributes:
+        max_entries (int): maximum number of cached crops
+        max_bytes (int): approximate memory budget of the cached entries, 0 for no limit
+    """
+
+    def __init__(self, max_entries: int = 8192, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(crop: np.ndarray, engine_id: str) -> str:
+        """Exact hash of a uint8 crop plus the engine / recognition settings."""
+        digest = hashlib.sha1(np.ascontiguousarray(crop).tobytes())
+        digest.update(f"{crop.shape}|{engine_id}".encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _entry_size(key: str, value: Recognition) -> int:
+        return sys.getsizeof(key) + sum(sys.getsizeof(text) + 64 for text, _ in value) + 64
+
+    def get(self, key: str) -> Optional[Recognition]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: str, value: Recognition):
+        size = self._entry_size(key, value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._sizes[key]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)):
+                evicted, _ = self._entries.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+
+    def lookup(self, keys: List[str]) -> List[Optional[Recognition]]:
+        return [self.get(key) for key in keys]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
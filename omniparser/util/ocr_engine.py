@@ -0,0 +1,193 @@
+"""
+Pooled OCR engine shared by check_ocr_box and the parser.
+
+Creating an EasyOCR / PaddleOCR reader loads detection and recognition
+networks, so readers are created once and kept in a pool. Each call checks
+a reader out for its duration; with several readers, frames (or regions of
+one frame) are recognized in parallel. `recognize_regions` restricts OCR to
+a set of pixel regions, e.g. the dirty regions of an incremental parse, and
+maps the results back to frame coordinates. With an OCRCache, detection
+runs on every frame but recognition is skipped for text boxes whose pixels
+were recognized before.
+"""
+import inspect
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from util.ocr_cache import OCRCache
+from util.overlap import max_iou_matrix
+
+BACKENDS = ('easyocr', 'paddleocr')
+
+
+class OCREngine:
+    """
+    Attributes:
+        backend (str): 'easyocr' or 'paddleocr'
+        num_workers (int): number of readers kept warm, i.e. OCR calls that can run at once
+    """
+
+    def __init__(self, backend: str = 'easyocr', num_workers: int = 1, languages: Optional[Sequence[str]] = None, readers: Optional[List] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f'unknown OCR backend {backend!r}, expected one of {BACKENDS}')
+        self.backend = backend
+        self.languages = list(languages) if languages else (['ko', 'en'] if backend == 'easyocr' else ['korean'])
+        readers = list(readers or [])
+        self.num_workers = max(num_workers, len(readers), 1)
+        self._readers = queue.Queue()
+        for reader in readers:
+            self._readers.put(reader)
+        for _ in range(self.num_workers - len(readers)):
+            self._readers.put(self._create_reader())
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _create_reader(self):
+        if self.backend == 'easyocr':
+            import easyocr
+            return easyocr.Reader(self.languages)
+        from paddleocr import PaddleOCR
+        return PaddleOCR(lang=self.languages[0])
+
+    def grow(self, num_workers: int):
+        """Add readers until the pool holds num_workers of them."""
+        with self._lock:
+            if num_workers <= self.num_workers:
+                return
+            for _ in range(num_workers - self.num_workers):
+                self._readers.put(self._create_reader())
+            self.num_workers = num_workers
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    @contextmanager
+    def reader(self):
+        """Check a reader out of the pool, blocking until one is free."""
+        reader = self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put(reader)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix=f'ocr-{self.backend}')
+            return self._executor
+
+    def recognize(self, image_np: np.ndarray, easyocr_args: Optional[dict] = None, cache: Optional[OCRCache] = None) -> Tuple[List, List[str]]:
+        """
+        OCR one RGB frame. Returns (quads, texts), a quad being the four [x, y] corners of a text box.
+        For paddleocr only `text_threshold` of easyocr_args is used (default 0.5), as in check_ocr_box.
+        cache: optional OCRCache, only text boxes not seen before go through recognition
+        """
+        if cache is not None:
+            return self._recognize_cached(image_np, easyocr_args, cache)
+        with self.reader() as reader:
+            if self.backend == 'paddleocr':
+                text_threshold = 0.5 if easyocr_args is None else easyocr_args['text_threshold']
+                result = reader.ocr(image_np, cls=False)[0] or []
+                coord = [item[0] for item in result if item[1][1] > text_threshold]
+                text = [item[1][0] for item in result if item[1][1] > text_threshold]
+            else:
+                result = reader.readtext(image_np, **(easyocr_args or {}))
+                coord = [item[0] for item in result]
+                text = [item[1] for item in result]
+        return coord, text
+
+    def _easyocr_args(self, reader, easyocr_args: dict) -> Tuple[dict, dict]:
+        """Split readtext keyword arguments into those of reader.detect and reader.recognize."""
+        detect_params = inspect.signature(reader.detect).parameters
+        recognize_params = inspect.signature(reader.recognize).parameters
+        return ({k: v for k, v in easyocr_args.items() if k in detect_params},
+                {k: v for k, v in easyocr_args.items() if k in recognize_params})
+
+    def _recognize_cached(self, image_np: np.ndarray, easyocr_args: Optional[dict], cache: OCRCache) -> Tuple[List, List[str]]:
+        h, w = image_np.shape[:2]
+        with self.reader() as reader:
+            # detect text boxes on the full frame
+            if self.backend == 'paddleocr':
+                text_threshold = 0.5 if easyocr_args is None else easyocr_args['text_threshold']
+                quads = [[list(point) for point in quad] for quad in (reader.ocr(image_np, det=True, rec=False, cls=False)[0] or [])]
+                engine_id = f'paddleocr|{self.languages}'
+            else:
+                detect_args, recognize_args = self._easyocr_args(reader, easyocr_args or {})
+                horizontal_list, free_list = reader.detect(image_np, **detect_args)
+                horizontal_list, free_list = horizontal_list[0], free_list[0]
+                quads = [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, x2, y1, y2 in horizontal_list] + [list(quad) for quad in free_list]
+                engine_id = f'easyocr|{self.languages}|{sorted(recognize_args.items())}'
+
+            rects = []
+            for quad in quads:
+                xs, ys = [p[0] for p in quad], [p[1] for p in quad]
+                rects.append([max(int(min(xs)), 0), max(int(min(ys)), 0), min(int(np.ceil(max(xs))), w), min(int(np.ceil(max(ys))), h)])
+            rects = np.array(rects, dtype=np.float64).reshape(-1, 4)
+            valid = (rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])
+            quads, rects = [quad for quad, ok in zip(quads, valid) if ok], rects[valid]
+            keys = [cache.make_key(image_np[int(y1):int(y2), int(x1):int(x2)], engine_id) for x1, y1, x2, y2 in rects]
+            recognitions = cache.lookup(keys)
+            misses = [i for i, recognition in enumerate(recognitions) if recognition is None]
+
+            # recognize only the boxes not seen before
+            if misses and self.backend == 'paddleocr':
+                for i in misses:
+                    x1, y1, x2, y2 = rects[i].astype(int)
+                    recognitions[i] = [(text, float(score)) for text, score in (reader.ocr(np.ascontiguousarray(image_np[y1:y2, x1:x2]), det=False, cls=False)[0] or [])]
+            elif misses:
+                n_horizontal = len(horizontal_list)
+                # indices still refer to the unfiltered quad list here, map the valid ones back
+                original = np.flatnonzero(valid)
+                miss_horizontal = [horizontal_list[original[i]] for i in misses if original[i] < n_horizontal]
+                miss_free = [free_list[original[i] - n_horizontal] for i in misses if original[i] >= n_horizontal]
+                results = reader.recognize(image_np, horizontal_list=miss_horizontal, free_list=miss_free, **recognize_args)
+                for i in misses:
+                    recognitions[i] = []
+                if results:
+                    # recognize reorders the boxes, match every result back to its detected box
+                    result_rects = np.array([[min(p[0] for p in box), min(p[1] for p in box), max(p[0] for p in box), max(p[1] for p in box)] for box, _, _ in results], dtype=np.float64)
+                    overlaps = max_iou_matrix(result_rects, rects[misses])
+                    for (_, text, confidence), row in zip(results, overlaps):
+                        if row.max() > 0:
+                            recognitions[misses[row.argmax()]].append((text, float(confidence)))
+            for i in misses:
+                cache.put(keys[i], recognitions[i])
+
+        coord, text = [], []
+        for quad, recognition in zip(quads, recognitions):
+            for recognized_text, confidence in recognition:
+                if self.backend == 'paddleocr' and confidence <= text_threshold:
+                    continue
+                coord.append(quad)
+                text.append(recognized_text)
+        return coord, text
+
+    def recognize_batch(self, images: List[np.ndarray], easyocr_args: Optional[dict] = None, cache: Optional[OCRCache] = None) -> List[Tuple[List, List[str]]]:
+        """recognize for several frames or crops, spread over the reader pool."""
+        if len(images) <= 1 or self.num_workers == 1:
+            return [self.recognize(image, easyocr_args, cache) for image in images]
+        futures = [self.executor.submit(self.recognize, image, easyocr_args, cache) for image in images]
+        return [future.result() for future in futures]
+
+    def recognize_regions(self, image_np: np.ndarray, regions: List[List[int]], easyocr_args: Optional[dict] = None, cache: Optional[OCRCache] = None) -> Tuple[List, List[str]]:
+        """OCR only the given pixel xyxy regions of a frame, quads are returned in frame coordinates."""
+        h, w = image_np.shape[:2]
+        regions = [[max(int(x1), 0), max(int(y1), 0), min(int(x2), w), min(int(y2), h)] for x1, y1, x2, y2 in regions]
+        regions = [r for r in regions if r[2] > r[0] and r[3] > r[1]]
+        crops = [np.ascontiguousarray(image_np[y1:y2, x1:x2]) for x1, y1, x2, y2 in regions]
+        coord, text = [], []
+        for (x1, y1, _, _), (region_coord, region_text) in zip(regions, self.recognize_batch(crops, easyocr_args, cache)):
+            coord.extend([[[px + x1, py + y1] for px, py in quad] for quad in region_coord])
+            text.extend(region_text)
+        return coord, text
+
+    def warmup(self):
+        """Run a small blank frame through every reader."""
+        blank = np.full((64, 256, 3), 255, dtype=np.uint8)
+        self.recognize_batch([blank] * self.num_workers)
@@ -1,32 +1,259 @@
-from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box
+from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box, get_default_ocr_engine, render_som_overlay, LazySomOverlay, get_yolo_detections, get_yolo_detections_batch, get_som_elements, caption_icon_crops, fill_icon_captions
+from util.icon_crop import crop_icon_batch
+from util.phi3v_caption import caption_phi3v_crops, crop_icons
+from util.caption_cache import CaptionCache
+from util.ocr_cache import OCRCache
+from util.image_codec import ImageCodec
+from util.yolo_backend import YoloDetector
+from util.incremental import plan_incremental_parse, to_frame_coords, splice
+from util.timing import timed, timing_context
+import copy
+import time
+import contextvars
 import torch
+import numpy as np
 from PIL import Image
 import io
 import base64
-from typing import Dict
+from typing import Dict, List, Optional, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 class Omniparser(object):
     def __init__(self, config: Dict):
         self.config = config
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-        self.som_model = get_yolo_model(model_path=config['som_model_path'])
-        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device)
+        self.som_model = get_yolo_model(model_path=config['som_model_path'], backend=config.get('yolo_backend', 'pytorch'), imgsz_buckets=config.get('yolo_imgsz_buckets'))
+        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device, backend=config.get('caption_backend', 'pytorch'), generation=config.get('caption_generation', 'default'),
+                                                                   early_exit=config.get('caption_early_exit', False), max_new_tokens=config.get('caption_max_new_tokens'))
+        cache_size = config.get('caption_cache_size', 4096)
+        self.caption_cache = CaptionCache(max_entries=cache_size, cache_dir=config.get('caption_cache_dir')) if cache_size else None
+        ocr_cache_size = config.get('ocr_cache_size', 8192)
+        self.ocr_cache = OCRCache(max_entries=ocr_cache_size, max_bytes=int(config.get('ocr_cache_max_mb', 16) * 1024 * 1024)) if ocr_cache_size else None
+        # last frame and parse result per session, used by incremental parsing. Each entry holds a full RGB frame,
+        # so only the `incremental_max_sessions` most recently used sessions are kept
+        self.previous_frames = OrderedDict()
+        self.max_sessions = config.get('incremental_max_sessions', 16)
+        self.som_codec = ImageCodec.from_spec(config.get('som_codec'))
+        # warm OCR readers, one per concurrent OCR call; the first one is the module-level reader from util.utils
+        ocr_workers = config.get('ocr_workers', 1)
+        self.ocr_engine = get_default_ocr_engine(use_paddleocr=config.get('ocr_backend', 'easyocr') == 'paddleocr', num_workers=ocr_workers)
+        # OCR does not depend on YOLO, so it runs on its own pinned workers while YOLO runs on the caller thread
+        self.ocr_executor = ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix='omniparser-ocr') if config.get('parallel_stages', True) else None
+        if config.get('warmup', True):
+            self.warmup()
         print('Omniparser initialized!!!')
 
-    def parse(self, image_base64: str):
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_bytes))
-        print('image size:', image.size)
-        
+    def warmup(self):
+        """Push blank frames through the detector and one crop through the caption model, so the first agent step runs at steady-state speed."""
+        start = time.time()
+        width, height = self.config.get('warmup_size') or (1920, 1080)
+        if isinstance(self.som_model, YoloDetector):
+            self.som_model.warmup(sizes=[(width, height)])
+        else:
+            frame = Image.new('RGB', (width, height), 'white')
+            for _ in range(2):
+                self.run_yolo(frame)
+        if 'phi3_v' not in self.caption_model_processor['model'].config.model_type:
+            crops = torch.zeros((1, 3, 64, 64), device=self.caption_model_processor['model'].device)
+            caption_icon_crops(crops, self.caption_model_processor, batch_size=1)
+        self.ocr_engine.warmup()
+        print(f'warm-up done in {time.time() - start:.2f}s')
+
+    def decode_image(self, image: Union[str, bytes, Image.Image]):
+        """image: base64 string or raw encoded image bytes (PNG, JPEG, ...), already decoded images are returned as is"""
+        if isinstance(image, Image.Image):
+            return image
+        with timed('decode'):
+            image_bytes = base64.b64decode(image) if isinstance(image, str) else image
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+        return image
+
+    def get_draw_bbox_config(self, image: Image.Image):
         box_overlay_ratio = max(image.size) / 3200
-        draw_bbox_config = {
+        return {
             'text_scale': 0.8 * box_overlay_ratio,
             'text_thickness': max(int(2 * box_overlay_ratio), 1),
             'text_padding': max(int(3 * box_overlay_ratio), 1),
             'thickness': max(int(3 * box_overlay_ratio), 1),
         }
 
-        (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=False)
-        dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128)
+    def run_ocr(self, image: Image.Image):
+        with timed('ocr'):
+            (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, ocr_engine=self.ocr_engine, ocr_cache=self.ocr_cache)
+        return text, ocr_bbox
+
+    def tile_args(self):
+        """Tiled detection settings for get_yolo_detections, tiling is off unless yolo_tile_size is set."""
+        return {
+            'tile_size': self.config.get('yolo_tile_size'),
+            'tile_overlap': self.config.get('yolo_tile_overlap', 0.2),
+            'tile_batch_size': self.config.get('yolo_tile_batch_size', 4),
+        }
+
+    def run_yolo(self, image: Image.Image):
+        with timed('yolo'):
+            return get_yolo_detections(image, self.som_model, BOX_TRESHOLD=self.config['BOX_TRESHOLD'], scale_img=False, **self.tile_args())
+
+    @staticmethod
+    def render_policy(som_format: Optional[str]):
+        return 'none' if som_format is None else 'lazy' if som_format == 'lazy' else 'eager'
+
+    def render_overlay(self, image: Image.Image, boxes: torch.Tensor, som_format: Optional[str] = 'base64'):
+        """Labeled image for normalized xyxy boxes, see render_som_overlay. None when som_format is None, a LazySomOverlay for 'lazy'."""
+        if som_format is None:
+            return None
+        image_np = np.asarray(image.convert('RGB'))
+        if som_format == 'lazy':
+            return LazySomOverlay(image_np, boxes, draw_bbox_config=self.get_draw_bbox_config(image), codec=self.som_codec)
+        dino_labled_img, _ = render_som_overlay(image_np, boxes, draw_bbox_config=self.get_draw_bbox_config(image), output_format=som_format, codec=self.som_codec)
+        return dino_labled_img
+
+    def parse_image(self, image: Image.Image, som_format: Optional[str] = 'base64', ocr_result=None):
+        """Full parse of one frame. OCR and YOLO run concurrently and are joined at the overlap filter.
+
+        som_format: 'base64', 'png' (raw bytes), 'lazy' for a LazySomOverlay drawn on demand, or None to skip the labeled image
+        ocr_result: (text, ocr_bbox) already computed for this frame, OCR is skipped
+        """
+        draw_bbox_config = self.get_draw_bbox_config(image)
+        # decode once up front, lazy PIL loading is not safe to trigger from two threads
+        image.load()
+        with timed('detection'):
+            if ocr_result is not None:
+                text, ocr_bbox = ocr_result
+                yolo_result = self.run_yolo(image)
+            elif self.ocr_executor is not None:
+                # copy the context so the worker records into the same timings dict
+                ocr_future = self.ocr_executor.submit(contextvars.copy_context().run, self.run_ocr, image)
+                yolo_result = self.run_yolo(image)
+                text, ocr_bbox = ocr_future.result()
+            else:
+                text, ocr_bbox = self.run_ocr(image)
+                yolo_result = self.run_yolo(image)
+
+        with timed('som'):
+            dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128, caption_cache=self.caption_cache, yolo_result=yolo_result, som_format=som_format, render_policy=self.render_policy(som_format), som_codec=self.som_codec)
+        return dino_labled_img, parsed_content_list
+
+    def parse_batch(self, images: List[Image.Image], som_formats: Optional[List[Optional[str]]] = None):
+        """Parse several frames together: one YOLO call per frame size and one caption batch across all frames.
+
+        Used by the server to coalesce concurrent /parse/ requests. Returns one (som image, parsed_content_list) per frame.
+        som_formats: per-frame som_format, see parse_image
+        """
+        if som_formats is None:
+            som_formats = ['base64'] * len(images)
+        if len(images) == 1:
+            return [self.parse_image(image, som_format=som_format) for image, som_format in zip(images, som_formats)]
+        for image in images:
+            image.load()
+
+        with timed('detection'):
+            if self.ocr_executor is not None:
+                ocr_futures = [self.ocr_executor.submit(contextvars.copy_context().run, self.run_ocr, image) for image in images]
+                with timed('yolo'):
+                    yolo_results = get_yolo_detections_batch(images, self.som_model, BOX_TRESHOLD=self.config['BOX_TRESHOLD'], scale_img=False, **self.tile_args())
+                ocr_results = [future.result() for future in ocr_futures]
+            else:
+                ocr_results = [self.run_ocr(image) for image in images]
+                with timed('yolo'):
+                    yolo_results = get_yolo_detections_batch(images, self.som_model, BOX_TRESHOLD=self.config['BOX_TRESHOLD'], scale_img=False, **self.tile_args())
+
+        with timed('som'):
+            rgb_images = [image.convert('RGB') for image in images]
+            elements = [get_som_elements(image, yolo_result, ocr_bbox=ocr_bbox, ocr_text=text, iou_threshold=0.7)
+                        for image, yolo_result, (text, ocr_bbox) in zip(rgb_images, yolo_results, ocr_results)]
+
+            # gather the icon crops of every frame into a single caption batch
+            device = self.caption_model_processor['model'].device
+            if 'phi3_v' in self.caption_model_processor['model'].config.model_type:
+                with timed('crop'):
+                    crops = [crop_icons(np.asarray(image), filtered_boxes[starting_idx:])
+                             for image, (_, filtered_boxes, starting_idx, _) in zip(rgb_images, elements)]
+                captions = caption_phi3v_crops([crop for frame_crops in crops for crop in frame_crops], self.caption_model_processor, caption_cache=self.caption_cache)
+            else:
+                with timed('crop'):
+                    crops = [crop_icon_batch(np.asarray(image), filtered_boxes[starting_idx:], size=64, device=device)
+                             for image, (_, filtered_boxes, starting_idx, _) in zip(rgb_images, elements)]
+                captions = caption_icon_crops(torch.cat(crops), self.caption_model_processor, batch_size=128, caption_cache=self.caption_cache)
+
+            results = []
+            offset = 0
+            for image, crop, (filtered_boxes_elem, filtered_boxes, _, _), som_format in zip(rgb_images, crops, elements, som_formats):
+                fill_icon_captions(filtered_boxes_elem, captions[offset:offset + len(crop)])
+                offset += len(crop)
+                dino_labled_img = self.render_overlay(image, filtered_boxes, som_format=som_format)
+                results.append((dino_labled_img, filtered_boxes_elem))
+        return results
+
+    def parse_incremental(self, image: Image.Image, prev_image: np.ndarray, prev_parsed_content_list, som_format: Optional[str] = 'base64'):
+        """Re-parse only the regions that changed since the previous frame and splice them into its results.
+
+        Falls back to a full parse when the frame size changed or too much of the screen is dirty.
+        """
+        image_np = np.asarray(image.convert('RGB'))
+        h, w = image_np.shape[:2]
+        if prev_image.shape != image_np.shape:
+            return self.parse_image(image, som_format=som_format)
+        with timed('diff'):
+            regions, kept, dirty_ratio = plan_incremental_parse(prev_image, image_np, prev_parsed_content_list, tile_size=self.config.get('incremental_tile_size', 128))
+        print(f'incremental parse: {len(regions)} dirty regions, {dirty_ratio:.1%} of the screen')
+        if dirty_ratio > self.config.get('incremental_max_dirty_ratio', 0.5):
+            return self.parse_image(image, som_format=som_format)
+
+        rgb_image = image.convert('RGB')
+        crops = [rgb_image.crop(tuple(region)) for region in regions]
+        # OCR only the dirty regions, all of them queued at once so a multi-reader pool recognizes them in parallel
+        if self.ocr_executor is not None:
+            ocr_results = [self.ocr_executor.submit(contextvars.copy_context().run, self.run_ocr, crop) for crop in crops]
+        else:
+            ocr_results = [self.run_ocr(crop) for crop in crops]
+        fresh = []
+        for region, crop, ocr_result in zip(regions, crops, ocr_results):
+            if self.ocr_executor is not None:
+                ocr_result = ocr_result.result()
+            _, region_content_list = self.parse_image(crop, som_format=None, ocr_result=ocr_result)
+            fresh.extend(to_frame_coords(region_content_list, region, w, h))
+        parsed_content_list = splice(kept, fresh)
+
+        boxes = torch.tensor([e['bbox'] for e in parsed_content_list]).reshape(-1, 4)
+        dino_labled_img = self.render_overlay(image, boxes, som_format=som_format)
+        return dino_labled_img, parsed_content_list
+
+    def parse(self, image_base64: Union[str, bytes, Image.Image], incremental: bool = False, session_id: str = 'default', timings: Optional[Dict] = None, som_format: Optional[str] = 'base64'):
+        """
+        image_base64: base64 string, raw image bytes or a decoded image
+        timings: optional dict filled with per-stage wall-clock seconds
+        som_format: see parse_image
+        """
+        if timings is None:
+            timings = {}
+        with timing_context(timings):
+            image = self.decode_image(image_base64)
+            print('image size:', image.size)
+
+            previous = self.previous_frames.get(session_id) if incremental else None
+            if previous is not None:
+                self.previous_frames.move_to_end(session_id)
+                dino_labled_img, parsed_content_list = self.parse_incremental(image, *previous, som_format=som_format)
+            else:
+                dino_labled_img, parsed_content_list = self.parse_image(image, som_format=som_format)
+
+            if incremental:
+                self.previous_frames[session_id] = (np.asarray(image.convert('RGB')), copy.deepcopy(parsed_content_list))
+                self.previous_frames.move_to_end(session_id)
+                while len(self.previous_frames) > self.max_sessions:
+                    self.previous_frames.popitem(last=False)
+        print('stage timings:', {k: round(v, 3) for k, v in timings.items()})
+        return dino_labled_img, parsed_content_list
 
-        return dino_labled_img, parsed_content_list
\ No newline at end of file
+    def parse_many(self, images_base64: List[Union[str, bytes, Image.Image]], timings: Optional[Dict] = None, som_formats: Optional[List[Optional[str]]] = None):
+        """Full (non-incremental) parse of several base64 or raw frames as one batch, see parse_batch."""
+        if timings is None:
+            timings = {}
+        with timing_context(timings):
+            images = [self.decode_image(image_base64) for image_base64 in images_base64]
+            results = self.parse_batch(images, som_formats=som_formats)
+        print(f'batch of {len(images)} stage timings:', {k: round(v, 3) for k, v in timings.items()})
+        return results
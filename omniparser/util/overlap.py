@@ -0,0 +1,139 @@
+"""
+Batched overlap suppression for YOLO and OCR boxes.
+
+The pairwise intersection, IoU and containment ratios are computed as
+matrices in one shot instead of nested Python loops, which keeps
+`remove_overlap_new` fast on dense screens with hundreds of detections.
+OCR boxes are merged into icons through a `GridIndex`, so each icon only
+looks at the OCR boxes it actually touches. The results are identical to the
+original per-pair implementation.
+"""
+from typing import List
+
+import numpy as np
+import torch
+
+from util.spatial_index import GridIndex
+
+
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def intersection_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """Pairwise intersection area, shape (len(boxes1), len(boxes2))."""
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+    return np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+
+
+def max_iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray, intersection: np.ndarray = None) -> np.ndarray:
+    """Pairwise max(IoU, intersection/area1, intersection/area2).
+
+    The containment ratios are zeroed when either box has a non-positive area,
+    matching the scalar `IoU` helper used throughout the repo.
+    """
+    if intersection is None:
+        intersection = intersection_matrix(boxes1, boxes2)
+    area1 = box_area(boxes1)[:, None]
+    area2 = box_area(boxes2)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = intersection / (area1 + area2 - intersection + 1e-6)
+        valid = (area1 > 0) & (area2 > 0)
+        ratio1 = np.where(valid, intersection / area1, 0)
+        ratio2 = np.where(valid, intersection / area2, 0)
+    return np.maximum(np.maximum(iou, ratio1), ratio2)
+
+
+def containment_matrix(boxes1: np.ndarray, boxes2: np.ndarray, intersection: np.ndarray = None) -> np.ndarray:
+    """Pairwise fraction of each box in `boxes1` covered by each box in `boxes2`."""
+    if intersection is None:
+        intersection = intersection_matrix(boxes1, boxes2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return intersection / box_area(boxes1)[:, None]
+
+
+def _as_array(boxes) -> np.ndarray:
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def suppress_larger_overlaps(boxes: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Return a keep mask that drops every box overlapping a smaller one above `iou_threshold`."""
+    areas = box_area(boxes)
+    overlaps = max_iou_matrix(boxes, boxes) > iou_threshold
+    np.fill_diagonal(overlaps, False)
+    larger = areas[:, None] > areas[None, :]
+    return ~np.any(overlaps & larger, axis=1)
+
+
+def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+
+    boxes = boxes.tolist()
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    if not boxes:
+        return torch.tensor(filtered_boxes)
+
+    boxes_np = _as_array(boxes)
+    keep = suppress_larger_overlaps(boxes_np, iou_threshold)
+    if ocr_bbox:
+        # only add the box if it does not overlap with any ocr bbox
+        ocr_np = _as_array(ocr_bbox)
+        intersection = intersection_matrix(boxes_np, ocr_np)
+        overlaps = max_iou_matrix(boxes_np, ocr_np, intersection) > iou_threshold
+        inside = containment_matrix(boxes_np, ocr_np, intersection) > 0.95
+        keep &= ~np.any(overlaps & ~inside, axis=1)
+    filtered_boxes.extend(box for box, k in zip(boxes, keep) if k)
+    return torch.tensor(filtered_boxes)
+
+
+def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
+    '''
+    ocr_bbox format: [{'type': 'text', 'bbox':[x,y], 'interactivity':False, 'content':str }, ...]
+    boxes format: [{'type': 'icon', 'bbox':[x,y], 'interactivity':True, 'content':None }, ...]
+
+    '''
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+
+    if not boxes:
+        return list(ocr_bbox) if ocr_bbox else []
+
+    boxes_np = _as_array([box['bbox'] for box in boxes])
+    # keep the smaller box
+    keep = suppress_larger_overlaps(boxes_np, iou_threshold)
+
+    if not ocr_bbox:
+        return [{'type': 'icon', 'bbox': box['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'} for box, k in zip(boxes, keep) if k]
+
+    # keep yolo boxes + prioritize ocr label; only ocr boxes touching an icon can be merged into it or swallow it
+    ocr_index = GridIndex([box['bbox'] for box in ocr_bbox])
+    ocr_boxes, ocr_areas = ocr_index.boxes.tolist(), ocr_index.areas.tolist()
+    removed = np.zeros(len(ocr_bbox), dtype=bool)
+    icons = []
+    for i in np.flatnonzero(keep).tolist():
+        box1 = boxes_np[i].tolist()
+        area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+        ocr_labels = ''
+        box_added = False
+        for k in ocr_index.intersecting(box1):
+            box3 = ocr_boxes[k]
+            intersection = (min(box1[2], box3[2]) - max(box1[0], box3[0])) * (min(box1[3], box3[3]) - max(box1[1], box3[1]))
+            if intersection / ocr_areas[k] > 0.80: # ocr inside icon
+                ocr_labels += ocr_bbox[k]['content'] + ' '
+                removed[k] = True
+            elif intersection / area1 > 0.80: # icon inside ocr, don't add this icon box
+                box_added = True
+                break
+        if not box_added:
+            if ocr_labels:
+                icons.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+            else:
+                icons.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+    # merged ocr boxes are dropped by index rather than by list search
+    filtered_boxes = [box for box, r in zip(ocr_bbox, removed) if not r]
+    filtered_boxes.extend(icons)
+    return filtered_boxes
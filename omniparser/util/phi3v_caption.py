@@ -0,0 +1,139 @@
+"""
+Batched icon captioning with Phi-3-vision.
+
+The Phi-3-vision processor expands `<|image_1|>` in the prompt to one
+placeholder token per image embedding, so the tokenized prompt only depends
+on that count. All crops go through the image processor in a single call,
+the prompt is tokenized once per distinct token count, and a padding
+collator left-pads the prompts into one tensor batch. The batch size is
+derived from the memory available on the model's device and halved on
+CUDA out-of-memory errors.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.nn.utils.rnn import pad_sequence
+
+from util.timing import timed
+
+PHI3V_PROMPT = "<|image_1|>\ndescribe the icon in one sentence"
+PHI3V_GENERATION = {"max_new_tokens": 25, "temperature": 0.01, "do_sample": False}
+
+
+def left_pad(sequences: List[torch.Tensor], pad_token_id: int):
+    """Left-pad 1-D token sequences into (input_ids, attention_mask)."""
+    input_ids = pad_sequence([seq.flip(0) for seq in sequences], batch_first=True, padding_value=pad_token_id).flip(1)
+    attention_mask = pad_sequence([torch.ones_like(seq).flip(0) for seq in sequences], batch_first=True, padding_value=0).flip(1)
+    return input_ids, attention_mask
+
+
+def adaptive_batch_size(model, seq_len: int, max_new_tokens: int = 25, max_batch_size: int = 64, memory_fraction: float = 0.5) -> int:
+    """
+    Crops per generate call that fit in `memory_fraction` of the free device memory,
+    estimated from the KV cache and MLP activations of one sequence.
+    """
+    config = model.config
+    bytes_per_value = torch.finfo(model.dtype).bits // 8
+    kv_cache = 2 * config.num_hidden_layers * config.hidden_size * (seq_len + max_new_tokens) * bytes_per_value
+    activations = 4 * getattr(config, 'intermediate_size', 4 * config.hidden_size) * seq_len * bytes_per_value
+    if model.device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(model.device)
+    else:
+        try:
+            import psutil
+        except ImportError:
+            return min(max_batch_size, 8)
+        free = psutil.virtual_memory().available
+    return max(1, min(max_batch_size, int(free * memory_fraction // (kv_cache + activations))))
+
+
+def crop_icons(image_source: np.ndarray, boxes) -> List[np.ndarray]:
+    """Native-resolution crops for normalized xyxy boxes, the processor does its own HD resize."""
+    h, w = image_source.shape[:2]
+    crops = []
+    for coord in boxes:
+        xmin, xmax = int(coord[0]*w), int(coord[2]*w)
+        ymin, ymax = int(coord[1]*h), int(coord[3]*h)
+        crops.append(np.ascontiguousarray(image_source[ymin:ymax, xmin:xmax, :]))
+    return crops
+
+
+class Phi3VCollator:
+    """Turns preprocessed crops into left-padded generate inputs, reusing the tokenized prompt per image token count."""
+
+    def __init__(self, processor, prompt: str):
+        self.processor = processor
+        self.prompt = prompt
+        self._prompt_ids: Dict[int, torch.Tensor] = {}
+
+    def prompt_ids(self, image_inputs, index: int) -> torch.Tensor:
+        num_img_tokens = int(image_inputs['num_img_tokens'][index])
+        if num_img_tokens not in self._prompt_ids:
+            single = {'pixel_values': image_inputs['pixel_values'][index:index + 1], 'image_sizes': image_inputs['image_sizes'][index:index + 1], 'num_img_tokens': [num_img_tokens]}
+            self._prompt_ids[num_img_tokens] = self.processor._convert_images_texts_to_inputs(single, self.prompt, return_tensors="pt")['input_ids'][0]
+        return self._prompt_ids[num_img_tokens]
+
+    def __call__(self, image_inputs, indices: List[int]) -> Dict[str, torch.Tensor]:
+        input_ids, attention_mask = left_pad([self.prompt_ids(image_inputs, i) for i in indices], self.processor.tokenizer.pad_token_id)
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'pixel_values': image_inputs['pixel_values'][indices],
+            'image_sizes': image_inputs['image_sizes'][indices],
+        }
+
+
+@torch.inference_mode()
+def caption_phi3v_crops(crops: List[np.ndarray], caption_model_processor, batch_size: Optional[int] = None, caption_cache=None) -> List[str]:
+    """
+    Caption HxWx3 uint8 icon crops with Phi-3-vision.
+
+    batch_size: crops per generate call, derived from free memory when None
+    caption_cache: optional CaptionCache, only crops not seen before are sent to the model
+    """
+    model, processor = caption_model_processor['model'], caption_model_processor['processor']
+    device = model.device
+    messages = [{"role": "user", "content": PHI3V_PROMPT}]
+    prompt = processor.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    captions = [None] * len(crops)
+    if caption_cache is not None and crops:
+        with timed('caption_cache'):
+            cache_keys = [caption_cache.make_key(crop, model.config.name_or_path, prompt) for crop in crops]
+            captions = caption_cache.lookup(cache_keys)
+    miss_idx = [i for i, caption in enumerate(captions) if caption is None]
+    if not miss_idx:
+        return captions
+
+    with timed('caption'):
+        image_inputs = processor.image_processor([Image.fromarray(crops[i]) for i in miss_idx], return_tensors="pt")
+        collator = Phi3VCollator(processor, prompt)
+        if batch_size is None:
+            seq_len = max(len(collator.prompt_ids(image_inputs, i)) for i in range(len(miss_idx)))
+            batch_size = adaptive_batch_size(model, seq_len, max_new_tokens=PHI3V_GENERATION['max_new_tokens'])
+        start = 0
+        while start < len(miss_idx):
+            indices = list(range(start, min(start + batch_size, len(miss_idx))))
+            inputs = {k: v.to(device) for k, v in collator(image_inputs, indices).items()}
+            try:
+                generate_ids = model.generate(**inputs, eos_token_id=processor.tokenizer.eos_token_id, **PHI3V_GENERATION)
+            except torch.cuda.OutOfMemoryError:
+                if batch_size == 1:
+                    raise
+                batch_size = max(1, batch_size // 2)
+                print(f'phi3v captioning out of memory, retrying with batch size {batch_size}')
+                torch.cuda.empty_cache()
+                continue
+            # remove input tokens
+            generate_ids = generate_ids[:, inputs['input_ids'].shape[1]:]
+            response = processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+            for i, res in zip(indices, response):
+                captions[miss_idx[i]] = res.strip('\n').strip()
+            start += len(indices)
+
+    if caption_cache is not None:
+        for i in miss_idx:
+            caption_cache.put(cache_keys[i], captions[i])
+    return captions
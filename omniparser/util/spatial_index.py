@@ -0,0 +1,86 @@
+"""
+Uniform grid index over normalized xyxy boxes.
+
+Used to answer "which boxes touch this box" without scanning
+every box, e.g. when merging OCR text into icon boxes on text-heavy pages.
+"""
+import math
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    Buckets boxes into a uniform grid so that a query only looks at the
+    boxes sharing a cell with it.
+
+    Attributes:
+        boxes (np.ndarray): (N, 4) array of xyxy boxes, float64
+        cell_size (float): side length of a grid cell, in box units
+    """
+
+    def __init__(self, boxes, cell_size: float = None):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.areas = (self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])
+        if len(self.boxes):
+            self.origin = self.boxes[:, :2].min(axis=0)
+            extent = self.boxes[:, 2:].max(axis=0)
+        else:
+            self.origin = np.zeros(2)
+            extent = np.ones(2)
+        if cell_size is None:
+            cell_size = self._default_cell_size()
+        self.cell_size = cell_size
+        self.num_cells = np.maximum(np.ceil((extent - self.origin) / cell_size).astype(int), 1)
+
+        # plain-float copies keep the per-query path free of numpy scalar overhead
+        self._box_list = self.boxes.tolist()
+        self.cells = defaultdict(list)
+        for idx, (cx1, cy1, cx2, cy2) in enumerate(self._cell_range(self.boxes).tolist()):
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self.cells[(cx, cy)].append(idx)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _default_cell_size(self) -> float:
+        # roughly two typical boxes per cell side keeps buckets small without spreading a box over many cells
+        if not len(self.boxes):
+            return 1.0
+        sizes = np.maximum(self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1])
+        cell_size = 2 * float(np.median(sizes))
+        return cell_size if cell_size > 0 and math.isfinite(cell_size) else 1.0
+
+    def _cell_range(self, boxes: np.ndarray) -> np.ndarray:
+        lo = np.floor((boxes[:, :2] - self.origin) / self.cell_size).astype(int)
+        hi = np.floor((boxes[:, 2:] - self.origin) / self.cell_size).astype(int)
+        upper = self.num_cells - 1
+        return np.concatenate([np.clip(lo, 0, upper), np.clip(hi, 0, upper)], axis=1)
+
+    def candidates(self, box) -> List[int]:
+        """Sorted indices of boxes sharing at least one grid cell with `box`."""
+        x1, y1, x2, y2 = box
+        ox, oy = self.origin.tolist()
+        nx, ny = (self.num_cells - 1).tolist()
+        cx1 = min(max(math.floor((x1 - ox) / self.cell_size), 0), nx)
+        cy1 = min(max(math.floor((y1 - oy) / self.cell_size), 0), ny)
+        cx2 = min(max(math.floor((x2 - ox) / self.cell_size), 0), nx)
+        cy2 = min(max(math.floor((y2 - oy) / self.cell_size), 0), ny)
+        found = set()
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                found.update(self.cells.get((cx, cy), ()))
+        return sorted(found)
+
+    def intersecting(self, box) -> List[int]:
+        """Sorted indices of boxes with a positive intersection area with `box`."""
+        x1, y1, x2, y2 = box
+        result = []
+        for idx in self.candidates(box):
+            bx1, by1, bx2, by2 = self._box_list[idx]
+            if min(x2, bx2) > max(x1, bx1) and min(y2, by2) > max(y1, by1):
+                result.append(idx)
+        return result
@@ -0,0 +1,114 @@
+"""
+Tiled icon detection for very high-resolution screens.
+
+Instead of feeding a 4K / ultrawide frame to YOLO in one piece (large
+activations, or a downscale that loses small icons), the frame is cut into
+equally sized, overlapping tiles that are detected at native resolution in
+fixed-size batches. Boxes are shifted back to frame coordinates and the
+duplicates that neighbouring tiles both saw in their overlap band are merged.
+"""
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from util.overlap import box_area, intersection_matrix
+
+
+def _starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # the last tile is shifted back to end at the border, so every tile has the same size
+    starts.append(length - tile)
+    return starts
+
+
+def tile_grid(width: int, height: int, tile_size: int = 1280, overlap: float = 0.2) -> List[List[int]]:
+    """Pixel xyxy tiles of at most tile_size x tile_size covering the frame, neighbours overlapping by `overlap` of a tile."""
+    stride = max(int(tile_size * (1 - overlap)), 1)
+    tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+    return [[x, y, x + tile_w, y + tile_h] for y in _starts(height, tile_h, stride) for x in _starts(width, tile_w, stride)]
+
+
+def truncated_mask(boxes: np.ndarray, tile: List[int], width: int, height: int, margin: float = 2.0) -> np.ndarray:
+    """Boxes (frame coordinates) touching an edge of their tile that is not also an edge of the frame, i.e. likely cut."""
+    x1, y1, x2, y2 = tile
+    cut = np.zeros(len(boxes), dtype=bool)
+    if x1 > 0:
+        cut |= boxes[:, 0] <= x1 + margin
+    if y1 > 0:
+        cut |= boxes[:, 1] <= y1 + margin
+    if x2 < width:
+        cut |= boxes[:, 2] >= x2 - margin
+    if y2 < height:
+        cut |= boxes[:, 3] >= y2 - margin
+    return cut
+
+
+def merge_tiled_detections(boxes: np.ndarray, scores: np.ndarray, truncated: np.ndarray, tile_ids: np.ndarray, tiles: List[List[int]],
+                           iou_threshold: float = 0.5, fragment_threshold: float = 0.8) -> np.ndarray:
+    """
+    Indices of the boxes to keep after merging the duplicates found in the overlap bands of neighbouring tiles.
+
+    Only boxes from different tiles that both reach into the band where their two tiles overlap are
+    compared. They are duplicates when their IoU is above iou_threshold, or when one was cut by its tile
+    border and lies mostly (fragment_threshold) inside the other. Boxes of the same tile, e.g. an icon
+    inside a panel, are left to the regular overlap removal. Whole boxes are visited before cut ones and
+    higher scores first, so an icon seen whole in one tile wins over its fragment from the neighbouring tile.
+    """
+    if not len(boxes):
+        return np.zeros(0, dtype=int)
+    box_tiles = np.asarray(tiles, dtype=np.float64)[tile_ids]
+    # overlap band of the tiles of every pair of boxes, empty for the same or non-overlapping tiles
+    band_x1 = np.maximum(box_tiles[:, None, 0], box_tiles[None, :, 0])
+    band_y1 = np.maximum(box_tiles[:, None, 1], box_tiles[None, :, 1])
+    band_x2 = np.minimum(box_tiles[:, None, 2], box_tiles[None, :, 2])
+    band_y2 = np.minimum(box_tiles[:, None, 3], box_tiles[None, :, 3])
+
+    def reaches_band(b):
+        return (np.minimum(b[..., 2], band_x2) > np.maximum(b[..., 0], band_x1)) & (np.minimum(b[..., 3], band_y2) > np.maximum(b[..., 1], band_y1))
+
+    candidates = (tile_ids[:, None] != tile_ids[None, :]) & reaches_band(boxes[:, None, :]) & reaches_band(boxes[None, :, :])
+    intersection = intersection_matrix(boxes, boxes)
+    areas = box_area(boxes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = intersection / (areas[:, None] + areas[None, :] - intersection + 1e-6)
+        # fraction of box j inside box i
+        inside = np.where(areas[None, :] > 0, intersection / areas[None, :], 0)
+    duplicates = candidates & ((iou > iou_threshold) | (truncated[None, :] & (inside > fragment_threshold)))
+
+    order = np.lexsort((-scores, truncated))
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= duplicates[i]
+    return np.sort(np.array(keep, dtype=int))
+
+
+def detect_tiled(predict_batch, image, tile_size: int = 1280, overlap: float = 0.2, batch_size: int = 4, iou_threshold: float = 0.5) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Run `predict_batch(list of PIL tiles) -> [(boxes xyxy, conf), ...]` over the tiles of a PIL image
+    `batch_size` tiles at a time. Returns merged (boxes, conf) in frame pixel coordinates.
+    """
+    width, height = image.size
+    tiles = tile_grid(width, height, tile_size=tile_size, overlap=overlap)
+    all_boxes, all_scores, all_truncated, all_tile_ids = [], [], [], []
+    for i in range(0, len(tiles), batch_size):
+        chunk = tiles[i:i + batch_size]
+        results = predict_batch([image.crop(tuple(tile)) for tile in chunk])
+        for tile_id, tile, (boxes, conf) in zip(range(i, i + len(chunk)), chunk, results):
+            boxes = boxes.detach().cpu().numpy().astype(np.float64).reshape(-1, 4) + np.array([tile[0], tile[1], tile[0], tile[1]], dtype=np.float64)
+            all_boxes.append(boxes)
+            all_scores.append(conf.detach().cpu().numpy().astype(np.float64).reshape(-1))
+            all_truncated.append(truncated_mask(boxes, tile, width, height))
+            all_tile_ids.append(np.full(len(boxes), tile_id, dtype=int))
+    boxes = np.concatenate(all_boxes) if all_boxes else np.zeros((0, 4))
+    scores = np.concatenate(all_scores) if all_scores else np.zeros(0)
+    truncated = np.concatenate(all_truncated) if all_truncated else np.zeros(0, dtype=bool)
+    tile_ids = np.concatenate(all_tile_ids) if all_tile_ids else np.zeros(0, dtype=int)
+    keep = merge_tiled_detections(boxes, scores, truncated, tile_ids, tiles, iou_threshold=iou_threshold)
+    return torch.from_numpy(boxes[keep]).float(), torch.from_numpy(scores[keep]).float()
@@ -0,0 +1,92 @@
+"""
+Low-overhead per-stage latency timers for the parsing pipeline.
+
+A parse call installs a timings dict with `timing_context`; anything inside
+it can wrap work in `timed('stage')` and the elapsed seconds are added to
+that dict. Outside a context `timed` is a no-op, so the library functions
+stay usable on their own. `LatencyHistograms` aggregates the per-request
+dicts and renders them in the Prometheus text exposition format.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+_current_timings = contextvars.ContextVar('omniparser_timings', default=None)
+
+
+@contextmanager
+def timing_context(timings: Optional[Dict]):
+    """Make `timings` the target of every `timed` block run in this context."""
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+@contextmanager
+def timed(stage: str):
+    """Add the wall-clock seconds spent in the block to the current timings dict under `stage`."""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def current_timings() -> Optional[Dict]:
+    return _current_timings.get()
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class LatencyHistograms:
+    """
+    Cumulative latency histograms, one per stage, exported in Prometheus text format.
+
+    Attributes:
+        name (str): metric name
+        buckets (tuple): upper bounds in seconds, +Inf is implied
+    """
+
+    def __init__(self, name: str = 'omniparser_stage_latency_seconds', buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self._counts = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            counts = self._counts.setdefault(stage, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[stage] = self._sums.get(stage, 0.0) + seconds
+
+    def observe_all(self, timings: Dict[str, float]):
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} Latency of each OmniParser pipeline stage in seconds.',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            for stage in sorted(self._counts):
+                counts = self._counts[stage]
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {self._sums[stage]}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {counts[-1]}')
+        return '\n'.join(lines) + '\n'
@@ -30,13 +30,27 @@ import torch
 from typing import Tuple, List, Union
 from torchvision.ops import box_convert
 import re
-from torchvision.transforms import ToPILImage
+import threading
 import supervision as sv
 import torchvision.transforms as T
 from util.box_annotator import BoxAnnotator 
-
-
-def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None):
+from util.overlap import remove_overlap_new
+from util.icon_crop import crop_icon_batch, preprocess_icon_batch
+from util.timing import timed
+from util.ocr_engine import OCREngine
+from util.image_codec import ImageCodec
+from util.yolo_backend import YoloDetector
+from util.tiling import detect_tiled
+from util.caption_backend import apply_caption_backend, generation_kwargs
+from util.caption_scheduler import supports_early_exit, generate_early_exit
+from util.phi3v_caption import caption_phi3v_crops, crop_icons
+
+
+def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None, backend='pytorch', generation='default', early_exit=False, max_new_tokens=None):
+    """backend: 'pytorch', 'int8' or 'onnx' (florence2); generation: decoding preset, see util/caption_backend.py
+    early_exit: drop finished captions from the batch while decoding (greedy florence2), see util/caption_scheduler.py
+    max_new_tokens: caption token budget, overrides the preset's
+    """
     if not device:
         device = "cuda" if torch.cuda.is_available() else "cpu"
     if model_name == "blip2":
@@ -57,249 +71,140 @@ def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2
             model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float32, trust_remote_code=True)
         else:
             model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float16, trust_remote_code=True).to(device)
-    return {'model': model.to(device), 'processor': processor}
+    caption_model_processor = {'model': model.to(device), 'processor': processor, 'model_name': model_name, 'generation_kwargs': generation_kwargs(model_name, generation), 'early_exit': early_exit}
+    if max_new_tokens:
+        caption_model_processor['generation_kwargs'].pop('max_length', None)
+        caption_model_processor['generation_kwargs']['max_new_tokens'] = max_new_tokens
+    if backend != 'pytorch' or generation != 'default' or max_new_tokens:
+        # captions differ slightly between backends / presets / budgets, keep their cache entries apart
+        caption_model_processor['cache_tag'] = f'{backend}|{generation}|{max_new_tokens}'
+    return apply_caption_backend(caption_model_processor, model_name, model_name_or_path, backend=backend)
+
+
+def get_yolo_model(model_path, backend='pytorch', imgsz_buckets=None, device=None):
+    """backend: 'pytorch', 'onnx', 'torchscript' or 'openvino'; imgsz_buckets: fixed input sizes, see util/yolo_backend.py"""
+    if backend == 'pytorch' and not imgsz_buckets:
+        from ultralytics import YOLO
+        # Load the model.
+        model = YOLO(model_path)
+        return model
+    return YoloDetector(model_path, backend=backend, imgsz_buckets=imgsz_buckets, device=device)
+
+
+def get_caption_prompt_inputs(processor, prompt):
+    """Tokenize the caption prompt once, shape (1, seq_len), to be repeated over a crop batch.
+
+    The processor is run on a single blank crop so that any image placeholder tokens
+    it inserts into the text are included, exactly as in a per-image processor call.
+    """
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    inputs = processor(images=[blank], text=[prompt], return_tensors="pt")
+    return {k: v for k, v in inputs.items() if k in ('input_ids', 'attention_mask')}
 
 
-def get_yolo_model(model_path):
-    from ultralytics import YOLO
-    # Load the model.
-    model = YOLO(model_path)
-    return model
+def get_caption_prompt(model, prompt=None):
+    if prompt:
+        return prompt
+    if 'florence' in model.config.name_or_path:
+        return "<CAPTION>"
+    return "The image shows"
 
 
 @torch.inference_mode()
-def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128):
-    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
-    to_pil = ToPILImage()
-    if starting_idx:
-        non_ocr_boxes = filtered_boxes[starting_idx:]
-    else:
-        non_ocr_boxes = filtered_boxes
-    croped_pil_image = []
-    for i, coord in enumerate(non_ocr_boxes):
-        try:
-            xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
-            ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
-            cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-            cropped_image = cv2.resize(cropped_image, (64, 64))
-            croped_pil_image.append(to_pil(cropped_image))
-        except:
-            continue
+def caption_icon_crops(crops, caption_model_processor, prompt=None, batch_size=128, caption_cache=None, max_new_tokens=None):
+    """Caption a (N, 3, 64, 64) crop batch from crop_icon_batch, possibly gathered from several screenshots.
 
+    caption_cache: optional CaptionCache, only crops not seen before are sent to the model
+    max_new_tokens: optional token budget, one int or one per crop; crops are batched by budget so short
+        captions are not decoded alongside long ones. Per-crop budgets need the early-exit scheduler
+        (caption_model_processor['early_exit'], greedy Florence2), otherwise the largest budget of a batch is used
+    """
     model, processor = caption_model_processor['model'], caption_model_processor['processor']
-    if not prompt:
-        if 'florence' in model.config.name_or_path:
-            prompt = "<CAPTION>"
-        else:
-            prompt = "The image shows"
-    
-    generated_texts = []
+    prompt = get_caption_prompt(model, prompt)
     device = model.device
-    for i in range(0, len(croped_pil_image), batch_size):
-        start = time.time()
-        batch = croped_pil_image[i:i+batch_size]
-        t1 = time.time()
-        if model.device.type == 'cuda':
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt", do_resize=False).to(device=device, dtype=torch.float16)
-        else:
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt").to(device=device)
-        if 'florence' in model.config.name_or_path:
-            generated_ids = model.generate(input_ids=inputs["input_ids"],pixel_values=inputs["pixel_values"],max_new_tokens=20,num_beams=1, do_sample=False)
-        else:
-            generated_ids = model.generate(**inputs, max_length=100, num_beams=5, no_repeat_ngram_size=2, early_stopping=True, num_return_sequences=1) # temperature=0.01, do_sample=True,
-        generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
-        generated_text = [gen.strip() for gen in generated_text]
-        generated_texts.extend(generated_text)
-    
+    dtype = torch.float16 if device.type == 'cuda' else torch.float32
+
+    cached_texts = [None] * len(crops)
+    if caption_cache is not None and len(crops):
+        with timed('caption_cache'):
+            crops_uint8 = crops.round().to(torch.uint8).cpu().numpy()
+            model_id = model.config.name_or_path
+            if caption_model_processor.get('cache_tag'):
+                model_id = f"{model_id}|{caption_model_processor['cache_tag']}"
+            cache_keys = [caption_cache.make_key(crop, model_id, prompt) for crop in crops_uint8]
+            cached_texts = caption_cache.lookup(cache_keys)
+        miss_idx = [i for i, txt in enumerate(cached_texts) if txt is None]
+        if not miss_idx:
+            return cached_texts
+        crops = crops[miss_idx]
+        if isinstance(max_new_tokens, (list, tuple)):
+            max_new_tokens = [max_new_tokens[i] for i in miss_idx]
+    prompt_inputs = {k: v.to(device) for k, v in get_caption_prompt_inputs(processor, prompt).items()}
+
+    is_florence = 'florence' in model.config.name_or_path
+    generation = caption_model_processor.get('generation_kwargs') or generation_kwargs('florence2' if is_florence else 'blip2')
+    early_exit = caption_model_processor.get('early_exit', False) and supports_early_exit(caption_model_processor.get('model_name'), generation)
+    budgets = None
+    if isinstance(max_new_tokens, (list, tuple)):
+        budgets = list(max_new_tokens)
+    elif max_new_tokens is not None:
+        generation = {k: v for k, v in generation.items() if k != 'max_length'}
+        generation['max_new_tokens'] = max_new_tokens
+    # length buckets: visit crops by budget so each batch holds similar budgets
+    order = sorted(range(len(crops)), key=lambda i: budgets[i]) if budgets else list(range(len(crops)))
+
+    generated_texts = [None] * len(crops)
+    for i in range(0, len(crops), batch_size):
+        batch_idx = order[i:i+batch_size]
+        batch = crops[batch_idx]
+        with timed('caption'):
+            pixel_values = preprocess_icon_batch(batch, processor.image_processor, do_resize=device.type != 'cuda', dtype=dtype)
+            text_inputs = {k: v.repeat(len(batch), 1) for k, v in prompt_inputs.items()}
+            batch_generation = dict(generation)
+            if budgets:
+                batch_generation.pop('max_length', None)
+                batch_generation['max_new_tokens'] = max(budgets[j] for j in batch_idx)
+            if early_exit:
+                batch_budgets = [budgets[j] for j in batch_idx] if budgets else batch_generation['max_new_tokens']
+                generated_ids = generate_early_exit(model, text_inputs["input_ids"], pixel_values, max_new_tokens=batch_budgets, no_repeat_ngram_size=batch_generation.get('no_repeat_ngram_size'))
+            elif is_florence:
+                generated_ids = model.generate(input_ids=text_inputs["input_ids"],pixel_values=pixel_values, **batch_generation)
+            else:
+                generated_ids = model.generate(pixel_values=pixel_values, **text_inputs, **batch_generation) # temperature=0.01, do_sample=True,
+            generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
+        for j, gen in zip(batch_idx, generated_text):
+            generated_texts[j] = gen.strip()
+
+    if caption_cache is not None and len(cached_texts):
+        for i, txt in zip(miss_idx, generated_texts):
+            caption_cache.put(cache_keys[i], txt)
+            cached_texts[i] = txt
+        return cached_texts
     return generated_texts
 
 
-
-def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor):
-    to_pil = ToPILImage()
-    if ocr_bbox:
-        non_ocr_boxes = filtered_boxes[len(ocr_bbox):]
+def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128, caption_cache=None):
+    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
+    if starting_idx:
+        non_ocr_boxes = filtered_boxes[starting_idx:]
     else:
         non_ocr_boxes = filtered_boxes
-    croped_pil_image = []
-    for i, coord in enumerate(non_ocr_boxes):
-        xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
-        ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
-        cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-        croped_pil_image.append(to_pil(cropped_image))
-
-    model, processor = caption_model_processor['model'], caption_model_processor['processor']
-    device = model.device
-    messages = [{"role": "user", "content": "<|image_1|>\ndescribe the icon in one sentence"}] 
-    prompt = processor.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-
-    batch_size = 5  # Number of samples per batch
-    generated_texts = []
-
-    for i in range(0, len(croped_pil_image), batch_size):
-        images = croped_pil_image[i:i+batch_size]
-        image_inputs = [processor.image_processor(x, return_tensors="pt") for x in images]
-        inputs ={'input_ids': [], 'attention_mask': [], 'pixel_values': [], 'image_sizes': []}
-        texts = [prompt] * len(images)
-        for i, txt in enumerate(texts):
-            input = processor._convert_images_texts_to_inputs(image_inputs[i], txt, return_tensors="pt")
-            inputs['input_ids'].append(input['input_ids'])
-            inputs['attention_mask'].append(input['attention_mask'])
-            inputs['pixel_values'].append(input['pixel_values'])
-            inputs['image_sizes'].append(input['image_sizes'])
-        max_len = max([x.shape[1] for x in inputs['input_ids']])
-        for i, v in enumerate(inputs['input_ids']):
-            inputs['input_ids'][i] = torch.cat([processor.tokenizer.pad_token_id * torch.ones(1, max_len - v.shape[1], dtype=torch.long), v], dim=1)
-            inputs['attention_mask'][i] = torch.cat([torch.zeros(1, max_len - v.shape[1], dtype=torch.long), inputs['attention_mask'][i]], dim=1)
-        inputs_cat = {k: torch.concatenate(v).to(device) for k, v in inputs.items()}
-
-        generation_args = { 
-            "max_new_tokens": 25, 
-            "temperature": 0.01, 
-            "do_sample": False, 
-        } 
-        generate_ids = model.generate(**inputs_cat, eos_token_id=processor.tokenizer.eos_token_id, **generation_args) 
-        # # remove input tokens 
-        generate_ids = generate_ids[:, inputs_cat['input_ids'].shape[1]:]
-        response = processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
-        response = [res.strip('\n').strip() for res in response]
-        generated_texts.extend(response)
-
-    return generated_texts
 
-def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
-    assert ocr_bbox is None or isinstance(ocr_bbox, List)
-
-    def box_area(box):
-        return (box[2] - box[0]) * (box[3] - box[1])
-
-    def intersection_area(box1, box2):
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        return max(0, x2 - x1) * max(0, y2 - y1)
-
-    def IoU(box1, box2):
-        intersection = intersection_area(box1, box2)
-        union = box_area(box1) + box_area(box2) - intersection + 1e-6
-        if box_area(box1) > 0 and box_area(box2) > 0:
-            ratio1 = intersection / box_area(box1)
-            ratio2 = intersection / box_area(box2)
-        else:
-            ratio1, ratio2 = 0, 0
-        return max(intersection / union, ratio1, ratio2)
-
-    def is_inside(box1, box2):
-        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
-        intersection = intersection_area(box1, box2)
-        ratio1 = intersection / box_area(box1)
-        return ratio1 > 0.95
+    # crop all icons at once on the model's device, no per-crop PIL conversion
+    with timed('crop'):
+        crops = crop_icon_batch(image_source, non_ocr_boxes, size=64, device=caption_model_processor['model'].device)
+    return caption_icon_crops(crops, caption_model_processor, prompt=prompt, batch_size=batch_size, caption_cache=caption_cache)
 
-    boxes = boxes.tolist()
-    filtered_boxes = []
-    if ocr_bbox:
-        filtered_boxes.extend(ocr_bbox)
-    # print('ocr_bbox!!!', ocr_bbox)
-    for i, box1 in enumerate(boxes):
-        # if not any(IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2) for j, box2 in enumerate(boxes) if i != j):
-        is_valid_box = True
-        for j, box2 in enumerate(boxes):
-            # keep the smaller box
-            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
-                is_valid_box = False
-                break
-        if is_valid_box:
-            # add the following 2 lines to include ocr bbox
-            if ocr_bbox:
-                # only add the box if it does not overlap with any ocr bbox
-                if not any(IoU(box1, box3) > iou_threshold and not is_inside(box1, box3) for k, box3 in enumerate(ocr_bbox)):
-                    filtered_boxes.append(box1)
-            else:
-                filtered_boxes.append(box1)
-    return torch.tensor(filtered_boxes)
-
-
-def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
-    '''
-    ocr_bbox format: [{'type': 'text', 'bbox':[x,y], 'interactivity':False, 'content':str }, ...]
-    boxes format: [{'type': 'icon', 'bbox':[x,y], 'interactivity':True, 'content':None }, ...]
-
-    '''
-    assert ocr_bbox is None or isinstance(ocr_bbox, List)
-
-    def box_area(box):
-        return (box[2] - box[0]) * (box[3] - box[1])
-
-    def intersection_area(box1, box2):
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        return max(0, x2 - x1) * max(0, y2 - y1)
-
-    def IoU(box1, box2):
-        intersection = intersection_area(box1, box2)
-        union = box_area(box1) + box_area(box2) - intersection + 1e-6
-        if box_area(box1) > 0 and box_area(box2) > 0:
-            ratio1 = intersection / box_area(box1)
-            ratio2 = intersection / box_area(box2)
-        else:
-            ratio1, ratio2 = 0, 0
-        return max(intersection / union, ratio1, ratio2)
 
-    def is_inside(box1, box2):
-        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
-        intersection = intersection_area(box1, box2)
-        ratio1 = intersection / box_area(box1)
-        return ratio1 > 0.80
 
-    # boxes = boxes.tolist()
-    filtered_boxes = []
+def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor, batch_size=None, caption_cache=None):
+    """batch_size: crops per generate call, sized from free device memory when None, see util/phi3v_caption.py"""
     if ocr_bbox:
-        filtered_boxes.extend(ocr_bbox)
-    # print('ocr_bbox!!!', ocr_bbox)
-    for i, box1_elem in enumerate(boxes):
-        box1 = box1_elem['bbox']
-        is_valid_box = True
-        for j, box2_elem in enumerate(boxes):
-            # keep the smaller box
-            box2 = box2_elem['bbox']
-            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
-                is_valid_box = False
-                break
-        if is_valid_box:
-            if ocr_bbox:
-                # keep yolo boxes + prioritize ocr label
-                box_added = False
-                ocr_labels = ''
-                for box3_elem in ocr_bbox:
-                    if not box_added:
-                        box3 = box3_elem['bbox']
-                        if is_inside(box3, box1): # ocr inside icon
-                            # box_added = True
-                            # delete the box3_elem from ocr_bbox
-                            try:
-                                # gather all ocr labels
-                                ocr_labels += box3_elem['content'] + ' '
-                                filtered_boxes.remove(box3_elem)
-                            except:
-                                continue
-                            # break
-                        elif is_inside(box1, box3): # icon inside ocr, don't added this icon box, no need to check other ocr bbox bc no overlap between ocr bbox, icon can only be in one ocr box
-                            box_added = True
-                            break
-                        else:
-                            continue
-                if not box_added:
-                    if ocr_labels:
-                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
-                    else:
-                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
-            else:
-                filtered_boxes.append(box1)
-    return filtered_boxes # torch.tensor(filtered_boxes)
-
+        non_ocr_boxes = filtered_boxes[len(ocr_bbox):]
+    else:
+        non_ocr_boxes = filtered_boxes
+    crops = crop_icons(image_source, non_ocr_boxes)
+    return caption_phi3v_crops(crops, caption_model_processor, batch_size=batch_size, caption_cache=caption_cache)
 
 def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
     transform = T.Compose(
@@ -390,65 +295,195 @@ def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.
 
     return boxes, conf, phrases
 
+def predict_yolo_batch(model, images, box_threshold, imgsz, scale_img, iou_threshold=0.7):
+    """ Batched predict_yolo for same-size images, returns one (boxes, conf, phrases) per image
+    """
+    if scale_img:
+        results = model.predict(source=images, conf=box_threshold, imgsz=imgsz, iou=iou_threshold)
+    else:
+        results = model.predict(source=images, conf=box_threshold, iou=iou_threshold)
+    detections = []
+    for result in results:
+        boxes = result.boxes.xyxy # in pixel space
+        detections.append((boxes, result.boxes.conf, [str(i) for i in range(len(boxes))]))
+    return detections
+
 def int_box_area(box, w, h):
     x1, y1, x2, y2 = box
     int_box = [int(x1*w), int(y1*h), int(x2*w), int(y2*h)]
     area = (int_box[2] - int_box[0]) * (int_box[3] - int_box[1])
     return area
 
-def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128):
-    """Process either an image path or Image object
-    
-    Args:
-        image_source: Either a file path (str) or PIL Image object
-        ...
+def render_som_overlay(image_source: np.ndarray, filtered_boxes: torch.Tensor, draw_bbox_config=None, text_scale=0.4, text_padding=5, output_format='base64', codec=None):
+    """Draw the numbered boxes on the screenshot and return (encoded image, label_coordinates in pixel xywh).
+
+    filtered_boxes: normalized xyxy boxes, in the order of the parsed content list
+    output_format: 'base64' for a base64 string, 'png' for the raw encoded bytes
+    codec: ImageCodec or spec string such as 'png:1', 'webp', 'jpeg:85', defaults to fast PNG
+    """
+    filtered_boxes = box_convert(boxes=filtered_boxes.reshape(-1, 4), in_fmt="xyxy", out_fmt="cxcywh")
+    phrases = [i for i in range(len(filtered_boxes))]
+
+    # draw boxes
+    with timed('annotate'):
+        if draw_bbox_config:
+            annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=None, phrases=phrases, **draw_bbox_config)
+        else:
+            annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=None, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
+
+    with timed('png_encode'):
+        image_bytes = ImageCodec.from_spec(codec).encode(annotated_frame)
+        if output_format == 'png':
+            return image_bytes, label_coordinates
+        encoded_image = base64.b64encode(image_bytes).decode('ascii')
+    return encoded_image, label_coordinates
+
+
+class LazySomOverlay:
+    """
+    Deferred render_som_overlay: keeps the frame and the final boxes and draws them only when
+    `render` is first called, so callers that only need the parsed content never pay for it.
+    """
+
+    def __init__(self, image_source: np.ndarray, filtered_boxes: torch.Tensor, draw_bbox_config=None, text_scale=0.4, text_padding=5, codec=None):
+        self.image_source = image_source
+        self.codec = ImageCodec.from_spec(codec)
+        self.filtered_boxes = filtered_boxes
+        self.draw_bbox_config = draw_bbox_config
+        self.text_scale = text_scale
+        self.text_padding = text_padding
+        self._png = None
+        self._label_coordinates = None
+        self._lock = threading.Lock()
+
+    def render(self, output_format='base64'):
+        """Same return value as render_som_overlay, the PNG is drawn once and reused."""
+        with self._lock:
+            if self._png is None:
+                self._png, self._label_coordinates = render_som_overlay(self.image_source, self.filtered_boxes, draw_bbox_config=self.draw_bbox_config,
+                                                                        text_scale=self.text_scale, text_padding=self.text_padding, output_format='png', codec=self.codec)
+        if output_format == 'png':
+            return self._png, self._label_coordinates
+        return base64.b64encode(self._png).decode('ascii'), self._label_coordinates
+
+
+def get_yolo_detections(image_source: Union[str, Image.Image], model, BOX_TRESHOLD=0.01, scale_img=False, imgsz=None, tile_size=None, tile_overlap=0.2, tile_batch_size=4):
+    """Run the icon detector the way get_som_labeled_img does, so it can be scheduled separately from OCR.
+
+    tile_size: when set and the frame is larger, detect on overlapping tile_size tiles at native resolution
+        (tile_batch_size tiles per call) and merge them, see util/tiling.py
     """
     if isinstance(image_source, str):
         image_source = Image.open(image_source)
-    image_source = image_source.convert("RGB") # for CLIP
+    image_source = image_source.convert("RGB")
     w, h = image_source.size
+    if tile_size and max(w, h) > tile_size:
+        def predict_tiles(tiles):
+            results = predict_yolo_batch(model=model, images=tiles, box_threshold=BOX_TRESHOLD, imgsz=tile_size, scale_img=True, iou_threshold=0.1)
+            return [(boxes, conf) for boxes, conf, _ in results]
+        boxes, conf = detect_tiled(predict_tiles, image_source, tile_size=tile_size, overlap=tile_overlap, batch_size=tile_batch_size)
+        return boxes, conf, [str(i) for i in range(len(boxes))]
     if not imgsz:
         imgsz = (h, w)
-    # print('image size:', w, h)
-    xyxy, logits, phrases = predict_yolo(model=model, image=image_source, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+    return predict_yolo(model=model, image=image_source, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+
+
+def get_yolo_detections_batch(images: List[Image.Image], model, BOX_TRESHOLD=0.01, scale_img=False, imgsz=None, tile_size=None, tile_overlap=0.2, tile_batch_size=4):
+    """get_yolo_detections for several screenshots, images of the same size share one detector call."""
+    if tile_size and any(max(image.size) > tile_size for image in images):
+        # tiles are already batched per frame
+        return [get_yolo_detections(image, model, BOX_TRESHOLD=BOX_TRESHOLD, scale_img=scale_img, imgsz=imgsz, tile_size=tile_size,
+                                    tile_overlap=tile_overlap, tile_batch_size=tile_batch_size) for image in images]
+    images = [image.convert("RGB") for image in images]
+    by_size = {}
+    for i, image in enumerate(images):
+        by_size.setdefault(image.size, []).append(i)
+    detections = [None] * len(images)
+    for (w, h), idx in by_size.items():
+        results = predict_yolo_batch(model=model, images=[images[i] for i in idx], box_threshold=BOX_TRESHOLD, imgsz=imgsz or (h, w), scale_img=scale_img, iou_threshold=0.1)
+        for i, result in zip(idx, results):
+            detections[i] = result
+    return detections
+
+
+def get_som_elements(image_source: Image.Image, yolo_result, ocr_bbox=None, ocr_text=[], iou_threshold=0.9):
+    """Merge YOLO detections with OCR boxes into the parsed element list, before icon captioning.
+
+    Returns:
+        filtered_boxes_elem: element dicts, the ones still to be captioned ('content': None) at the end
+        filtered_boxes: (N, 4) tensor of their normalized xyxy boxes
+        starting_idx: index of the first element to be captioned
+        ocr_bbox: OCR boxes normalized to the image size
+    """
+    w, h = image_source.size
+    xyxy, logits, phrases = yolo_result
     xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
-    image_source = np.asarray(image_source)
-    phrases = [str(i) for i in range(len(phrases))]
 
-    # annotate the image with labels
     if ocr_bbox:
         ocr_bbox = torch.tensor(ocr_bbox) / torch.Tensor([w, h, w, h])
         ocr_bbox=ocr_bbox.tolist()
     else:
         print('no ocr bbox!!!')
-        ocr_bbox = None
+        ocr_bbox = []
 
     ocr_bbox_elem = [{'type': 'text', 'bbox':box, 'interactivity':False, 'content':txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_bbox, ocr_text) if int_box_area(box, w, h) > 0] 
     xyxy_elem = [{'type': 'icon', 'bbox':box, 'interactivity':True, 'content':None} for box in xyxy.tolist() if int_box_area(box, w, h) > 0]
-    filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
+    with timed('overlap'):
+        filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
     
     # sort the filtered_boxes so that the one with 'content': None is at the end, and get the index of the first 'content': None
     filtered_boxes_elem = sorted(filtered_boxes, key=lambda x: x['content'] is None)
     # get the index of the first 'content': None
-    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), -1)
-    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
+    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), len(filtered_boxes_elem))
+    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem]).reshape(-1, 4)
     print('len(filtered_boxes):', len(filtered_boxes), starting_idx)
+    return filtered_boxes_elem, filtered_boxes, starting_idx, ocr_bbox
+
+
+def fill_icon_captions(filtered_boxes_elem, parsed_content_icon):
+    """Fill the 'content': None elements with the icon captions in order, returns the unused captions."""
+    parsed_content_icon = list(parsed_content_icon)
+    for i, box in enumerate(filtered_boxes_elem):
+        if box['content'] is None:
+            box['content'] = parsed_content_icon.pop(0)
+    return parsed_content_icon
+
+
+def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128, caption_cache=None, yolo_result=None, som_format='base64', render_policy='eager', som_codec=None):
+    """Process either an image path or Image object
+    
+    Args:
+        image_source: Either a file path (str) or PIL Image object
+        yolo_result: Optional precomputed output of get_yolo_detections, skips running the detector here
+        som_format: 'base64' or 'png' (raw bytes) for the labeled image
+        som_codec: ImageCodec or spec string for the labeled image, defaults to fast PNG
+        render_policy: 'eager' draws the labeled image now, 'lazy' returns a LazySomOverlay to draw on demand,
+            'none' skips it; both return no label coordinates
+        ...
+    """
+    if isinstance(image_source, str):
+        image_source = Image.open(image_source)
+    image_source = image_source.convert("RGB") # for CLIP
+    w, h = image_source.size
+    # print('image size:', w, h)
+    if yolo_result is None:
+        yolo_result = get_yolo_detections(image_source, model, BOX_TRESHOLD=BOX_TRESHOLD, scale_img=scale_img, imgsz=imgsz)
+    filtered_boxes_elem, filtered_boxes, starting_idx, ocr_bbox = get_som_elements(image_source, yolo_result, ocr_bbox=ocr_bbox, ocr_text=ocr_text, iou_threshold=iou_threshold)
+    image_source = np.asarray(image_source)
 
     # get parsed icon local semantics
     time1 = time.time()
     if use_local_semantics:
         caption_model = caption_model_processor['model']
         if 'phi3_v' in caption_model.config.model_type: 
-            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor)
+            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor, caption_cache=caption_cache)
         else:
-            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size)
+            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size, caption_cache=caption_cache)
         ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
         icon_start = len(ocr_text)
         parsed_content_icon_ls = []
         # fill the filtered_boxes_elem None content with parsed_content_icon in order
-        for i, box in enumerate(filtered_boxes_elem):
-            if box['content'] is None:
-                box['content'] = parsed_content_icon.pop(0)
+        parsed_content_icon = fill_icon_captions(filtered_boxes_elem, parsed_content_icon)
         for i, txt in enumerate(parsed_content_icon):
             parsed_content_icon_ls.append(f"Icon Box ID {str(i+icon_start)}: {txt}")
         parsed_content_merged = ocr_text + parsed_content_icon_ls
@@ -457,23 +492,13 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
         parsed_content_merged = ocr_text
     print('time to get parsed content:', time.time()-time1)
 
-    filtered_boxes = box_convert(boxes=filtered_boxes, in_fmt="xyxy", out_fmt="cxcywh")
-
-    phrases = [i for i in range(len(filtered_boxes))]
-    
-    # draw boxes
-    if draw_bbox_config:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, **draw_bbox_config)
-    else:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
-    
-    pil_img = Image.fromarray(annotated_frame)
-    buffered = io.BytesIO()
-    pil_img.save(buffered, format="PNG")
-    encoded_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+    if render_policy == 'none':
+        return None, {}, filtered_boxes_elem
+    if render_policy == 'lazy':
+        return LazySomOverlay(image_source, filtered_boxes, draw_bbox_config=draw_bbox_config, text_scale=text_scale, text_padding=text_padding, codec=som_codec), {}, filtered_boxes_elem
+    encoded_image, label_coordinates = render_som_overlay(image_source, filtered_boxes, draw_bbox_config=draw_bbox_config, text_scale=text_scale, text_padding=text_padding, output_format=som_format, codec=som_codec)
     if output_coord_in_ratio:
         label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
-        assert w == annotated_frame.shape[1] and h == annotated_frame.shape[0]
 
     return encoded_image, label_coordinates, filtered_boxes_elem
 
@@ -493,7 +518,26 @@ def get_xywh_yolo(input):
     x, y, w, h = int(x), int(y), int(w), int(h)
     return x, y, w, h
 
-def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False):
+_default_ocr_engines = {}
+
+
+def get_default_ocr_engine(use_paddleocr=False, num_workers=1):
+    """OCREngine around the module-level reader, shared by every check_ocr_box call without an explicit engine.
+    Asking for more workers adds warm readers to the shared pool."""
+    backend = 'paddleocr' if use_paddleocr else 'easyocr'
+    if backend not in _default_ocr_engines:
+        _default_ocr_engines[backend] = OCREngine(backend, readers=[paddle_ocr if use_paddleocr else reader])
+    engine = _default_ocr_engines[backend]
+    engine.grow(num_workers)
+    return engine
+
+
+def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False, ocr_engine=None, regions=None, ocr_cache=None):
+    """
+    ocr_engine: OCREngine to run on, defaults to the module-level easyocr / paddleocr reader
+    regions: optional pixel xyxy regions, only those parts of the image are recognized
+    ocr_cache: optional OCRCache, text boxes recognized in earlier calls are not recognized again
+    """
     if isinstance(image_source, str):
         image_source = Image.open(image_source)
     if image_source.mode == 'RGBA':
@@ -501,20 +545,12 @@ def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, out
         image_source = image_source.convert('RGB')
     image_np = np.array(image_source)
     w, h = image_source.size
-    if use_paddleocr:
-        if easyocr_args is None:
-            text_threshold = 0.5
-        else:
-            text_threshold = easyocr_args['text_threshold']
-        result = paddle_ocr.ocr(image_np, cls=False)[0]
-        coord = [item[0] for item in result if item[1][1] > text_threshold]
-        text = [item[1][0] for item in result if item[1][1] > text_threshold]
-    else:  # EasyOCR
-        if easyocr_args is None:
-            easyocr_args = {}
-        result = reader.readtext(image_np, **easyocr_args)
-        coord = [item[0] for item in result]
-        text = [item[1] for item in result]
+    if ocr_engine is None:
+        ocr_engine = get_default_ocr_engine(use_paddleocr)
+    if regions is None:
+        coord, text = ocr_engine.recognize(image_np, easyocr_args, cache=ocr_cache)
+    else:
+        coord, text = ocr_engine.recognize_regions(image_np, regions, easyocr_args, cache=ocr_cache)
     if display_img:
         opencv_img = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
         bb = []
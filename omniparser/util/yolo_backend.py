@@ -0,0 +1,111 @@
+"""
+Icon detector backends with warm-up and fixed input-size buckets.
+
+The PyTorch YOLO model pays graph / allocator set-up costs on its first
+predict calls, and exported runtimes (ONNX Runtime, TorchScript, OpenVINO)
+are compiled for a single static input shape. `YoloDetector` keeps one
+model per input-size bucket, exporting it on first use next to the weights
+(`model_640.onnx`, ...), and maps every request onto a bucket so screenshots
+of the same resolution always hit the same compiled graph. It has the
+`predict` signature of an Ultralytics YOLO model, so `predict_yolo` works
+with either.
+"""
+import os
+import threading
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+BACKENDS = ('pytorch', 'onnx', 'torchscript', 'openvino')
+EXPORT_SUFFIXES = {'onnx': '.onnx', 'torchscript': '.torchscript', 'openvino': '_openvino_model'}
+
+
+class YoloDetector:
+    """
+    Attributes:
+        model_path (str): path of the PyTorch weights (model.pt)
+        backend (str): one of BACKENDS
+        imgsz_buckets (List[int]): allowed square input sizes, ascending; the first one is the default
+        device (Optional[str]): inference device passed to predict, None lets Ultralytics choose
+    """
+
+    def __init__(self, model_path: str, backend: str = 'pytorch', imgsz_buckets: Optional[Iterable[int]] = None, device: Optional[str] = None):
+        from ultralytics import YOLO
+        if backend not in BACKENDS:
+            raise ValueError(f'unknown yolo backend {backend!r}, expected one of {BACKENDS}')
+        self.model_path = model_path
+        self.backend = backend
+        self.device = device
+        self._pytorch_model = YOLO(model_path)
+        if not imgsz_buckets:
+            imgsz = self._pytorch_model.overrides.get('imgsz', 640)
+            imgsz_buckets = [max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz]
+        self.imgsz_buckets = sorted(int(size) for size in imgsz_buckets)
+        self._models: Dict[int, object] = {}
+        self._lock = threading.Lock()
+
+    def bucket_for(self, imgsz: Union[int, Sequence[int], None]) -> int:
+        """Smallest bucket that holds the longest side of `imgsz`, the largest bucket for bigger inputs."""
+        if imgsz is None:
+            return self.imgsz_buckets[0]
+        longest = max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+        for bucket in self.imgsz_buckets:
+            if longest <= bucket:
+                return bucket
+        return self.imgsz_buckets[-1]
+
+    @staticmethod
+    def source_size(source) -> Optional[int]:
+        """Longest side of a PIL image, HxWxC array or image path (the largest one for a list), None when unknown."""
+        if isinstance(source, (list, tuple)):
+            sizes = [size for size in (YoloDetector.source_size(item) for item in source) if size]
+            return max(sizes) if sizes else None
+        if isinstance(source, Image.Image):
+            return max(source.size)
+        if isinstance(source, np.ndarray):
+            return max(source.shape[:2])
+        if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+            with Image.open(source) as image:
+                return max(image.size)
+        return None
+
+    def export_path(self, bucket: int) -> str:
+        root, _ = os.path.splitext(self.model_path)
+        return f'{root}_{bucket}{EXPORT_SUFFIXES[self.backend]}'
+
+    def model_for(self, bucket: int):
+        if self.backend == 'pytorch':
+            return self._pytorch_model
+        with self._lock:
+            if bucket not in self._models:
+                from ultralytics import YOLO
+                path = self.export_path(bucket)
+                if not os.path.exists(path):
+                    print(f'exporting {self.model_path} to {self.backend} at imgsz {bucket}...')
+                    # exports land next to the weights under a fixed name, rename so buckets do not overwrite each other
+                    exported = YOLO(self.model_path).export(format=self.backend, imgsz=bucket, dynamic=False, batch=1)
+                    os.replace(exported, path)
+                self._models[bucket] = YOLO(path, task='detect')
+            return self._models[bucket]
+
+    def predict(self, source, conf: float = 0.25, iou: float = 0.7, imgsz: Union[int, Sequence[int], None] = None, **kwargs):
+        """Ultralytics predict on the bucket for `imgsz`, or for the size of the source frame when imgsz is None."""
+        bucket = self.bucket_for(imgsz if imgsz is not None else self.source_size(source))
+        model = self.model_for(bucket)
+        if self.device is not None:
+            kwargs.setdefault('device', self.device)
+        if self.backend != 'pytorch' and isinstance(source, list) and len(source) > 1:
+            # exported graphs are compiled for batch 1
+            results = []
+            for image in source:
+                results.extend(model.predict(source=image, conf=conf, iou=iou, imgsz=bucket, **kwargs))
+            return results
+        return model.predict(source=source, conf=conf, iou=iou, imgsz=bucket, **kwargs)
+
+    def warmup(self, sizes: Iterable[Tuple[int, int]] = ((1920, 1080),), runs: int = 2):
+        """Run blank frames of the given (width, height) through the bucket each size maps to, so the first real step is not the slow one."""
+        for width, height in sizes:
+            frame = Image.fromarray(np.full((height, width, 3), 255, dtype=np.uint8))
+            for _ in range(runs):
+                self.predict(source=frame, conf=0.05, iou=0.1, verbose=False)
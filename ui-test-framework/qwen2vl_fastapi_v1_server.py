@@ -8,6 +8,7 @@ qwen2vl_webapp_analyzer.py의 기능을 그대로 유지하면서
 import base64
 import io
 import os
+import sys
 import torch
 import time
 import subprocess
@@ -22,6 +23,10 @@ from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
 import requests
 from io import BytesIO
 
+# 추론 실행기는 omniparser 서버와 같은 omniparser/util/inference_executor.py를 사용합니다
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "omniparser"))
+from util.inference_executor import InferenceExecutor, InferenceBusy
+
 # 화면 스크린샷을 위한 라이브러리
 try:
     import pyautogui
@@ -274,6 +279,11 @@ class WebAppAnalyzer:
 # 전역 분석기 초기화
 analyzer = None
 
+# 추론 실행기: 분석은 워커 1개에서 순서대로 실행, 대기 요청이 MAX_PENDING_REQUESTS를 넘으면 503
+INFERENCE_WORKERS = 1
+MAX_PENDING_REQUESTS = 4
+inference_executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_pending=MAX_PENDING_REQUESTS, name="qwen2vl")
+
 @app.on_event("startup")
 async def startup_event():
     """서버 시작 시 모델 로드"""
@@ -306,7 +316,8 @@ async def health_check():
     return {
         "status": "healthy" if analyzer is not None else "not_ready",
         "model_loaded": analyzer is not None,
-        "device": analyzer.device if analyzer else "unknown"
+        "device": analyzer.device if analyzer else "unknown",
+        "inference": inference_executor.stats()
     }
 
 @app.post("/analyze", response_model=ImageAnalysisResponse)
@@ -347,9 +358,11 @@ async def analyze_image(request: ImageAnalysisRequest):
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"이미지 디코딩 실패: {str(e)}")
         
-        # webapp analyzer와 동일한 분석 실행
+        # webapp analyzer와 동일한 분석 실행 (이벤트 루프를 막지 않도록 추론 워커에서 실행)
         try:
-            result = analyzer.analyze_webapp_screenshot(image, request.user_context)
+            result = await inference_executor.run(analyzer.analyze_webapp_screenshot, image, request.user_context)
+        except InferenceBusy as e:
+            raise HTTPException(status_code=503, detail=f"추론 대기열이 가득 찼습니다: {e}", headers={"Retry-After": "1"})
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"이미지 분석 실패: {str(e)}")
         
@@ -398,7 +411,9 @@ async def analyze_screenshot(request: ScreenshotAnalysisRequest):
         
         # 2. Qwen2VL로 스크린샷 분석
         try:
-            result = analyzer.analyze_webapp_screenshot(screenshot, request.context)
+            result = await inference_executor.run(analyzer.analyze_webapp_screenshot, screenshot, request.context)
+        except InferenceBusy as e:
+            raise HTTPException(status_code=503, detail=f"추론 대기열이 가득 찼습니다: {e}", headers={"Retry-After": "1"})
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"이미지 분석 실패: {str(e)}")
         
@@ -411,6 +426,8 @@ async def analyze_screenshot(request: ScreenshotAnalysisRequest):
             processing_time=processing_time
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"서버 스크린샷 분석 실패: {str(e)}"
         print(f"❌ {error_msg}")
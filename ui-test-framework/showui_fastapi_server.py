@@ -2,6 +2,7 @@ import ast
 import base64
 import io
 import os
+import sys
 import time
 import traceback
 from io import BytesIO
@@ -18,6 +19,10 @@ from pydantic import BaseModel
 from qwen_vl_utils import process_vision_info
 from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
 
+# 추론 실행기는 omniparser 서버와 같은 omniparser/util/inference_executor.py를 사용합니다
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "omniparser"))
+from util.inference_executor import InferenceExecutor, InferenceBusy
+
 # 화면 클릭을 위한 라이브러리
 try:
     import pyautogui
@@ -77,6 +82,7 @@ class HealthResponse(BaseModel):
     model_loaded: bool
     gpu_available: bool
     timestamp: str
+    inference: Optional[Dict[str, Any]] = None  # 추론 워커 / 대기열 상태
 
 class BrowserInfo(BaseModel):
     """브라우저 정보 모델"""
@@ -135,6 +141,12 @@ min_pixels = 256*28*28
 max_pixels = 1344*28*28
 size = {"shortest_edge": min_pixels, "longest_edge": max_pixels}
 
+# 추론 실행기: 모델 호출은 워커 1개에서 순서대로 실행 (GPU 하나당 한 번에 하나)
+# 대기 요청이 MAX_PENDING_REQUESTS를 넘으면 503으로 거절
+INFERENCE_WORKERS = 1
+MAX_PENDING_REQUESTS = 8
+inference_executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_pending=MAX_PENDING_REQUESTS, name="showui")
+
 # 결과 이미지 저장 디렉토리
 RESULTS_DIR = Path("results")
 RESULTS_DIR.mkdir(exist_ok=True)
@@ -274,6 +286,69 @@ def init_model():
         traceback.print_exc()
         is_model_loaded = False
 
+def run_showui_inference(image: Image.Image, query: str) -> str:
+    """
+    ShowUI 모델 추론 (블로킹) - 추론 워커 스레드에서 실행됨
+    
+    Returns:
+        str: 모델 출력 텍스트 (예: "[0.52, 0.31]")
+    """
+    # 메시지 구성
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": _SYSTEM},
+                {"type": "image", "image": image, "min_pixels": min_pixels, "max_pixels": max_pixels},
+                {"type": "text", "text": query}
+            ],
+        }
+    ]
+
+    # 텍스트 템플릿 적용
+    text = processor.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True,
+    )
+
+    # 이미지 및 비디오 입력 처리
+    image_inputs, video_inputs = process_vision_info(messages)
+
+    # 모델 입력 준비
+    inputs = processor(
+        text=[text],
+        images=image_inputs,
+        videos=video_inputs,
+        padding=True,
+        return_tensors="pt",
+    )
+
+    # GPU 사용 시 입력을 GPU로 이동
+    device = next(model.parameters()).device
+    inputs = inputs.to(device)
+
+    # 모델 추론
+    with torch.no_grad():
+        generated_ids = model.generate(
+            **inputs, 
+            max_new_tokens=128,
+            do_sample=True,
+            temperature=0.1,
+            top_p=0.9,
+            repetition_penalty=1.05
+        )
+
+    # 생성된 토큰만 추출
+    generated_ids_trimmed = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    ]
+
+    # 텍스트 디코딩
+    output_text = processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )[0]
+    
+    return output_text
+
 # =============================================================================
 # API 엔드포인트들
 # =============================================================================
@@ -299,7 +374,8 @@ async def health_check():
         status="healthy" if is_model_loaded else "model_not_loaded",
         model_loaded=is_model_loaded,
         gpu_available=torch.cuda.is_available(),
-        timestamp=time.strftime("%Y-%m-%d %H:%M:%S")
+        timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
+        inference=inference_executor.stats()
     )
 
 @app.post("/find_click_position", response_model=ClickResponse)
@@ -324,59 +400,11 @@ async def find_click_position(request: ClickRequest):
         print(f"📏 이미지 크기: {image.width} × {image.height}")
         print(f"🎯 분석 대상: {request.query}")
         
-        # 메시지 구성
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": _SYSTEM},
-                    {"type": "image", "image": image, "min_pixels": min_pixels, "max_pixels": max_pixels},
-                    {"type": "text", "text": request.query}
-                ],
-            }
-        ]
-        
-        # 텍스트 템플릿 적용
-        text = processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True,
-        )
-        
-        # 이미지 및 비디오 입력 처리
-        image_inputs, video_inputs = process_vision_info(messages)
-        
-        # 모델 입력 준비
-        inputs = processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        
-        # GPU 사용 시 입력을 GPU로 이동
-        device = next(model.parameters()).device
-        inputs = inputs.to(device)
-        
-        # 모델 추론
-        with torch.no_grad():
-            generated_ids = model.generate(
-                **inputs, 
-                max_new_tokens=128,
-                do_sample=True,
-                temperature=0.1,
-                top_p=0.9,
-                repetition_penalty=1.05
-            )
-        
-        # 생성된 토큰만 추출
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        
-        # 텍스트 디코딩
-        output_text = processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
+        # 모델 추론 (이벤트 루프를 막지 않도록 추론 워커에서 실행)
+        try:
+            output_text = await inference_executor.run(run_showui_inference, image, request.query)
+        except InferenceBusy as e:
+            raise HTTPException(status_code=503, detail=f"추론 대기열이 가득 찼습니다: {e}", headers={"Retry-After": "1"})
         
         print(f"모델 출력: {output_text}")
         
@@ -486,6 +514,8 @@ async def upload_and_find(
         
         return await find_click_position(request)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"파일 처리 실패: {str(e)}")
 